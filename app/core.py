@@ -7,9 +7,18 @@ import os
 
 from .transcoder import transcoder
 from .log import logger, getLogs
-from .utils import checkArgs, checkUser, addCache, getUID
-from .dbHelper import getSqlConnection, r_runningThreads, configData
+from .utils import (
+    checkArgs,
+    checkUser,
+    addCache,
+    getUID,
+    conditionalGet,
+    bumpLibraryVersion,
+    getPageArgs,
+)
+from .dbHelper import getSqlConnection, getSqlPoolStats, r_runningThreads, configData
 from .indexer import scanner
+from .search import searchMedia, searchPeople, getLinkedMedia
 
 core = Blueprint("core", __name__)
 
@@ -96,6 +105,12 @@ def getThreadsStatus():
     )
 
 
+@core.route("core/db/stats", methods=["GET"])
+def getDatabaseStats():
+    checkUser("admin")
+    return jsonify({"status": "ok", "data": getSqlPoolStats()})
+
+
 @core.route("core/log", methods=["GET"])
 @core.route("core/log/<int:amount>", methods=["GET"])
 def getServerLogs(amount: int):
@@ -171,11 +186,13 @@ def runPeopleScan():
     r_runningThreads.set("people", 1)
     sqlConnection = getSqlConnection(False)
     scanner(sqlConnection, "people", configData["api"]).getObject().scan()
+    bumpLibraryVersion()
     r_runningThreads.set("people", 0)
     sqlConnection.close()
 
 
 @core.route("person/<int:mediaType>/<mediaData>", methods=["GET"])
+@conditionalGet
 def getPeopleFromMedia(mediaType: int, mediaData: str):
     sqlConnection, cursor = getSqlConnection()
     cursor.execute(
@@ -194,6 +211,7 @@ def getPeopleFromMedia(mediaType: int, mediaData: str):
 
 
 @core.route("person/letter/<letter>", methods=["GET"])
+@conditionalGet
 def getPeopleFromLetter(letter: str):
     sqlConnection, cursor = getSqlConnection()
     cursor.execute(
@@ -208,20 +226,17 @@ def getPeopleFromLetter(letter: str):
 
 
 @core.route("person/name/<name>", methods=["GET"])
+@conditionalGet
 def getPeopleFromName(name: str):
+    limit, offset = getPageArgs()
     sqlConnection, cursor = getSqlConnection()
-    cursor.execute(
-        "SELECT DISTINCT idPers AS id, name, gender, birthdate, deathdate, description, known_for, CONCAT('/api/core/image/',icon) AS icon "
-        "FROM people "
-        "WHERE name LIKE %(name)s;",
-        {"name": "%" + name + "%"},
-    )
-    res = cursor.fetchall()
+    res = searchPeople(cursor, name, limit, offset)
     sqlConnection.close()
     return jsonify({"status": "ok", "data": res})
 
 
 @core.route("person/<int:id>", methods=["GET"])
+@conditionalGet
 def getPersonFromID(id: int):
     sqlConnection, cursor = getSqlConnection()
     cursor.execute(
@@ -236,6 +251,7 @@ def getPersonFromID(id: int):
 
 
 @core.route("tag/<int:mediaType>/<mediaData>", methods=["GET"])
+@conditionalGet
 def getTagsFromMedia(mediaType: int, mediaData: str):
     sqlConnection, cursor = getSqlConnection()
     cursor.execute(
@@ -254,6 +270,7 @@ def getTagsFromMedia(mediaType: int, mediaData: str):
 
 
 @core.route("tag/category", methods=["GET"])
+@conditionalGet
 def getTagCategories():
     sqlConnection, cursor = getSqlConnection()
     cursor.execute("SELECT DISTINCT name FROM tags")
@@ -263,6 +280,7 @@ def getTagCategories():
 
 
 @core.route("tag/category/<catg>", methods=["GET"])
+@conditionalGet
 def getTagsFromCategory(catg: str):
     sqlConnection, cursor = getSqlConnection()
     cursor.execute(
@@ -279,6 +297,7 @@ def getTagsFromCategory(catg: str):
 
 
 @core.route("tag/<int:id>", methods=["GET"])
+@conditionalGet
 def getTagFromID(id: str):
     sqlConnection, cursor = getSqlConnection()
     cursor.execute(
@@ -299,40 +318,49 @@ def search_main():
     reqData = json.loads(request.data)
     reqData.update(request.args)
 
-    # tag[], person[], name, date
+    # tag[], person[], name, date, limit, offset
 
-    name = []
-    person = []
-    tag = []
-    date = []
-    sqlConnection, cursor = getSqlConnection()
+    allowedTypes = []
+    if checkUser("allowTvs", False):
+        allowedTypes += [1, 2]
+    if checkUser("allowMovie", False):
+        allowedTypes.append(3)
 
     mode = "OR"
     if "andMode" in reqData and reqData["andMode"]:
         mode = "AND"
+    limit, offset = getPageArgs(reqData)
+
+    sqlConnection, cursor = getSqlConnection()
+    # set of (mediaType, idMedia) for each filter
+    filters = []
+    scores = {}
 
     if "tag" in reqData:
-        args = buildArgsRequest(reqData["tag"], "idTag", mode)
-        if args != "":
-            cursor.execute("SELECT idMedia, mediaType FROM tags_link WHERE" + args)
-            tag += [(x["mediaType"], x["idMedia"]) for x in cursor.fetchall()]
+        filters.append(
+            getLinkedMedia(
+                cursor, "tags_link", "idTag", _getIds(reqData["tag"]), mode == "AND"
+            )
+        )
 
     if "person" in reqData:
-        args = buildArgsRequest(reqData["person"], "idPers", mode)
-        if args != "":
-            cursor.execute("SELECT idMedia, mediaType FROM people_link WHERE" + args)
-            person += [(x["mediaType"], x["idMedia"]) for x in cursor.fetchall()]
-
-    if "name" in reqData:
-        cursor.execute(
-            'SELECT 1 AS "mediaType", idEpisode AS "mediaData" FROM episodes WHERE title LIKE %(like)s '
-            "UNION "
-            'SELECT 2 AS "mediaType", idShow AS "mediaData" FROM tv_shows WHERE title LIKE %(like)s '
-            "UNION "
-            'SELECT 3 AS "mediaType", idMovie AS "mediaData" FROM movies WHERE title LIKE %(like)s ',
-            {"like": "%" + str(reqData["name"]) + "%"},
+        filters.append(
+            getLinkedMedia(
+                cursor,
+                "people_link",
+                "idPers",
+                _getIds(reqData["person"]),
+                mode == "AND",
+            )
         )
-        name = [(x["mediaType"], x["mediaData"]) for x in cursor.fetchall()]
+
+    if "name" in reqData and len(allowedTypes) > 0:
+        # the matches are only cut when no other filter is intersected with them
+        maxResults = None
+        if len(filters) == 0 and "date" not in reqData:
+            maxResults = configData["config"].get("searchMaxResults", 1000)
+        scores = searchMedia(cursor, reqData["name"], allowedTypes, maxResults)
+        filters.append(set(scores))
 
     if "date" in reqData:
         operator = "="
@@ -352,61 +380,33 @@ def search_main():
             + " %(data)s ",
             data,
         )
-        date = [(x["mediaType"], x["mediaData"]) for x in cursor.fetchall()]
+        filters.append(set((x["mediaType"], x["mediaData"]) for x in cursor.fetchall()))
 
     sqlConnection.close()
 
-    results = []
-    res = name + date + person + tag
-    allowedTypes = []
+    results = set()
+    if len(filters) > 0:
+        if mode == "OR":
+            results = set.union(*filters)
+        else:
+            results = set.intersection(*filters)
+    results = [i for i in results if i[0] in allowedTypes]
+    # best matches of the name first
+    results.sort(key=lambda i: (-scores.get(i, 0), i))
 
-    if checkUser("allowTvs", False):
-        allowedTypes += [1, 2]
-    if checkUser("allowMovie", False):
-        allowedTypes.append(3)
+    return jsonify(
+        {
+            "status": "ok",
+            "data": results[offset : offset + limit],
+            "total": len(results),
+        }
+    )
 
-    if mode == "OR":
-        for i in res:
-            if i[0] in allowedTypes and i not in results:
-                results.append(i)
-    else:
-        check = []
-        if len(name) > 0:
-            check.append(name)
-        if len(date) > 0:
-            check.append(date)
-        if len(tag) > 0:
-            check.append(tag)
-        if len(person) > 0:
-            check.append(person)
-
-        for i in res:
-            if i[0] in allowedTypes and i not in results:
-                ok = True
-                for c in check:
-                    if i not in c:
-                        ok = False
-                if ok:
-                    results.append(i)
-
-    return jsonify({"status": "ok", "data": results})
-
-
-def buildArgsRequest(data, field, mode):
-    args = ""
-    first = True
-    if type(data) is list:
-        for t in data:
-            if type(t) != int and not t.isdigit():
-                abort(400)
-            if first:
-                args = " " + field + " = " + str(t)
-                first = False
-            else:
-                args += " " + mode + " " + field + " = " + str(t)
-    else:
-        if type(data) != int and not data.isdigit():
-            abort(400)
-        args = " " + field + " = " + str(data)
 
-    return args
+def _getIds(data) -> list:
+    if type(data) is not list:
+        data = [data]
+    for t in data:
+        if type(t) != int and not t.isdigit():
+            abort(400)
+    return data
@@ -1,19 +1,207 @@
-from mysql.connector.pooling import MySQLConnectionPool
+import mysql.connector
+from mysql.connector.errors import PoolError
 import redis
 import json
+import time
+import threading
+import collections
+from flask import g, has_request_context
 from .log import logger
 
 with open("config/config.json") as f:
     configData = json.load(f)
     logger.info("Configuration loaded")
 
-_sqlPool = MySQLConnectionPool(
-    pool_name="zogwine",
-    pool_reset_session=False,
-    **configData["db"],
-    use_unicode=True,
-    charset="utf8",
-    pool_size=10
+
+class pymysqlConnection:
+    # gives a PyMySQL connection (pure python, cooperative with gevent) the
+    # mysql.connector interface used by the app
+    def __init__(self, **config):
+        import pymysql
+
+        self._connection = pymysql.connect(**config, charset="utf8", autocommit=False)
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def cursor(self, dictionary=False, buffered=True):
+        # PyMySQL cursors are always buffered
+        import pymysql.cursors
+
+        if dictionary:
+            return self._connection.cursor(pymysql.cursors.DictCursor)
+        return self._connection.cursor()
+
+    @property
+    def in_transaction(self) -> bool:
+        from pymysql.constants.SERVER_STATUS import SERVER_STATUS_IN_TRANS
+
+        return bool(self._connection.server_status & SERVER_STATUS_IN_TRANS)
+
+    def ping(self, reconnect=True, attempts=1):
+        self._connection.ping(reconnect)
+
+
+class pooledConnection:
+    # connection taken from a sqlPool, close() gives it back to the pool
+    def __init__(self, pool, connection):
+        self._pool = pool
+        self._connection = connection
+
+    def __getattr__(self, name):
+        if self._connection is None:
+            raise PoolError("Connection already returned to the pool")
+        return getattr(self._connection, name)
+
+    def close(self):
+        if self._connection is not None:
+            connection = self._connection
+            self._connection = None
+            self._pool.release(connection)
+
+    def __del__(self):
+        # the connection was not closed, it is given back on the next use of the pool
+        # (no lock can be taken here, the garbage collector may run while it is held)
+        if self._connection is not None:
+            self._pool.leak(self._connection)
+            self._connection = None
+
+
+class sqlPool:
+    def __init__(
+        self, driver: str, size: int, timeout: float, pingInterval: float, **config
+    ):
+        self._driver = driver
+        self._config = config
+        self._size = size
+        self._timeout = timeout
+        self._pingInterval = pingInterval
+        self._idle = collections.deque()
+        # connections of the garbage collected pooledConnection, appending is lock-free
+        self._leaked = collections.deque()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._stats = {
+            "checkouts": 0,
+            "waits": 0,
+            "timeouts": 0,
+            "created": 0,
+            "reconnects": 0,
+            "leaked": 0,
+            "waitTime": 0.0,
+            "maxWaitTime": 0.0,
+        }
+        self._inUse = 0
+
+    def _count(self, name: str):
+        # the stats are updated by concurrent requests
+        with self._lock:
+            self._stats[name] += 1
+
+    @staticmethod
+    def _close(connection):
+        # close a broken connection, without failing on its already closed socket
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def _connect(self):
+        self._count("created")
+        if self._driver == "pymysql":
+            return pymysqlConnection(**self._config)
+        return mysql.connector.connect(**self._config, use_unicode=True, charset="utf8")
+
+    def get_connection(self) -> pooledConnection:
+        # wait up to timeout seconds for a free connection
+        self._releaseLeaked()
+        start = time.monotonic()
+        if not self._slots.acquire(blocking=False):
+            self._count("waits")
+            if not self._slots.acquire(timeout=self._timeout):
+                self._count("timeouts")
+                raise PoolError(
+                    "No SQL connection available after " + str(self._timeout) + "s"
+                )
+        wait = time.monotonic() - start
+
+        try:
+            with self._lock:
+                idle = self._idle.pop() if len(self._idle) > 0 else None
+            if idle is None:
+                connection = self._connect()
+            else:
+                connection, lastUsed = idle
+                if time.monotonic() - lastUsed > self._pingInterval:
+                    # the server may have closed an idle connection
+                    try:
+                        connection.ping(reconnect=True, attempts=1)
+                    except Exception:
+                        self._count("reconnects")
+                        self._close(connection)
+                        connection = self._connect()
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._inUse += 1
+            self._stats["checkouts"] += 1
+            self._stats["waitTime"] += wait
+            self._stats["maxWaitTime"] = max(self._stats["maxWaitTime"], wait)
+        return pooledConnection(self, connection)
+
+    def release(self, connection):
+        self._release(connection)
+        self._releaseLeaked()
+
+    def leak(self, connection):
+        self._leaked.append(connection)
+
+    def _releaseLeaked(self):
+        while True:
+            try:
+                connection = self._leaked.popleft()
+            except IndexError:
+                return
+            self._release(connection, True)
+
+    def _release(self, connection, leaked: bool = False):
+        try:
+            if connection.in_transaction:
+                # do not give uncommitted changes to the next user
+                connection.rollback()
+            with self._lock:
+                self._idle.append((connection, time.monotonic()))
+        except Exception:
+            # the connection is broken, it is not reused
+            self._close(connection)
+        with self._lock:
+            self._inUse -= 1
+            if leaked:
+                self._stats["leaked"] += 1
+        self._slots.release()
+
+    def getStats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update(
+                {
+                    "size": self._size,
+                    "inUse": self._inUse,
+                    "idle": len(self._idle),
+                    "avgWaitTime": stats["waitTime"] / max(stats["checkouts"], 1),
+                }
+            )
+        return stats
+
+
+_sqlPool = sqlPool(
+    configData["config"].get("dbDriver", "mysql-connector"),
+    configData["config"].get("sqlPoolSize", 10),
+    configData["config"].get("sqlPoolTimeout", 10),
+    configData["config"].get("sqlPingInterval", 30),
+    **configData["db"]
 )
 
 r_userTokens = redis.Redis(
@@ -36,6 +224,11 @@ r_remotePlayer = redis.Redis(
     port=configData["redis"]["port"],
     db=configData["redis"]["remotePlayerDB"],
 )
+r_cache = redis.Redis(
+    host=configData["redis"]["host"],
+    port=configData["redis"]["port"],
+    db=configData["redis"].get("cacheDB", 5),
+)
 
 """
 r_userFiles: contains data about the media currently used by the user
@@ -47,7 +240,12 @@ r_userFiles: contains data about the media currently used by the user
         "pid": ffmpeg process pid,
         "outDir": output dir,
         "logFile": transcode log file path,
-        "classData": transcoder class data
+        "progress": key of the ffmpeg progress in r_cache,
+        "onDemand": segments are encoded when requested,
+        "playlist": playlist file name,
+        "firstSegment": segment to wait for before starting playback,
+        "classData": transcoder class data,
+        "cacheKey": key of the shared encode in r_cache (pid, logFile, progress and classData are then stored there)
     },
     "device": device-related data [dict, optionnal]
     {
@@ -59,8 +257,22 @@ r_userFiles: contains data about the media currently used by the user
 
 def getSqlConnection(with_cursor=True):
     sqlConnection = _sqlPool.get_connection()
-    sqlConnection.connect()
+    if has_request_context():
+        # closed at the end of the request if the handler forgot to
+        if "sqlConnections" not in g:
+            g.sqlConnections = []
+        g.sqlConnections.append(sqlConnection)
     if not with_cursor:
         return sqlConnection
     cursor = sqlConnection.cursor(dictionary=True, buffered=True)
     return (sqlConnection, cursor)
+
+
+def closeSqlConnections():
+    # close the connections of the current request that are still open
+    for sqlConnection in g.pop("sqlConnections", []):
+        sqlConnection.close()
+
+
+def getSqlPoolStats() -> dict:
+    return _sqlPool.getStats()
@@ -15,6 +15,7 @@ class PlayerBase(ABC):
         skipInit: bool = False,
     ):
         self._address = address
+        self._uid = uid
 
     @abstractmethod
     def playMedia(self, mediaType: int, mediaData: int, data: dict = None) -> tuple:
@@ -41,6 +41,7 @@ class chromecast(PlayerBase):
         obj = transcoder(int(mediaType), int(mediaData))
         obj.enableHLS(True)
         obj.configure(data)
+        obj.setSession(uid=self._uid)
         return {}, obj.start()
 
     def doWork(self):
@@ -1,4 +1,3 @@
-import requests
 import os
 import time
 import json
@@ -6,6 +5,7 @@ import json
 from app.devices.PlayerBase import PlayerBase
 from app.transcoder import transcoder
 from app.dbHelper import configData
+from app.httpClient import getSession
 from app.files import getOutputDir, getMediaFromUrl
 
 
@@ -36,7 +36,7 @@ class kodi(PlayerBase):
     @property
     def available(self) -> bool:
         try:
-            r = requests.post(
+            r = getSession("devices").post(
                 "http://" + self._address + ":" + self._port + "/jsonrpc",
                 data=json.dumps(
                     {
@@ -59,10 +59,11 @@ class kodi(PlayerBase):
         obj = transcoder(int(mediaType), int(mediaData))
         obj.enableHLS(True)
         obj.configure(data)
+        obj.setSession(uid=self._uid)
         return {}, obj.start()
 
     def _request(self, params):
-        return requests.post(
+        return getSession("devices").post(
             "http://" + self._address + ":" + self._port + "/jsonrpc",
             data=json.dumps(params),
             auth=self._auth,
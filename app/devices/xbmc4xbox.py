@@ -1,4 +1,3 @@
-import requests
 import time
 import urllib.parse
 import os
@@ -6,6 +5,7 @@ import os
 from app.devices.PlayerBase import PlayerBase
 from app.transcoder import transcoder
 from app.dbHelper import configData
+from app.httpClient import getSession
 from app.log import logger
 from app.files import getOutputDir, getMediaFromUrl
 
@@ -26,6 +26,7 @@ class xbmc4xbox(PlayerBase):
         self._token = token
         self._outDir = getOutputDir()
         self._endpoint = "http://" + str(address) + "/xbmcCmds/xbmcHttp?command="
+        self._session = getSession("devices")
         if user is not None and password is not None:
             self._auth = (str(user), str(password))
         else:
@@ -44,6 +45,7 @@ class xbmc4xbox(PlayerBase):
         obj = transcoder(int(mediaType), int(mediaData))
         obj.enableHLS(True)
         obj.configure(data)
+        obj.setSession(uid=self._uid)
         if int(obj._resize) > 720 or int(obj._resize) < 0:
             obj.resize(720)
         self._startData = obj.start()
@@ -57,10 +59,10 @@ class xbmc4xbox(PlayerBase):
 
         logger.info("STARTING XBMC4XBOX Player")
         logger.debug(
-            requests.get(self._endpoint + "ClearPlayList(1)", auth=self._auth).text
+            self._session.get(self._endpoint + "ClearPlayList(1)", auth=self._auth).text
         )
         logger.debug(
-            requests.get(
+            self._session.get(
                 self._endpoint
                 + "AddToPlayList("
                 + urllib.parse.quote(
@@ -71,9 +73,13 @@ class xbmc4xbox(PlayerBase):
             ).text
         )
         logger.debug(
-            requests.get(self._endpoint + "SetCurrentPlaylist(1)", auth=self._auth).text
+            self._session.get(
+                self._endpoint + "SetCurrentPlaylist(1)", auth=self._auth
+            ).text
+        )
+        logger.debug(
+            self._session.get(self._endpoint + "PlayNext()", auth=self._auth).text
         )
-        logger.debug(requests.get(self._endpoint + "PlayNext()", auth=self._auth).text)
 
         logger.debug("STARTING XBMC4XBOX Main Loop")
         prev = 0
@@ -90,7 +96,7 @@ class xbmc4xbox(PlayerBase):
             if int(num) > prev:
                 logger.debug("Add stream: " + num)
                 logger.debug(
-                    requests.get(
+                    self._session.get(
                         self._endpoint
                         + "AddToPlayList("
                         + urllib.parse.quote(
@@ -106,13 +112,13 @@ class xbmc4xbox(PlayerBase):
             dowork = self.activePid(self._startData["pid"])
 
     def seek(self, value: int):
-        data = requests.get(
+        data = self._session.get(
             self._endpoint + "GetCurrentlyPlaying", auth=self._auth
         ).text
         url = data[20 : data.find("\n", 20)]
         currentStream = int(url[url.find("/stream") + 7 : url.find(".ts?token=")])
 
-        data = requests.get(
+        data = self._session.get(
             self._endpoint + "GetPlaylistContents(1)", auth=self._auth
         ).text
         urls = data[12 : len(data) - 8].split("\n<li>")
@@ -121,51 +127,51 @@ class xbmc4xbox(PlayerBase):
 
         if value < configData["config"]["hlsTime"] * currentStream:
             for i in range(currentStream - posStream):
-                requests.get(self._endpoint + "PlayPrev()", auth=self._auth)
+                self._session.get(self._endpoint + "PlayPrev()", auth=self._auth)
         else:
             playlistNum = len(urls) - posStream
             if playlistNum < 0:
                 for i in range(len(urls) - 1 - currentStream):
-                    requests.get(self._endpoint + "PlayNext()", auth=self._auth)
+                    self._session.get(self._endpoint + "PlayNext()", auth=self._auth)
             else:
                 for i in range(posStream - currentStream):
-                    requests.get(self._endpoint + "PlayNext()", auth=self._auth)
+                    self._session.get(self._endpoint + "PlayNext()", auth=self._auth)
 
         percent = round(
             (value % configData["config"]["hlsTime"])
             / configData["config"]["hlsTime"]
             * 100
         )
-        requests.get(
+        self._session.get(
             self._endpoint + "SeekPercentage(" + str(percent) + ")", auth=self._auth
         )
 
     def play(self):
-        requests.get(self._endpoint + "Action(79)", auth=self._auth).text
+        self._session.get(self._endpoint + "Action(79)", auth=self._auth).text
 
     def pause(self):
-        requests.get(self._endpoint + "Pause()", auth=self._auth).text
+        self._session.get(self._endpoint + "Pause()", auth=self._auth).text
 
     def stop(self):
-        requests.get(self._endpoint + "Stop()", auth=self._auth).text
+        self._session.get(self._endpoint + "Stop()", auth=self._auth).text
 
     def mute(self):
-        requests.get(self._endpoint + "Mute()", auth=self._auth).text
+        self._session.get(self._endpoint + "Mute()", auth=self._auth).text
 
     def unmute(self):
-        requests.get(self._endpoint + "Mute()", auth=self._auth).text
+        self._session.get(self._endpoint + "Mute()", auth=self._auth).text
 
     def setVolume(self, value: int) -> bool:
         if value > 100 or value < 0:
             return False
-        requests.get(
+        self._session.get(
             self._endpoint + "SetVolume(" + str(value) + ")", auth=self._auth
         ).text
         return True
 
     @property
     def position(self) -> float:
-        data = requests.get(
+        data = self._session.get(
             self._endpoint + "GetCurrentlyPlaying", auth=self._auth
         ).text
         url = data[20 : data.find("\n", 20)]
@@ -181,7 +187,7 @@ class xbmc4xbox(PlayerBase):
 
     @property
     def loaded(self):
-        data = requests.get(
+        data = self._session.get(
             self._endpoint + "GetPlaylistContents(1)", auth=self._auth
         ).text
         urls = data[12 : len(data) - 8].split("\n<li>")
@@ -189,12 +195,12 @@ class xbmc4xbox(PlayerBase):
 
     @property
     def volume(self) -> int:
-        data = requests.get(self._endpoint + "GetVolume", auth=self._auth).text
+        data = self._session.get(self._endpoint + "GetVolume", auth=self._auth).text
         return int(data[11 : data.find("</html>")])
 
     @property
     def status(self) -> int:
-        data = requests.get(
+        data = self._session.get(
             self._endpoint + "GetCurrentlyPlaying", auth=self._auth
         ).text
         p = data.find("PlayStatus") + 11
@@ -209,7 +215,7 @@ class xbmc4xbox(PlayerBase):
 
     @property
     def playingMedia(self) -> tuple:
-        data = requests.get(
+        data = self._session.get(
             self._endpoint + "GetCurrentlyPlaying", auth=self._auth
         ).text
-        return getMediaFromUrl(data[20 : data.find("\n", 20)])
\ No newline at end of file
+        return getMediaFromUrl(data[20 : data.find("\n", 20)])
@@ -3,10 +3,12 @@ import json
 import re
 import os
 import base64
+from concurrent.futures import ThreadPoolExecutor
 
 from .dbHelper import getSqlConnection, configData, r_userFiles
 from .urlResolver import getInfos
 from .utils import getUID
+from .log import logger
 
 
 def _getSubtitleFilesList(filePath: bytes) -> list:
@@ -35,7 +37,97 @@ def getSubPathFromName(filePath: bytes, subFile: bytes) -> bytes:
     return filePath[: filePath.rfind(".")].encode("utf-8") + base64.b64decode(subFile)
 
 
-def _getFileInfos(path: bytes) -> dict:
+def _probeFile(path: bytes) -> dict:
+    proc = subprocess.run(
+        [
+            "ffprobe",
+            "-v",
+            "quiet",
+            "-print_format",
+            "json",
+            "-show_format",
+            "-show_streams",
+            path,
+        ],
+        stdout=subprocess.PIPE,
+    )
+    try:
+        return json.loads(proc.stdout.decode("utf-8"))
+    except ValueError:
+        return {}
+
+
+def _getFileKey(path: bytes) -> dict:
+    # a file is identified by its device, inode, size and mtime, so a renamed file is not probed again
+    st = os.stat(path)
+    return {
+        "dev": st.st_dev,
+        "inode": st.st_ino,
+        "size": st.st_size,
+        "mtime": st.st_mtime,
+    }
+
+
+def _getCachedProbe(cursor, key: dict) -> dict:
+    cursor.execute(
+        "SELECT data FROM probe_cache WHERE dev = %(dev)s AND inode = %(inode)s AND size = %(size)s AND mtime = %(mtime)s;",
+        key,
+    )
+    dat = cursor.fetchone()
+    if dat is None:
+        return None
+    return json.loads(dat["data"])
+
+
+def _setCachedProbe(cursor, key: dict, path: bytes, data: dict):
+    cursor.execute(
+        "INSERT INTO probe_cache (path, dev, inode, size, mtime, data) VALUES (%(path)s, %(dev)s, %(inode)s, %(size)s, %(mtime)s, %(data)s) ON DUPLICATE KEY UPDATE path = %(path)s, data = %(data)s;",
+        {
+            **key,
+            "path": path.decode("utf-8", "surrogateescape"),
+            "data": json.dumps(data),
+        },
+    )
+
+
+def probeFiles(paths: list, cursor=None) -> dict:
+    # probe multiple files concurrently, the results are stored in the probe cache
+    # (with the cursor of the caller, the caller commits)
+    sqlConnection = None
+    if cursor is None:
+        sqlConnection, cursor = getSqlConnection()
+    results = {}
+    toProbe = {}
+    for path in paths:
+        try:
+            key = _getFileKey(path)
+        except OSError:
+            continue
+        dat = _getCachedProbe(cursor, key)
+        if dat is None:
+            toProbe[path] = key
+        else:
+            results[path] = dat
+
+    if len(toProbe) > 0:
+        logger.info("Probing " + str(len(toProbe)) + " files")
+        with ThreadPoolExecutor(
+            max_workers=configData["config"].get("probeWorkers", 4)
+        ) as executor:
+            for path, dat in zip(toProbe, executor.map(_probeFile, toProbe)):
+                results[path] = dat
+                # a failed probe (ffprobe missing or killed, I/O error) is tried again next time
+                if dat:
+                    _setCachedProbe(cursor, toProbe[path], path, dat)
+        if sqlConnection is not None:
+            sqlConnection.commit()
+
+    if sqlConnection is not None:
+        sqlConnection.close()
+    return results
+
+
+def _getFileInfos(path: bytes, cursor) -> dict:
     fileName = path.decode("utf-8")[path.decode("utf-8").rindex("/") + 1 :].lower()
 
     stereo3d = 0
@@ -44,17 +136,9 @@ def _getFileInfos(path: bytes) -> dict:
     elif re.search("([. -_]?3d[. -_]?)|([. -_]?sbs[. -_]?)", fileName):
         stereo3d = 1
 
-    cmd = (
-        b'ffprobe -v quiet -print_format json -show_format -show_streams "'
-        + path
-        + b'"'
-    )
-    proc = subprocess.Popen(
-        cmd,
-        stdout=subprocess.PIPE,
-        shell=True,
-    )
-    dat = json.loads(proc.communicate()[0].decode("utf-8"))
+    dat = probeFiles([path], cursor).get(path)
+    if dat is None:
+        dat = _probeFile(path)
 
     data = {
         "extension": fileName[fileName.rfind(u".") + 1 :],
@@ -121,28 +205,34 @@ def _getFileInfos(path: bytes) -> dict:
     return data
 
 
-def addFile(file: bytes, mediaType: int) -> int:
+def getFullPath(file: bytes, mediaType: int) -> bytes:
     if mediaType == 1:
-        filePath = os.path.join(
+        return os.path.join(
             configData["config"]["contentPath"].encode(),
             configData["config"]["tvsPath"].encode(),
             file,
         )
     elif mediaType == 3:
-        filePath = os.path.join(
+        return os.path.join(
             configData["config"]["contentPath"].encode(),
             configData["config"]["moviePath"].encode(),
             file,
         )
     else:
+        return None
+
+
+def addFile(file: bytes, mediaType: int) -> int:
+    filePath = getFullPath(file, mediaType)
+    if filePath is None:
         return -1
 
-    infos = _getFileInfos(filePath)
+    sqlConnection, cursor = getSqlConnection()
+    infos = _getFileInfos(filePath, cursor)
     infos.update({u"mediaType": mediaType, u"path": file})
     infos.update({u"subtitles": json.dumps(infos[u"subtitles"])})
     infos.update({u"audio": json.dumps(infos[u"audio"])})
 
-    sqlConnection, cursor = getSqlConnection()
     cursor.execute(
         u"INSERT INTO video_files (mediaType, path, format, duration, extension, audio, subtitles, stereo3d, ratio, dimension, pix_fmt, video_codec, size) VALUES (%(mediaType)s, %(path)s, %(format)s, %(duration)s, %(extension)s, %(audio)s, %(subtitles)s, %(stereo3d)s, %(ratio)s, %(dimension)s, %(pix_fmt)s, %(video_codec)s, %(size)s)",
         infos,
@@ -0,0 +1,228 @@
+import time
+import json
+import hashlib
+import threading
+import requests
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from .dbHelper import configData, r_cache
+from .log import logger
+
+"""
+r_cache: responses of the scrapers apis
+    http:<hash of the url> : {"status", "text", "etag", "lastModified", "time": last validation}
+"""
+
+# default [requests per second, burst] for each api, can be changed with "apiRates" in the config
+_defaultRates = {"tmdb": [20, 40], "tvdb": [10, 20]}
+# default time (s) during which a cached response is used without revalidation, see "apiCacheTTL"
+_defaultTTL = {"tmdb": 86400, "tvdb": 86400, "fillers": 604800}
+# cached responses are kept this many times their ttl, to be revalidated with the server
+_keepFactor = 10
+# maximum wait (s) requested by a rate limited api
+_maxRetryAfter = 60
+
+
+class tokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self._rate = float(rate)
+        self._burst = float(burst)
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        # wait until a request can be sent
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self._burst, self._tokens + (now - self._last) * self._rate
+                )
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self._rate
+            time.sleep(wait)
+
+
+class timeoutSession(requests.Session):
+    # session with a default timeout for its requests
+    def __init__(self, timeout: float):
+        super().__init__()
+        self._timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self._timeout)
+        return super().request(method, url, **kwargs)
+
+
+_sessions = {}
+_sessionsLock = threading.Lock()
+
+
+def getSession(name: str, timeout: float = None) -> requests.Session:
+    # returns the shared keep-alive session for an api or a kind of device
+    # (the default timeout is httpTimeout)
+    with _sessionsLock:
+        if name not in _sessions:
+            session = timeoutSession(
+                timeout or configData["config"].get("httpTimeout", 10)
+            )
+            poolSize = max(
+                configData["config"].get("httpPoolSize", 10),
+                configData["config"].get("scraperWorkers", 8),
+            )
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=poolSize, pool_maxsize=poolSize
+            )
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _sessions[name] = session
+        return _sessions[name]
+
+
+_buckets = {}
+_bucketsLock = threading.Lock()
+
+
+def _getBucket(api: str) -> tokenBucket:
+    with _bucketsLock:
+        if api not in _buckets:
+            rate = configData["config"].get("apiRates", {}).get(api)
+            if rate is None:
+                rate = _defaultRates.get(api)
+            _buckets[api] = tokenBucket(*rate) if rate is not None else None
+        return _buckets[api]
+
+
+def _request(api: str, method: str, url: str, **kwargs) -> requests.Response:
+    bucket = _getBucket(api)
+    for i in range(3):
+        if bucket is not None:
+            bucket.acquire()
+        resp = getSession(api).request(method, url, **kwargs)
+        if resp.status_code != 429:
+            break
+        # rate limited anyway, wait for the time requested by the api
+        wait = _getRetryAfter(resp.headers.get("Retry-After"))
+        logger.warning("Rate limited by " + api + ", waiting " + str(wait) + "s")
+        time.sleep(wait)
+    return resp
+
+
+def _getRetryAfter(value: str) -> float:
+    # Retry-After is a number of seconds or an HTTP date
+    if value is None:
+        return 1
+    try:
+        wait = float(value)
+    except ValueError:
+        try:
+            wait = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            wait = 1
+    return min(max(wait, 0), _maxRetryAfter)
+
+
+_pending = {}
+_pendingLock = threading.Lock()
+
+
+def _getTTL(api: str) -> int:
+    ttl = configData["config"].get("apiCacheTTL", {}).get(api)
+    if ttl is None:
+        ttl = _defaultTTL.get(api, 0)
+    return ttl
+
+
+def _toResponse(url: str, data: dict) -> requests.Response:
+    resp = requests.Response()
+    resp.url = url
+    resp.status_code = data["status"]
+    resp.encoding = "utf-8"
+    resp._content = data["text"].encode("utf-8")
+    return resp
+
+
+def _fetch(api: str, key: str, url: str, ttl: int, **kwargs) -> requests.Response:
+    cached = r_cache.get(key)
+    if cached is not None:
+        cached = json.loads(cached)
+        if cached["time"] + ttl > time.time():
+            return _toResponse(url, cached)
+        # revalidate the cached response
+        headers = dict(kwargs.pop("headers", None) or {})
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("lastModified"):
+            headers["If-Modified-Since"] = cached["lastModified"]
+        kwargs["headers"] = headers
+
+    resp = _request(api, "GET", url, **kwargs)
+    if resp.status_code == 304 and cached is not None:
+        data = cached
+    elif resp.status_code == 200:
+        data = {
+            "status": resp.status_code,
+            "text": resp.text,
+            "etag": resp.headers.get("ETag"),
+            "lastModified": resp.headers.get("Last-Modified"),
+        }
+    else:
+        return resp
+    data["time"] = time.time()
+    r_cache.set(key, json.dumps(data), ex=max(ttl, 3600) * _keepFactor)
+    return _toResponse(url, data)
+
+
+def apiGet(api: str, url: str, ttl: int = None, **kwargs) -> requests.Response:
+    # GET requests are cached during ttl seconds (default: apiCacheTTL of the api)
+    if ttl is None:
+        ttl = _getTTL(api)
+    headers = kwargs.get("headers") or {}
+    key = (
+        "http:"
+        + hashlib.sha1(
+            (url + "|" + headers.get("Accept-Language", "")).encode("utf-8")
+        ).hexdigest()
+    )
+
+    # concurrent requests for the same url wait for the first one
+    with _pendingLock:
+        event = _pending.get(key)
+        if event is None:
+            _pending[key] = threading.Event()
+    if event is not None:
+        event.wait(60)
+        return _fetch(api, key, url, max(ttl, 60), **kwargs)
+
+    try:
+        return _fetch(api, key, url, ttl, **kwargs)
+    finally:
+        with _pendingLock:
+            _pending.pop(key).set()
+
+
+def apiPost(api: str, url: str, **kwargs) -> requests.Response:
+    return _request(api, "POST", url, **kwargs)
+
+
+def fetchAll(func, argsList: list) -> list:
+    # call func for each tuple of arguments concurrently, the results keep the order of argsList
+    # (the result of a failed call is None)
+    def call(args):
+        try:
+            return func(*args)
+        except Exception as e:
+            logger.warning("Fetch failed for " + str(args) + ": " + str(e))
+            return None
+
+    if len(argsList) == 0:
+        return []
+    with ThreadPoolExecutor(
+        max_workers=configData["config"].get("scraperWorkers", 8)
+    ) as executor:
+        return list(executor.map(call, argsList))
@@ -25,12 +25,12 @@ class scanner:
         else:
             logger.info("Indexer Class Instancied Successfully for type " + str(sType))
 
-    def scanDir(self, path):
+    def scanDir(self, path, full=False):
         if self._class == None:
             logger.error("Indexer not available")
             return None
         else:
-            return self._class.scanDir(path)
+            return self._class.scanDir(path, full=full)
 
     def getObject(self):
         if self._class == None:
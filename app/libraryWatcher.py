@@ -0,0 +1,218 @@
+from uwsgidecorators import thread
+import os
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+
+from .dbHelper import r_runningThreads, configData
+from .log import logger
+
+# inotify flags (see inotify(7))
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+# IN_MODIFY keeps postponing the scan of a file that is still being copied
+_watchMask = (
+    IN_MODIFY
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+)
+_eventHeader = struct.Struct("iIII")
+
+
+class inotifyBackend:
+    # watch all the directories of the libraries with inotify, raises OSError if not available
+    def __init__(self, roots: dict):
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._roots = roots
+        self._watches = {}
+        for name, root in roots.items():
+            self._addTree(name, root)
+        logger.info(
+            "Library watcher using inotify ("
+            + str(len(self._watches))
+            + " directories)"
+        )
+
+    def _addWatch(self, name: str, path: str):
+        wd = self._libc.inotify_add_watch(
+            self._fd, os.fsencode(path), ctypes.c_uint32(_watchMask)
+        )
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOENT:
+                return
+            raise OSError(err, "inotify_add_watch failed for " + path)
+        self._watches[wd] = (name, os.path.relpath(path, self._roots[name]))
+
+    def _addTree(self, name: str, path: str):
+        self._addWatch(name, path)
+        for root, dirs, files in os.walk(path):
+            for d in dirs:
+                self._addWatch(name, os.path.join(root, d))
+
+    def read(self, timeout: float) -> list:
+        # returns the changes as a list of (library name, directory, entry name)
+        # a None directory means that events were lost
+        r, w, x = select.select([self._fd], [], [], timeout)
+        if len(r) == 0:
+            return []
+        try:
+            buf = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        changes = []
+        pos = 0
+        while pos + _eventHeader.size <= len(buf):
+            wd, mask, cookie, length = _eventHeader.unpack_from(buf, pos)
+            pos += _eventHeader.size
+            entry = os.fsdecode(buf[pos : pos + length].rstrip(b"\0"))
+            pos += length
+
+            if mask & IN_Q_OVERFLOW:
+                for name in self._roots:
+                    changes.append((name, None, None))
+                continue
+            if mask & IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+            if wd not in self._watches:
+                continue
+
+            name, directory = self._watches[wd]
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                # new directory, watch it and everything inside
+                try:
+                    self._addTree(name, os.path.join(self._roots[name], directory, entry))
+                except OSError as e:
+                    logger.warning("Cannot watch new directory: " + str(e))
+            if not mask & IN_DELETE_SELF:
+                changes.append((name, directory, entry))
+        return changes
+
+
+class pollingBackend:
+    # compare the directories mtimes at regular interval
+    def __init__(self, roots: dict):
+        self._roots = roots
+        self._interval = configData["config"].get("liveScanPoll", 300)
+        self._lastPoll = time.time()
+        self._mtimes = self._getMtimes()
+        logger.info(
+            "Library watcher polling every "
+            + str(self._interval)
+            + "s ("
+            + str(len(self._mtimes))
+            + " directories)"
+        )
+
+    def _getMtimes(self) -> dict:
+        mtimes = {}
+        for name, root in self._roots.items():
+            for path, dirs, files in os.walk(root):
+                try:
+                    mtimes[(name, os.path.relpath(path, root))] = os.stat(
+                        path
+                    ).st_mtime
+                except OSError:
+                    pass
+        return mtimes
+
+    def read(self, timeout: float) -> list:
+        if self._lastPoll + self._interval > time.time():
+            time.sleep(timeout)
+            return []
+        self._lastPoll = time.time()
+        mtimes = self._getMtimes()
+        changes = []
+        for (name, directory), mtime in mtimes.items():
+            if self._mtimes.get((name, directory)) != mtime:
+                changes.append((name, directory, None))
+        self._mtimes = mtimes
+        return changes
+
+
+def getScanKey(name: str, directory: str, entry: str) -> tuple:
+    # returns the item to scan for a change: the show directory for tv shows,
+    # the directory containing the change for movies
+    if directory is None:
+        return (name, None)
+    path = os.path.normpath(os.path.join(directory, entry or ""))
+    if name == "tvs":
+        if path == ".":
+            return None
+        return (name, path.split(os.sep)[0])
+    else:
+        return (name, os.path.normpath(directory))
+
+
+@thread
+def startLibraryWatcher():
+    if not configData["config"].get("liveScan", False):
+        return
+
+    from .tvs import tvs_runScan, tvs_scanShow
+    from .movie import mov_runScan, mov_scanDir
+
+    roots = {
+        "tvs": os.path.join(
+            configData["config"]["contentPath"], configData["config"]["tvsPath"]
+        ),
+        "movies": os.path.join(
+            configData["config"]["contentPath"], configData["config"]["moviePath"]
+        ),
+    }
+    try:
+        backend = inotifyBackend(roots)
+    except (OSError, AttributeError) as e:
+        logger.warning("inotify is not available (" + str(e) + "), using polling")
+        backend = pollingBackend(roots)
+
+    delay = configData["config"].get("liveScanDelay", 30)
+    pending = {}
+
+    while True:
+        for name, directory, entry in backend.read(1):
+            key = getScanKey(name, directory, entry)
+            if key is not None:
+                pending[key] = time.time()
+
+        # wait for the files to stop changing before scanning them
+        now = time.time()
+        for key, lastEvent in list(pending.items()):
+            name, item = key
+            if lastEvent + delay > now or r_runningThreads.get(name) == b"1":
+                continue
+            del pending[key]
+            logger.info("[LIVE] scanning " + name + " " + str(item))
+            try:
+                if item is None:
+                    # events were lost, fall back to an incremental scan of the library
+                    if name == "tvs":
+                        tvs_runScan()
+                    else:
+                        mov_runScan()
+                elif name == "tvs":
+                    tvs_scanShow(item)
+                else:
+                    mov_scanDir(item)
+            except Exception as e:
+                logger.error("[LIVE] scan failed for " + str(item) + ": " + str(e))
@@ -0,0 +1,55 @@
+from flask import abort
+
+"""
+sql of the library listings, sorted and paginated on (title, id)
+no database or configuration is used here, so that tests/test_query_plans.py can
+explain the queries built by the api
+"""
+
+
+def listQuery(
+    columns: dict,
+    table: str,
+    idField: str,
+    where: str,
+    fields: list = None,
+    limit: int = None,
+    after: list = None,
+) -> str:
+    # query of the requested fields of the rows after the position (title, id), the
+    # parameters %(afterTitle)s and %(afterId)s are given with the position
+    query = "SELECT " + selectFields(columns, fields) + " FROM " + table
+    query += " WHERE " + where
+    if after is not None:
+        query += keysetFilter(after, idField)
+    query += " ORDER BY title, " + idField
+    if limit is not None:
+        query += " LIMIT " + str(int(limit))
+    return query + ";"
+
+
+def keysetFilter(after: list, idField: str) -> str:
+    # condition on (title, id) for the rows after the position
+    # (mysql sorts the NULL titles first)
+    if after[0] is None:
+        return (
+            " AND ((title IS NULL AND "
+            + idField
+            + " > %(afterId)s) OR title IS NOT NULL)"
+        )
+    return (
+        " AND (title > %(afterTitle)s OR (title = %(afterTitle)s AND "
+        + idField
+        + " > %(afterId)s))"
+    )
+
+
+def selectFields(columns: dict, fields: list = None) -> str:
+    # returns the select expression of the requested fields (default: all), id and title are always selected
+    if fields is None:
+        fields = list(columns)
+    for f in fields:
+        if f not in columns:
+            abort(400)
+    fields = ["id", "title"] + [f for f in fields if f not in ["id", "title"]]
+    return ", ".join(columns[f] for f in fields)
@@ -7,7 +7,18 @@ from datetime import datetime
 
 from .transcoder import transcoder
 from .log import logger
-from .utils import checkArgs, checkUser, addCache, getUID, fixTypes
+from .utils import (
+    checkArgs,
+    checkUser,
+    addCache,
+    getUID,
+    fixTypes,
+    conditionalGet,
+    bumpLibraryVersion,
+    getListArgs,
+    getNextPage,
+)
+from .listing import listQuery
 
 from .dbHelper import getSqlConnection, r_runningThreads, configData
 from .indexer import scanner
@@ -22,7 +33,7 @@ movie = Blueprint("movie", __name__)
 @movie.route("scan", methods=["GET"])
 def mov_runScanThreaded():
     checkUser("admin")
-    mov_runScan()
+    mov_runScan(request.args.get("full", "false") == "true")
     return jsonify({"status": "ok", "data": "ok"})
 
 
@@ -42,12 +53,18 @@ def mov_multipleResults():
 
 @movie.route("<int:idMovie>", methods=["GET"])
 @movie.route("", methods=["GET"])
+@conditionalGet
 def mov_getMovieFlask(idMovie: int = None):
-    return jsonify({"status": "ok", "data": mov_getMovie(False, idMovie)})
+    if idMovie is not None:
+        return jsonify({"status": "ok", "data": mov_getMovie(False, idMovie)})
+    fields, limit, after = getListArgs()
+    res = mov_getMovie(False, None, fields, limit, after)
+    return jsonify({"status": "ok", "data": res, "next": getNextPage(res, limit)})
 
 
 @movie.route("collection", methods=["GET"])
 @movie.route("collection/<int:idCollection>", methods=["GET"])
+@conditionalGet
 def mov_getCollections(idCollection: int = None):
     idUser = getUID()
     queryData = {"idUser": idUser}
@@ -77,6 +94,7 @@ def mov_getCollections(idCollection: int = None):
 
 
 @movie.route("fromCollection/<int:idCollection>", methods=["GET"])
+@conditionalGet
 def mov_getCollectionMovies(idCollection: int):
     idUser = getUID()
     sqlConnection, cursor = getSqlConnection()
@@ -183,39 +201,86 @@ def mov_toggleStatus(idMovie: int):
 
 
 @thread
-def mov_runScan():
-    r_runningThreads.set("movies", 1)
+def mov_runScan(full: bool = False):
+    # one scan at a time, the flag is only cleared by the scan that set it
+    if r_runningThreads.getset("movies", 1) == b"1":
+        logger.info("A movies scan is already running, skipping the new one")
+        return
     sqlConnection = getSqlConnection(False)
-    scanner(sqlConnection, "movies", configData["api"]).scanDir(
-        os.path.join(
-            configData["config"]["contentPath"], configData["config"]["moviePath"]
+    try:
+        scanner(sqlConnection, "movies", configData["api"]).scanDir(
+            os.path.join(
+                configData["config"]["contentPath"], configData["config"]["moviePath"]
+            ),
+            full,
         )
-    )
-    r_runningThreads.set("movies", 0)
-    sqlConnection.close()
+    finally:
+        bumpLibraryVersion()
+        r_runningThreads.set("movies", 0)
+        sqlConnection.close()
 
 
-def mov_getMovie(mr=False, idMovie=None):
+def mov_scanDir(addPath: str):
+    # scan a single movie directory (used by the library watcher)
+    path = os.path.join(
+        configData["config"]["contentPath"], configData["config"]["moviePath"]
+    )
+    if not os.path.isdir(os.path.join(path, addPath)):
+        return
+    sqlConnection = getSqlConnection(False)
+    # the flag is only cleared by the scan that set it (a full scan may be running)
+    owner = r_runningThreads.getset("movies", 1) != b"1"
+    try:
+        scanner(sqlConnection, "movies", configData["api"]).getObject().scanSubDir(
+            path, addPath
+        )
+    finally:
+        bumpLibraryVersion()
+        if owner:
+            r_runningThreads.set("movies", 0)
+        sqlConnection.close()
+
+
+_movieColumns = {
+    "id": "idMovie AS id",
+    "title": "title",
+    "overview": "overview",
+    "idCollection": "idCollection",
+    "icon": "CONCAT('/api/core/image/',icon) AS icon",
+    "fanart": "CONCAT('/api/core/image/',fanart) AS fanart",
+    "rating": "rating",
+    "premiered": "premiered",
+    "scraperName": "scraperName",
+    "scraperID": "scraperID",
+    "multipleResults": "multipleResults",
+    "watchCount": "(SELECT COALESCE(SUM(watchCount), '0') FROM status st WHERE idUser = %(idUser)s AND st.mediaType = 3 AND st.idMedia = t.idMovie) AS watchCount",
+    "scraperLink": "CONCAT((SELECT scraperURL FROM scrapers WHERE scraperName = t.scraperName AND mediaType = 3),scraperID) AS scraperLink",
+}
+
+
+def mov_getMovie(mr=False, idMovie=None, fields=None, limit=None, after=None):
     idUser = getUID()
     sqlConnection, cursor = getSqlConnection()
     mrDat = ""
-    show = ""
+    where = ""
     queryData = {"idUser": int(idUser)}
     if mr:
         mrDat = "NOT "
     if idMovie is not None:
-        show = " AND idMovie = %(idMovie)s"
+        where = " AND idMovie = %(idMovie)s"
         queryData.update({"idMovie": idMovie})
-
-    query = (
-        "SELECT idMovie AS id, title, overview, idCollection, "
-        "CONCAT('/api/core/image/',icon) AS icon, "
-        "CONCAT('/api/core/image/',fanart) AS fanart, "
-        "rating, premiered, scraperName, scraperID, multipleResults, "
-        "(SELECT COALESCE(SUM(watchCount), '0') FROM movies mov LEFT JOIN status st ON (st.idMedia = mov.idMovie) WHERE idUser = %(idUser)s AND st.mediaType = 3 AND idMovie = t.idMovie) AS watchCount, "
-        "CONCAT((SELECT scraperURL FROM scrapers WHERE scraperName = t.scraperName AND mediaType = 3),scraperID) AS scraperLink "
-        "FROM movies t "
-        "WHERE multipleResults IS " + mrDat + "NULL" + show + " ORDER BY title;"
+    if after is not None:
+        # keyset pagination on (title, id), NULL titles first
+        queryData.update({"afterTitle": after[0], "afterId": after[1]})
+
+    query = listQuery(
+        _movieColumns,
+        "movies t",
+        "idMovie",
+        "multipleResults IS " + mrDat + "NULL" + where,
+        fields,
+        limit,
+        after,
     )
 
     cursor.execute(query, queryData)
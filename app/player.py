@@ -2,18 +2,33 @@ import time
 from flask import request, Blueprint, jsonify, abort, Response, send_file, redirect
 import redis
 import os
+import re
 import json
 from uwsgidecorators import thread
 from datetime import datetime
 
 from .transcoder import transcoder
+from .transcodeCache import (
+    acquireTranscoder,
+    releaseTranscoder,
+    resolveTranscoder,
+    updateTranscoder,
+    touchTranscoder,
+)
+from .transcodeProgress import getProgress
+from .scheduler import (
+    admitTranscoder,
+    releaseTranscoderSlot,
+    getQueuePosition,
+)
 from .log import logger
-from .utils import checkArgs, getUID, generateToken
+from .utils import checkArgs, getUID, generateToken, bumpLibraryVersion
 from .files import getMediaPath, getFileInfos
 from .device import importDevice
 from app.devices.PlayerBase import PlayerBase
 
-from .dbHelper import getSqlConnection, r_userFiles, r_userTokens, configData
+from .dbHelper import getSqlConnection, r_userFiles, r_userTokens, r_cache, configData
+from .watchStats import updateWatchStats
 
 player = Blueprint("player", __name__)
 
@@ -30,6 +45,40 @@ def getToken():
     )
 
 
+def getOutputUrl(outDir: str) -> str:
+    # static files are directly served by nginx
+    return (
+        configData["config"]["baseUrl"]
+        + "/out/"
+        + os.path.relpath(outDir, configData["config"]["outDir"])
+        + "/"
+    )
+
+
+def startTranscoder(uid: int, reqData: dict) -> dict:
+    # returns the transcoder data, or a queued state if there is no room for this encode
+    obj = transcoder(int(reqData["mediaType"]), int(reqData["mediaData"]))
+    obj.enableHLS(True, configData["config"]["hlsTime"])
+    obj.enableOnDemand(configData["config"].get("hlsOnDemand", False))
+    obj.enableABR(configData["config"].get("abr", False))
+    obj.configure(reqData)
+    if not admitTranscoder(uid, obj, reqData):
+        return {"queued": True, "request": reqData}
+    if configData["config"].get("sharedCache", False):
+        return acquireTranscoder(uid, obj)
+    else:
+        obj.setSession(uid=uid)
+        return obj.start()
+
+
+def stopTranscoder(uid: int, data: dict):
+    releaseTranscoderSlot(uid)
+    if "cacheKey" in data:
+        releaseTranscoder(uid, data)
+    else:
+        transcoder.stop(data)
+
+
 @player.route("start", methods=["POST"])
 def startPlayer():
     reqData = json.loads(request.data)
@@ -68,10 +117,11 @@ def startPlayer():
         if hasattr(device, "doWork"):
             doWork(device)
     else:
-        obj = transcoder(int(reqData["mediaType"]), int(reqData["mediaData"]))
-        obj.enableHLS(True, configData["config"]["hlsTime"])
-        obj.configure(reqData)
-        startData = obj.start()
+        previous = r_userFiles.get(uid)
+        if previous is not None:
+            stopTranscoder(uid, json.loads(previous)["transcoder"])
+
+        startData = startTranscoder(uid, reqData)
 
     r_userFiles.set(
         uid,
@@ -109,17 +159,58 @@ def getTranscoderStatus():
     data = r_userFiles.get(uid)
     if data is not None:
         data = json.loads(data)
+        if data["transcoder"].get("queued", False):
+            # waiting for an encode slot, try to start it again
+            data["transcoder"] = startTranscoder(uid, data["transcoder"]["request"])
+            r_userFiles.set(uid, json.dumps(data))
+            if data["transcoder"].get("queued", False):
+                return jsonify(
+                    {
+                        "status": "ok",
+                        "data": {
+                            "available": False,
+                            "running": False,
+                            "queued": True,
+                            "position": getQueuePosition(uid),
+                        },
+                    }
+                )
         if os.path.exists(data["transcoder"]["outDir"]):
             if data["transcoder"] != {}:
+                outDir = data["transcoder"]["outDir"]
                 if os.path.exists(
-                    data["transcoder"]["outDir"] + "/stream.m3u8"
-                ) and os.path.exists(data["transcoder"]["outDir"] + "/stream001.ts"):
+                    os.path.join(
+                        outDir, data["transcoder"].get("playlist", "stream.m3u8")
+                    )
+                ) and os.path.exists(
+                    os.path.join(
+                        outDir, data["transcoder"].get("firstSegment", "stream001.ts")
+                    )
+                ):
                     return jsonify(
-                        {"status": "ok", "data": {"available": True, "running": True}}
+                        {
+                            "status": "ok",
+                            "data": {
+                                "available": True,
+                                "running": True,
+                                "progress": getEncodeProgress(data["transcoder"]),
+                                "onDemand": data["transcoder"].get("onDemand", False),
+                                "startFrom": data["transcoder"].get("startFrom", 0),
+                            },
+                        }
                     )
                 else:
                     return jsonify(
-                        {"status": "ok", "data": {"available": False, "running": True}}
+                        {
+                            "status": "ok",
+                            "data": {
+                                "available": False,
+                                "running": True,
+                                "progress": getEncodeProgress(data["transcoder"]),
+                                "onDemand": data["transcoder"].get("onDemand", False),
+                                "startFrom": data["transcoder"].get("startFrom", 0),
+                            },
+                        }
                     )
             else:
                 return jsonify(
@@ -133,21 +224,67 @@ def getTranscoderStatus():
         return jsonify({"status": "ok", "data": {"available": False, "running": False}})
 
 
+def getEncodeProgress(data: dict) -> dict:
+    # last progress reported by ffmpeg (speed, fps, out_time, ...)
+    data = resolveTranscoder(data)
+    if "progress" not in data:
+        return {}
+    return getProgress(data["progress"])
+
+
 @player.route("m3u8", methods=["GET"])
 def getTranscoderM3U8():
     token = getToken()
     uid = getUID()
-    # static files are directly served by nginx
-    fileUrl = configData["config"]["baseUrl"] + "/out/" + str(uid) + "/"
+    data = r_userFiles.get(uid)
+    if data is None:
+        abort(404)
+    data = json.loads(data)["transcoder"]
+    touchTranscoder(uid, data)
+    outDir = data.get("outDir", os.path.join(configData["config"]["outDir"], str(uid)))
+
+    fileUrl = getOutputUrl(outDir)
     # add time to fileUrl prevent browser caching
     fileUrlEnd = "?token=" + token + "&time=" + str(time.time())
     dat = ""
 
-    file = os.path.join(configData["config"]["outDir"], str(getUID()), "stream.m3u8")
+    onDemand = data.get("onDemand", False)
+    if onDemand:
+        # segments are requested through the api, so that they can be encoded first
+        fileUrl = configData["config"]["baseUrl"] + "/api/player/segment/"
+        fileUrlEnd = "?token=" + token
+
+    file = os.path.join(outDir, "stream.m3u8")
+    variant = request.args.get("variant")
+    if variant is not None:
+        # playlist of one rendition of an ABR encode
+        if not variant.isdigit():
+            abort(404)
+        file = os.path.join(outDir, "stream_" + variant + ".m3u8")
     if os.path.exists(file):
         fileData = open(file, "r").read()
         for i in fileData.split("\n"):
-            if ".ts" in i and "stream" in i:
+            m = re.match(r"stream_(\d+)\.m3u8", i)
+            if m:
+                # the rendition playlists of the master playlist are rewritten too
+                dat += (
+                    configData["config"]["baseUrl"]
+                    + "/api/player/m3u8?variant="
+                    + m.group(1)
+                    + "&token="
+                    + token
+                    + "\n"
+                )
+            elif i == "#EXTM3U" and onDemand and variant is None:
+                dat += i + "\n"
+                if float(data.get("startFrom", 0)) > 0:
+                    # the VOD playlist starts at 0, play from the resume position
+                    dat += "#EXT-X-START:TIME-OFFSET=%.3f,PRECISE=YES\n" % float(
+                        data["startFrom"]
+                    )
+            elif ".ts" in i and "stream" in i:
+                if onDemand:
+                    i = str(int(re.search(r"stream(\d+)\.ts", i).group(1)))
                 dat += fileUrl + i + fileUrlEnd + "\n"
             else:
                 dat += i + "\n"
@@ -156,6 +293,72 @@ def getTranscoderM3U8():
         abort(404)
 
 
+@player.route("segment/<int:num>", methods=["GET"])
+def getTranscoderSegment(num: int):
+    uid = getUID()
+    data = r_userFiles.get(uid)
+    if data is None:
+        abort(404)
+    data = json.loads(data)
+    if not data["transcoder"].get("onDemand", False):
+        abort(404)
+    touchTranscoder(uid, data["transcoder"])
+
+    trData = resolveTranscoder(data["transcoder"])
+    tr = transcoder.fromJSON(trData["classData"])
+    if num < 0 or num >= tr.getSegmentCount():
+        abort(404)
+
+    segment = os.path.join(trData["outDir"], tr.getSegmentName(num))
+    if not os.path.exists(segment):
+        restartSegment(uid, num)
+
+        timeout = time.time() + configData["config"]["hlsKill"]
+        while not os.path.exists(segment):
+            if time.time() > timeout:
+                abort(404)
+            time.sleep(0.5)
+
+    return redirect(
+        getOutputUrl(trData["outDir"]) + tr.getSegmentName(num) + "?token=" + getToken(),
+        code=302,
+    )
+
+
+def restartSegment(uid: int, num: int):
+    # restart ffmpeg at the segment if it is not being encoded, the parallel requests of
+    # a player (or of the users of a shared encode) must not each start their own ffmpeg
+    data = json.loads(r_userFiles.get(uid))
+    if "cacheKey" in data["transcoder"]:
+        lockKey = "transcode:" + data["transcoder"]["cacheKey"] + ":lock"
+    else:
+        lockKey = "segment:" + str(uid) + ":lock"
+
+    with r_cache.lock(lockKey, timeout=60):
+        # the session may have been restarted while waiting for the lock
+        data = r_userFiles.get(uid)
+        if data is None:
+            abort(404)
+        data = json.loads(data)
+        trData = resolveTranscoder(data["transcoder"])
+        tr = transcoder.fromJSON(trData["classData"])
+        if os.path.exists(os.path.join(trData["outDir"], tr.getSegmentName(num))):
+            return
+        if tr.isInWindow(num) and transcoder.isRunning(trData):
+            return
+
+        # the client jumped outside of what is being encoded
+        logger.info(
+            "Restarting transcoder at segment " + str(num) + " for user " + str(uid)
+        )
+        transcoder.stop(trData, False)
+        if "cacheKey" in trData:
+            updateTranscoder(trData["cacheKey"], tr.startSegment(num))
+        else:
+            data["transcoder"] = tr.startSegment(num)
+            r_userFiles.set(uid, json.dumps(data))
+
+
 @player.route("file", methods=["GET"])
 def player_getFile():
     checkArgs(["mediaType", "mediaData"])
@@ -257,7 +460,7 @@ def player_stop():
     else:
         data = r_userFiles.get(uid)
         if data is not None:
-            transcoder.stop(json.loads(data)["transcoder"])
+            stopTranscoder(uid, json.loads(data)["transcoder"])
 
     r_userFiles.delete(uid)
 
@@ -313,5 +516,8 @@ def player_setWatchTime(uid: str, mediaType: int, idMedia: int, endTime: float):
                 "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
             },
         )
+    if mediaType == 1 and viewAdd > 0:
+        updateWatchStats(cursor, uid, idMedia)
     sqlConnection.commit()
     sqlConnection.close()
+    bumpLibraryVersion()
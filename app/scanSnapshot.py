@@ -0,0 +1,63 @@
+import os
+import json
+
+from .dbHelper import r_cache
+
+"""
+r_cache: directory snapshots, used by the scanners to only descend into the directories that changed
+    scan:<name> : hash of directory path -> {"mtime": directory mtime, "dirs": subdirectories, "tag": scan identifier}
+"""
+
+
+def listDir(path: str) -> tuple:
+    # returns the mtime, the subdirectories and the files of a directory
+    # (the mtime is read first, so a change during the listing is seen by the next scan)
+    mtime = os.stat(path).st_mtime
+    dirs = []
+    files = []
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_dir():
+                dirs.append(entry.name)
+            else:
+                files.append(entry.name)
+    return mtime, sorted(dirs), sorted(files)
+
+
+def getSnapshot(name: str, path: str, tag: str = None) -> dict:
+    snapshot = r_cache.hget("scan:" + name, path)
+    if snapshot is None:
+        return None
+    snapshot = json.loads(snapshot)
+    if snapshot.get("tag") != tag:
+        return None
+    return snapshot
+
+
+def saveSnapshot(name: str, path: str, mtime: float, dirs: list, tag: str = None):
+    r_cache.hset(
+        "scan:" + name,
+        path,
+        json.dumps({"mtime": mtime, "dirs": dirs, "tag": tag}),
+    )
+
+
+def isUnchanged(name: str, path: str, tag: str = None, recursive: bool = True) -> bool:
+    # only the directories are stat'ed, their content is not listed
+    snapshot = getSnapshot(name, path, tag)
+    if snapshot is None:
+        return False
+    try:
+        if os.stat(path).st_mtime != snapshot["mtime"]:
+            return False
+    except OSError:
+        return False
+    if recursive:
+        for d in snapshot["dirs"]:
+            if not isUnchanged(name, os.path.join(path, d), tag):
+                return False
+    return True
+
+
+def clearSnapshots(name: str):
+    r_cache.delete("scan:" + name)
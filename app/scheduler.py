@@ -0,0 +1,154 @@
+import json
+import time
+import socket
+
+from .log import logger
+from .transcoder import transcoder
+from .transcodeCache import getCacheKey, resolveTranscoder
+from .dbHelper import r_runningThreads, r_userFiles, configData
+
+"""
+r_runningThreads: transcoding admission for this host
+    encodes:<host> : hash of uid -> {"cost": cost of the encode, "key": encode identifier,
+        "admitted": admission timestamp}
+        a slot is kept for admissionGrace seconds even without a running encode, the
+        session of the user is only written once the encode is started
+    encodeQueue:<host> : list of the uids waiting for an encode slot
+    encodeRequest:<uid> : start request of a queued user, expires if the user stops polling
+"""
+
+_host = socket.gethostname()
+_baseCost = 1920 * 1080
+
+
+def getCost(tr: transcoder) -> float:
+    # the cost of an encode is its output size relative to 1080p
+    if tr.canCopyVideo():
+        return configData["config"].get("directStreamCost", 0.1)
+    try:
+        width, height = [int(x) for x in tr._fileInfos["dimension"].split("x")]
+    except (KeyError, ValueError, AttributeError):
+        return 1.0
+    if tr.isABR():
+        # the source is decoded once, but each rendition is encoded
+        return sum(r[0] * r[0] * height / width for r in tr.getRenditions()) / _baseCost
+    if int(tr._resize) > 0 and int(tr._resize) < width:
+        height = height * int(tr._resize) / width
+        width = int(tr._resize)
+    return width * height / _baseCost
+
+
+def _getKey(uid: int, tr: transcoder) -> str:
+    # users sharing an encode only pay for it once
+    if configData["config"].get("sharedCache", False):
+        return getCacheKey(tr)
+    return str(uid)
+
+
+def _getSessions() -> dict:
+    # running encodes, the ones that are not used anymore are removed
+    sessions = {}
+    grace = configData["config"].get("admissionGrace", 60)
+    for uid, data in r_runningThreads.hgetall("encodes:" + _host).items():
+        uid = uid.decode("utf-8")
+        data = json.loads(data)
+        if time.time() - data.get("admitted", 0) < grace:
+            # the encode is still being started
+            sessions[uid] = data
+            continue
+        userData = r_userFiles.get(uid)
+        if userData is not None:
+            userData = json.loads(userData)
+            if transcoder.isRunning(resolveTranscoder(userData["transcoder"])):
+                sessions[uid] = data
+                continue
+        r_runningThreads.hdel("encodes:" + _host, uid)
+    return sessions
+
+
+def _getUsage(sessions: dict) -> tuple:
+    costs = {}
+    for s in sessions.values():
+        costs[s["key"]] = s["cost"]
+    return sum(costs.values()), costs
+
+
+def _getQueue() -> list:
+    # queued users that stopped polling are removed
+    queue = []
+    for uid in r_runningThreads.lrange("encodeQueue:" + _host, 0, -1):
+        uid = uid.decode("utf-8")
+        if r_runningThreads.exists("encodeRequest:" + uid):
+            queue.append(uid)
+        else:
+            r_runningThreads.lrem("encodeQueue:" + _host, 0, uid)
+    return queue
+
+
+def admitTranscoder(uid: int, tr: transcoder, reqData: dict) -> bool:
+    # returns True if the encode can be started now, else the request is queued
+    # (the transcoder may be degraded to fit in the budget)
+    uid = str(uid)
+    budget = configData["config"].get("transcodeBudget", 4)
+
+    with r_runningThreads.lock("encodes:" + _host + ":lock", timeout=10):
+        sessions = _getSessions()
+        usage, costs = _getUsage(sessions)
+        queue = _getQueue()
+
+        if len(queue) == 0 or queue[0] == uid:
+            cost = getCost(tr)
+            key = _getKey(uid, tr)
+            fits = key in costs or usage + cost <= budget
+
+            if not fits and not tr.canCopyVideo():
+                width = configData["config"].get("degradeWidth", 1280)
+                try:
+                    srcWidth = int(tr._fileInfos["dimension"].split("x")[0])
+                except (KeyError, ValueError, AttributeError):
+                    srcWidth = 0
+                if srcWidth > width and (
+                    int(tr._resize) <= 0 or int(tr._resize) > width
+                ):
+                    tr.resize(width)
+                tr._crf = max(
+                    int(tr._crf), configData["config"].get("degradeCrf", 28)
+                )
+                cost = getCost(tr)
+                key = _getKey(uid, tr)
+                fits = key in costs or usage + cost <= budget
+                if fits:
+                    logger.info("Degrading transcoder for user " + uid)
+
+            if fits:
+                r_runningThreads.hset(
+                    "encodes:" + _host,
+                    uid,
+                    json.dumps({"cost": cost, "key": key, "admitted": time.time()}),
+                )
+                r_runningThreads.lrem("encodeQueue:" + _host, 0, uid)
+                r_runningThreads.delete("encodeRequest:" + uid)
+                return True
+
+        if uid not in queue:
+            logger.info("Queuing transcoder for user " + uid)
+            r_runningThreads.rpush("encodeQueue:" + _host, uid)
+        r_runningThreads.set(
+            "encodeRequest:" + uid,
+            json.dumps(reqData),
+            ex=configData["config"].get("queueTimeout", 30),
+        )
+        return False
+
+
+def getQueuePosition(uid: int) -> int:
+    queue = _getQueue()
+    if str(uid) in queue:
+        return queue.index(str(uid))
+    return None
+
+
+def releaseTranscoderSlot(uid: int):
+    r_runningThreads.hdel("encodes:" + _host, str(uid))
+    r_runningThreads.lrem("encodeQueue:" + _host, 0, str(uid))
+    r_runningThreads.delete("encodeRequest:" + str(uid))
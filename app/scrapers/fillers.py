@@ -1,7 +1,8 @@
 from bs4 import BeautifulSoup
-import requests
 import re
 
+from app.httpClient import apiGet
+
 
 def getFillers(url):
     def getFillersFromResp(resp, ftype, name, flist):
@@ -18,7 +19,7 @@ def getFillers(url):
                 else:
                     flist.append((int(val), ftype))
 
-    rawData = requests.get(url).text
+    rawData = apiGet("fillers", url).text
     soup = BeautifulSoup(rawData, features="html.parser")
     resp = soup.find("div", {"id": "Condensed"})
     if resp is None:
@@ -42,7 +43,7 @@ def getFillerSlug(name):
 
 def findFillerUrl(name):
     url = "https://www.animefillerlist.com/shows/" + getFillerSlug(name)
-    if requests.get(url).status_code == 200:
+    if apiGet("fillers", url).status_code == 200:
         return url
     else:
         return False
\ No newline at end of file
@@ -0,0 +1,97 @@
+import unicodedata
+
+from app.utils import encodeImg
+
+
+def _collate(value) -> str:
+    # compare the values like the utf8_general_ci collation of the tables:
+    # case and accent insensitive, trailing spaces ignored
+    value = unicodedata.normalize("NFKD", str(value))
+    value = "".join(c for c in value if not unicodedata.combining(c))
+    return value.casefold().rstrip(" ")
+
+
+def _getIds(cursor, table: str, idField: str, fields: list, keys: list) -> dict:
+    # returns the ids of the rows matching the keys, in one query
+    if len(keys) == 0:
+        return {}
+    columns = ", ".join(fields)
+    row = "(" + ", ".join(["%s"] * len(fields)) + ")"
+    cursor.execute(
+        "SELECT " + idField + ", " + columns + " FROM " + table
+        + " WHERE (" + columns + ") IN (" + ", ".join([row] * len(keys)) + ");",
+        [v for k in keys for v in k],
+    )
+    ids = {}
+    for row in cursor.fetchall():
+        ids[tuple(_collate(row[f]) for f in fields)] = row[idField]
+    return ids
+
+
+def _getId(ids: dict, key: tuple) -> int:
+    return ids.get(tuple(_collate(v) for v in key))
+
+
+def linkTags(cursor, mediaType: int, idMedia: int, tags: list) -> bool:
+    # create the missing tags [name, value, icon] and link them to the media
+    # returns True if something was written, the caller commits
+    keys = list(dict.fromkeys((t[0], t[1]) for t in tags))
+    ids = _getIds(cursor, "tags", "idTag", ["name", "value"], keys)
+
+    icons = {(t[0], t[1]): t[2] for t in tags}
+    missing = [k for k in keys if _getId(ids, k) is None]
+    if len(missing) > 0:
+        cursor.executemany(
+            "INSERT INTO tags (name, value, icon) VALUES (%s, %s, %s);",
+            [(k[0], k[1], encodeImg(icons[k])) for k in missing],
+        )
+        ids.update(_getIds(cursor, "tags", "idTag", ["name", "value"], missing))
+
+    cursor.execute(
+        "SELECT idTag FROM tags_link WHERE mediaType = %(mediaType)s AND idMedia = %(idMedia)s;",
+        {"mediaType": mediaType, "idMedia": idMedia},
+    )
+    existing = set(i["idTag"] for i in cursor.fetchall())
+    links = []
+    for k in keys:
+        idTag = _getId(ids, k)
+        if idTag is not None and idTag not in existing:
+            existing.add(idTag)
+            links.append((idTag, idMedia, mediaType))
+    if len(links) > 0:
+        cursor.executemany(
+            "INSERT INTO tags_link (idTag, idMedia, mediaType) VALUES (%s, %s, %s);",
+            links,
+        )
+    return len(missing) > 0 or len(links) > 0
+
+
+def linkPeople(cursor, mediaType: int, idMedia: int, people: list) -> bool:
+    # create the missing people [name, role] and link them to the media
+    # returns True if something was written, the caller commits
+    keys = list(dict.fromkeys((p[0],) for p in people))
+    ids = _getIds(cursor, "people", "idPers", ["name"], keys)
+
+    missing = [k for k in keys if _getId(ids, k) is None]
+    if len(missing) > 0:
+        cursor.executemany("INSERT INTO people (name) VALUES (%s);", missing)
+        ids.update(_getIds(cursor, "people", "idPers", ["name"], missing))
+
+    cursor.execute(
+        "SELECT idPers FROM people_link WHERE mediaType = %(mediaType)s AND idMedia = %(idMedia)s;",
+        {"mediaType": mediaType, "idMedia": idMedia},
+    )
+    existing = set(i["idPers"] for i in cursor.fetchall())
+    links = []
+    for p in people:
+        idPers = _getId(ids, (p[0],))
+        # a person can have multiple roles (cast and crew)
+        if idPers is not None and idPers not in existing:
+            links.append((idPers, idMedia, mediaType, p[1]))
+    links = list(dict.fromkeys(links))
+    if len(links) > 0:
+        cursor.executemany(
+            "INSERT INTO people_link (idPers, idMedia, mediaType, role) VALUES (%s, %s, %s, %s);",
+            links,
+        )
+    return len(missing) > 0 or len(links) > 0
@@ -7,8 +7,10 @@ import urllib.parse
 from importlib import import_module
 from datetime import datetime
 
-from app.files import addFile
+from app.files import addFile, probeFiles, getFullPath
 from app.utils import encodeImg
+from app.scrapers.links import linkTags, linkPeople
+from app.scanSnapshot import listDir, getSnapshot, saveSnapshot, clearSnapshots
 
 
 class movies:
@@ -78,44 +80,84 @@ class movies:
             movies[p] = i
         return paths, movies
 
-    def scanDir(self, path, recursive=False, addPath=""):
+    def scanDir(self, path, recursive=False, addPath="", full=False):
         self._logger.info(
             "Scan Dir Triggered, recursive: "
             + str(recursive)
             + " ; current Movie: "
             + str(self._currentMovie)
         )
-        self._paths, self._movies = self.getMovieData()
+        if not recursive:
+            self._paths, self._movies = self.getMovieData()
+            self._scanned = []
+            if full:
+                clearSnapshots("movies")
 
-        for item in os.listdir(path):
-            self._logger.debug(b"New Item: " + item.encode("utf-8", "surrogateescape"))
+        snapshot = getSnapshot("movies", path)
+        if snapshot is not None and snapshot["mtime"] == os.stat(path).st_mtime:
+            # no file was added or removed in this directory since the last scan
+            self._logger.debug("Directory unchanged since last scan")
+            mtime, dirs, files = snapshot["mtime"], snapshot["dirs"], []
+        else:
+            mtime, dirs, files = listDir(path)
+            self.probeNewMovies(addPath, files)
 
-            if os.path.isdir(os.path.join(path, item)):
-                self._logger.debug("Item is a directory")
-                self.scanDir(
-                    path.encode("utf-8", "surrogateescape"),
-                    True,
-                    os.path.join(
-                        addPath.encode("utf-8", "surrogateescape"),
-                        item.encode("utf-8", "surrogateescape"),
-                    ),
-                )
-            else:
-                self._logger.debug("Item is a file")
-                if addPath != "":
-                    p = (
-                        addPath.encode("utf-8", "surrogateescape")
-                        + b"/"
-                        + item.encode("utf-8", "surrogateescape")
-                    )
-                else:
-                    p = item.encode("utf-8", "surrogateescape")
-                self.scanMovie(p)
+        for item in dirs:
+            self._logger.debug("New Item: " + item + " (directory)")
+            self.scanDir(
+                os.path.join(path, item),
+                True,
+                os.path.join(addPath, item),
+            )
+
+        for item in files:
+            self._logger.debug("New Item: " + item + " (file)")
+            p = os.fsencode(os.path.join(addPath, item))
+            self._scanned.append(p)
+            self.scanMovie(p)
+
+        saveSnapshot("movies", path, mtime, dirs)
+
+        if not recursive:
+            # update the movies of the directories that didn't change
+            for p in self._paths:
+                if p not in self._scanned and self.isPending(p):
+                    self.scanMovie(p)
+
+            self._logger.debug("End of scan")
+            self.scanCollections()
+            self._connection.commit()
 
-        self._logger.debug("End of scan (recursive: " + str(recursive) + ")")
+    def scanSubDir(self, path, addPath):
+        # scan a single directory of the movies library
+        self._paths, self._movies = self.getMovieData()
+        self._scanned = []
+        if addPath == ".":
+            addPath = ""
+        self.scanDir(os.path.join(path, addPath), True, addPath)
         self.scanCollections()
         self._connection.commit()
 
+    def isPending(self, item: bytes) -> bool:
+        # an existing movie that must be updated by scanMovie
+        m = self._movies[item]
+        return bool(
+            (m["forceUpdate"] and m["scraperName"] and m["scraperID"])
+            or (m["multipleResults"] and m["multipleResults"][0] != "[")
+        )
+
+    def probeNewMovies(self, addPath, files):
+        # probe the new movies of this directory at once
+        paths = []
+        for item in files:
+            if item[item.rfind(".") + 1 :] not in self._supportedFiles:
+                continue
+            p = os.fsencode(os.path.join(addPath, item))
+            if p not in self._paths:
+                paths.append(getFullPath(p, 3))
+        if len(paths) > 0:
+            probeFiles(paths)
+
     def scanMovie(self, item: bytes):
         cursor = self._connection.cursor(dictionary=True, buffered=True)
         commit = False
@@ -284,87 +326,9 @@ class movies:
             if s.__class__.__name__ == scraperName:
                 self._logger.debug("Getting " + str(s.__class__.__name__) + " results")
 
-                # tags part
-                newTags = []
-                for t in s.getTags(scraperID):
-                    cursor.execute(
-                        "SELECT idTag FROM tags where name = %(name)s AND value = %(value)s;",
-                        {"name": t[0], "value": t[1]},
-                    )
-                    idTag = cursor.fetchone()
-                    if idTag == None:
-                        # create tag if new
-                        cursor.execute(
-                            "INSERT INTO tags (name, value, icon) VALUES (%(name)s, %(value)s, %(icon)s);",
-                            {"name": t[0], "value": t[1], "icon": encodeImg(t[2])},
-                        )
-                        # get tag id
-                        cursor.execute(
-                            "SELECT idTag FROM tags where name = %(name)s AND value = %(value)s;",
-                            {"name": t[0], "value": t[1]},
-                        )
-                        idTag = cursor.fetchone()
-                    newTags.append(idTag["idTag"])
-
-                # get existing tags for this movie
-                cursor.execute(
-                    "SELECT idTag FROM tags_link WHERE mediaType = 3 AND idMedia = %(idMovie)s;",
-                    {"idMovie": idMovie},
-                )
-                existingTags = []
-                for i in cursor.fetchall():
-                    existingTags.append(i["idTag"])
-                # link new tags to this movie
-                for i in newTags:
-                    if i not in existingTags:
-                        cursor.execute(
-                            "INSERT INTO tags_link (idTag, idMedia, mediaType) VALUES (%(idTag)s, %(idMovie)s, 3);",
-                            {"idTag": i, "idMovie": idMovie},
-                        )
-                        commit = True
-
-                # people part
-                movPeopleIDs = []
-                movPeople = s.getPeople(scraperID)
-                for p in movPeople:
-                    cursor.execute(
-                        "SELECT idPers FROM people WHERE name = %(name)s;",
-                        {"name": p[0]},
-                    )
-                    idPers = cursor.fetchone()
-                    if idPers == None:
-                        # create person if new
-                        cursor.execute(
-                            "INSERT INTO people (name) VALUES (%(name)s);",
-                            {"name": p[0]},
-                        )
-                        # get person id
-                        cursor.execute(
-                            "SELECT idPers FROM people WHERE name = %(name)s;",
-                            {"name": p[0]},
-                        )
-                        idPers = cursor.fetchone()
-                        commit = True
-                    movPeopleIDs.append(idPers["idPers"])
-
-                # get existing people for this tvs
-                cursor.execute(
-                    "SELECT idPers FROM people_link WHERE mediaType = 3 AND idMedia = %(idMovie)s;",
-                    {"idMovie": idMovie},
-                )
-                existingPers = []
-                for i in cursor.fetchall():
-                    existingPers.append(i["idPers"])
-                # link new tags to this tv_show
-                for i in range(len(movPeopleIDs)):
-                    if movPeopleIDs[i] not in existingPers:
-                        cursor.execute(
-                            "INSERT INTO people_link (idPers, idMedia, mediaType, role) VALUES (%(idPers)s, %(idMovie)s, 3, %(role)s);",
-                            {
-                                "idPers": movPeopleIDs[i],
-                                "idMovie": idMovie,
-                                "role": movPeople[i][1],
-                            },
-                        )
+                # tags and people are written in the transaction of the movie
+                linkTags(cursor, 3, idMovie, s.getTags(scraperID))
+                linkPeople(cursor, 3, idMovie, s.getPeople(scraperID))
+                break
 
         return True
@@ -1,8 +1,9 @@
 # coding: utf-8
-import requests
 import json
 import urllib.parse
 
+from app.httpClient import apiGet
+
 
 class tmdb:
     def __init__(self, apikey):
@@ -19,7 +20,8 @@ class tmdb:
 
     def getMovie(self, id):
         resp = json.loads(
-            requests.get(
+            apiGet(
+                "tmdb",
                 self._endpoint + "movie/" + str(id) + "?api_key=" + self._apikey
             ).text
         )
@@ -45,7 +47,8 @@ class tmdb:
 
     def getCollection(self, id):
         resp = json.loads(
-            requests.get(
+            apiGet(
+                "tmdb",
                 self._endpoint + "collection/" + str(id) + "?api_key=" + self._apikey
             ).text
         )
@@ -69,7 +72,8 @@ class tmdb:
         data = []
         while next:
             response = json.loads(
-                requests.get(
+                apiGet(
+                    "tmdb",
                     self._endpoint
                     + "search/movie?query="
                     + urllib.parse.quote(name)
@@ -103,7 +107,8 @@ class tmdb:
 
     def getPeople(self, idMov):
         resp = json.loads(
-            requests.get(
+            apiGet(
+                "tmdb",
                 self._endpoint
                 + "movie/"
                 + str(idMov)
@@ -120,7 +125,8 @@ class tmdb:
 
     def getTags(self, idMov):
         d = json.loads(
-            requests.get(
+            apiGet(
+                "tmdb",
                 self._endpoint + "movie/" + str(idMov) + "?api_key=" + self._apikey
             ).text
         )
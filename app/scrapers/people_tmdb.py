@@ -1,7 +1,8 @@
-import requests
 import json
 import urllib.parse
 
+from app.httpClient import apiGet
+
 class tmdb:
 
     def __init__(self, apikey):
@@ -10,7 +11,7 @@ class tmdb:
         self._apikey = apikey
 
     def getPersonDetails(self, id):
-        data = json.loads(requests.get(self._endpoint+"person/"+str(id)+"?api_key="+self._apikey).text)
+        data = json.loads(apiGet("tmdb", self._endpoint+"person/"+str(id)+"?api_key="+self._apikey).text)
         ic = None
         if data.get('profile_path') is not None:
             ic = self.baseImgUrl + data.get('profile_path')
@@ -24,7 +25,7 @@ class tmdb:
         }
 
     def getPersonData(self, name):
-        response = json.loads(requests.get(self._endpoint+"search/person?query="+urllib.parse.quote(name)+"&api_key="+self._apikey).text)
+        response = json.loads(apiGet("tmdb", self._endpoint+"search/person?query="+urllib.parse.quote(name)+"&api_key="+self._apikey).text)
         if len(response['results']) == 0:
             return None
         else:
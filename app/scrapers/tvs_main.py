@@ -8,9 +8,13 @@ from importlib import import_module
 from base64 import b64encode
 from datetime import datetime
 
-from app.files import addFile
+from app.files import addFile, probeFiles, getFullPath
 from app.scrapers.fillers import getFillers, findFillerUrl
 from app.utils import encodeImg
+from app.httpClient import fetchAll
+from app.scrapers.links import linkTags, linkPeople
+from app.watchStats import refreshShowStats
+from app.scanSnapshot import listDir, saveSnapshot, isUnchanged, clearSnapshots
 
 
 class tvs:
@@ -61,7 +65,7 @@ class tvs:
             tvs[i["path"]] = i
         return paths, tvs
 
-    def scanDir(self, path, recursive=False, addPath=""):
+    def scanDir(self, path, recursive=False, addPath="", full=False):
         self._logger.info(
             "Scan Dir Triggered, recursive: "
             + str(recursive)
@@ -70,21 +74,33 @@ class tvs:
             + " ; additionnalPath: "
             + addPath
         )
-        dirContent = os.listdir(path)
+        mtime, dirs, files = listDir(path)
+        dirContent = dirs + files
         if not recursive:
             print(dirContent)
+            if full:
+                clearSnapshots("tvs")
+            self._paths, self._tvs = self.getTVSData()
+            self._pendingShows = self.getPendingShows()
         self._existingEp = []
         self._forceUpdateEp = []
         self._idUpdateEp = {}
-        self._paths, self._tvs = self.getTVSData()
         cursor = self._connection.cursor(dictionary=True, buffered=True)
 
+        # scraper results of the files of this directory, the season directories have their own
+        fetched = {}
+        if recursive and self._currentTVS:
+            # probe and fetch the new episodes of this directory at once
+            self.getEpisodesData(cursor)
+            self.probeNewEpisodes(path, addPath, files)
+            fetched = self.fetchNewEpisodes(files)
+
+        commit = False
         for item in dirContent:
             # try:
-            commit = False
             self._logger.debug("New Item: " + str(item))
 
-            if os.path.isdir(os.path.join(path, item)):
+            if item in dirs:
                 self._logger.debug("Item is a directory")
 
                 if recursive:
@@ -108,40 +124,133 @@ class tvs:
                     and len(self._forceUpdateEp) == 0
                     and len(self._idUpdateEp) == 0
                 ):
-                    # fill the buffer with episodes that mustn't be updated
-                    cursor.execute(
-                        "SELECT CONCAT(season,'.',episode) AS epCode, idEpisode, forceUpdate from episodes WHERE idShow = "
-                        + str(self._tvs[self._currentTVS]["idShow"])
-                        + ";"
-                    )
-                    dat = cursor.fetchall()
-                    for i in dat:
-                        self._existingEp.append(i["epCode"])
-                        if i["forceUpdate"]:
-                            self._forceUpdateEp.append(i["epCode"])
-                            self._idUpdateEp[i["epCode"]] = i["idEpisode"]
-
-                    self._logger.debug("Existing episodes: " + str(self._existingEp))
-                    self._logger.debug(
-                        "Force Update episodes: " + str(self._forceUpdateEp)
-                    )
-                    self._logger.debug("ID Update episodes: " + str(self._idUpdateEp))
+                    self.getEpisodesData(cursor)
 
                 # it is an episode file
                 self._logger.debug("this is an episode file")
-                self.scanEpisode(addPath, item)
+                if self.scanEpisode(addPath, item, fetched):
+                    commit = True
 
-            if commit:
-                self._connection.commit()
-                self._logger.debug(str(cursor.rowcount) + " rows affected")
+        if commit:
+            # the episodes of this directory are written in one transaction
+            self._connection.commit()
+            self._logger.debug(str(cursor.rowcount) + " rows affected")
         # except Exception as ex:
         #    self._logger.error('New indexer exception: '+str(ex))
-        if not recursive:
+        if recursive:
+            # this directory will be skipped by the next scans if it doesn't change
+            saveSnapshot("tvs", path, mtime, dirs, self.getScanTag())
+        else:
             # scan potential fillers for all shows
             self.scanFillers()
 
         self._logger.debug("End of scan (recursive: " + str(recursive) + ")")
 
+    def scanShow(self, path, item):
+        # scan a single show directory
+        self._paths, self._tvs = self.getTVSData()
+        self._pendingShows = self.getPendingShows()
+        self.scanTVS(path, item)
+        self._connection.commit()
+
+    def getPendingShows(self):
+        # shows with episodes or seasons to update, they must be scanned even if their files didn't change
+        cursor = self._connection.cursor(dictionary=True, buffered=True)
+        cursor.execute(
+            "SELECT idShow FROM episodes WHERE forceUpdate = 1 UNION SELECT idShow FROM seasons WHERE forceUpdate = 1;"
+        )
+        return [i["idShow"] for i in cursor.fetchall()]
+
+    def getScanTag(self):
+        # a show must be scanned again if it is matched with another scraper entry
+        return (
+            str(self._tvs[self._currentTVS]["scraperName"])
+            + ":"
+            + str(self._tvs[self._currentTVS]["scraperID"])
+        )
+
+    def getEpisodesData(self, cursor):
+        # fill the buffer with episodes that mustn't be updated
+        self._existingEp = []
+        self._forceUpdateEp = []
+        self._idUpdateEp = {}
+        cursor.execute(
+            "SELECT CONCAT(season,'.',episode) AS epCode, idEpisode, forceUpdate from episodes WHERE idShow = "
+            + str(self._tvs[self._currentTVS]["idShow"])
+            + ";"
+        )
+        dat = cursor.fetchall()
+        for i in dat:
+            self._existingEp.append(i["epCode"])
+            if i["forceUpdate"]:
+                self._forceUpdateEp.append(i["epCode"])
+                self._idUpdateEp[i["epCode"]] = i["idEpisode"]
+
+        self._logger.debug("Existing episodes: " + str(self._existingEp))
+        self._logger.debug("Force Update episodes: " + str(self._forceUpdateEp))
+        self._logger.debug("ID Update episodes: " + str(self._idUpdateEp))
+
+    def getEpisodeCode(self, item):
+        # returns the (season, episode) of an episode file, or None
+        if item[item.rfind(".") + 1 :] not in self._supportedFiles:
+            return None
+        season = re.findall("(?i)(?:s)(\\d+)(?:e)", item)
+        episode = re.findall("(?i)(?:s\\d+e)(\\d+)(?:\\.)", item)
+        if len(season) == 0 or len(episode) == 0:
+            return None
+        return (int(season[0]), int(episode[0]))
+
+    def getScraper(self):
+        # returns the scraper of the current show
+        for s in self._scrapers:
+            if s.__class__.__name__ == self._tvs[self._currentTVS]["scraperName"]:
+                return s
+        return None
+
+    def probeNewEpisodes(self, path, addPath, dirContent):
+        files = []
+        for item in dirContent:
+            code = self.getEpisodeCode(item)
+            if code is None or str(code[0]) + "." + str(code[1]) in self._existingEp:
+                continue
+            if addPath != "":
+                filePath = (
+                    self._tvs[self._currentTVS]["path"] + "/" + addPath + "/" + item
+                )
+            else:
+                filePath = self._tvs[self._currentTVS]["path"] + "/" + item
+            files.append(getFullPath(filePath.encode(), 1))
+        if len(files) > 0:
+            probeFiles(files)
+
+    def fetchNewEpisodes(self, dirContent):
+        # get the scraper results of the episodes to create or update concurrently
+        # returns {(season, episode): result}
+        fetched = {}
+        scraper = self.getScraper()
+        if scraper is None:
+            return fetched
+        show = self._tvs[self._currentTVS]
+        args = []
+        for item in dirContent:
+            code = self.getEpisodeCode(item)
+            if code is None:
+                continue
+            epCode = str(code[0]) + "." + str(code[1])
+            if epCode not in self._existingEp or epCode in self._forceUpdateEp:
+                args.append((show["scraperID"], code[0], code[1], show["scraperData"]))
+        if len(args) == 0:
+            return fetched
+        if show["scraperData"] is not None:
+            # the first request fills the episode group cache of the scraper
+            fetched[args[0][1:3]] = scraper.getTVSEp(*args[0])
+            args = args[1:]
+        self._logger.debug("Fetching " + str(len(args)) + " episodes")
+        for a, result in zip(args, fetchAll(scraper.getTVSEp, args)):
+            if result is not None:
+                fetched[a[1:3]] = result
+        return fetched
+
     def scanTVS(self, path, item):
         cursor = self._connection.cursor(dictionary=True, buffered=True)
         commit = False
@@ -214,15 +323,24 @@ class tvs:
                 # tvs is ok, call scan on tvs folder
                 self._seasons = []
                 self._currentTVS = item
-                # scan for subfolders/files
-                self.scanDir(os.path.join(path, item), True)
-                # scan for seasons
-                if self.scanSeasons():
-                    commit = True
-                # scan for tags and people
-                if self.scanShowData():
+                if (
+                    self._tvs[item]["idShow"] not in self._pendingShows
+                    and isUnchanged("tvs", os.path.join(path, item), self.getScanTag())
+                ):
+                    self._logger.debug("D- Item unchanged since last scan, skipping")
+                else:
+                    # scan for subfolders/files
+                    self.scanDir(os.path.join(path, item), True)
+                    # scan for seasons
+                    if self.scanSeasons():
+                        commit = True
+                    # scan for tags and people
+                    if self.scanShowData():
+                        commit = True
+                    # update the episode counts of the show
+                    refreshShowStats(cursor, self._tvs[item]["idShow"])
                     commit = True
-                self._logger.debug("D- Item ok, scanning subdirectories")
+                    self._logger.debug("D- Item ok, scanning subdirectories")
         else:
             # entries for this tvs doesn't exists, create entry with multipleResults
             self._logger.debug("Entries for this item doesn't exists in database")
@@ -244,7 +362,7 @@ class tvs:
             self._connection.commit()
             self._logger.debug(str(cursor.rowcount) + "were affected")
 
-    def scanEpisode(self, path, item):
+    def scanEpisode(self, path, item, fetched: dict):
         extension = item[item.rfind(".") + 1 :]
         self._logger.debug(
             "The extension for: " + self._currentTVS + " is: " + extension
@@ -281,11 +399,11 @@ class tvs:
                         "id": None,
                     }
 
-                    for s in self._scrapers:
-                        if (
-                            s.__class__.__name__
-                            == self._tvs[self._currentTVS]["scraperName"]
-                        ):
+                    if (season, episode) in fetched:
+                        result.update(fetched[(season, episode)])
+                    else:
+                        s = self.getScraper()
+                        if s is not None:
                             self._logger.debug(
                                 "Getting " + str(s.__class__.__name__) + " results"
                             )
@@ -297,7 +415,6 @@ class tvs:
                                     self._tvs[self._currentTVS]["scraperData"],
                                 )
                             )
-                            break
 
                     forceUpdate = 0
                     if "overview" not in result or (
@@ -371,9 +488,7 @@ class tvs:
             else:
                 self._logger.warning("Cannot extract season or episode from file name")
 
-        if commit:
-            self._connection.commit()
-            self._logger.debug(str(cursor.rowcount) + "were affected")
+        return commit
 
     def scanSeasons(self):
         # scan seasons for a tv_show
@@ -394,10 +509,22 @@ class tvs:
         for s in self._scrapers:
             if s.__class__.__name__ == self._tvs[self._currentTVS]["scraperName"]:
                 self._logger.debug("Getting " + str(s.__class__.__name__) + " results")
+                # get the seasons to create or update concurrently
+                seasons = [
+                    season
+                    for season in self._seasons
+                    if season not in existingSeasons or season not in noUpdate
+                ]
+                fetched = dict(
+                    zip(
+                        seasons,
+                        fetchAll(s.getTVSSeason, [(scraperID, i) for i in seasons]),
+                    )
+                )
                 for season in self._seasons:
                     if season not in existingSeasons:
                         # season don't already exists, and must be created
-                        data = s.getTVSSeason(scraperID, season)
+                        data = fetched.get(season) or s.getTVSSeason(scraperID, season)
                         queryData = {
                             "idShow": idShow,
                             "title": data["title"],
@@ -414,7 +541,7 @@ class tvs:
                         commit = True
                     elif season not in noUpdate:
                         # season already exists and must be updated
-                        data = s.getTVSSeason(scraperID, season)
+                        data = fetched.get(season) or s.getTVSSeason(scraperID, season)
                         queryData = {
                             "idShow": idShow,
                             "title": data["title"],
@@ -442,89 +569,19 @@ class tvs:
             if s.__class__.__name__ == self._tvs[self._currentTVS]["scraperName"]:
                 self._logger.debug("Getting " + str(s.__class__.__name__) + " results")
 
-                # tags part
-                newTags = []
-                for t in s.getTags(scraperID):
-                    cursor.execute(
-                        "SELECT idTag FROM tags where name = %(name)s AND value = %(value)s;",
-                        {"name": t[0], "value": t[1]},
-                    )
-                    idTag = cursor.fetchone()
-                    if idTag == None:
-                        # create tag if new
-                        cursor.execute(
-                            "INSERT INTO tags (name, value, icon) VALUES (%(name)s, %(value)s, %(icon)s);",
-                            {"name": t[0], "value": t[1], "icon": encodeImg(t[2])},
-                        )
-                        # get tag id
-                        cursor.execute(
-                            "SELECT idTag FROM tags where name = %(name)s AND value = %(value)s;",
-                            {"name": t[0], "value": t[1]},
-                        )
-                        idTag = cursor.fetchone()
-                        commit = True
-                    newTags.append(idTag["idTag"])
-
-                # get existing tags for this tvs
-                cursor.execute(
-                    "SELECT idTag FROM tags_link WHERE mediaType = 2 AND idMedia = %(idShow)s;",
-                    {"idShow": idShow},
+                # tags and people are fetched concurrently
+                tags, tvsPeople = fetchAll(
+                    lambda f: f(scraperID), [(s.getTags,), (s.getPeople,)]
                 )
-                existingTags = []
-                for i in cursor.fetchall():
-                    existingTags.append(i["idTag"])
-                # link new tags to this tv_show
-                for i in newTags:
-                    if i not in existingTags:
-                        cursor.execute(
-                            "INSERT INTO tags_link (idTag, idMedia, mediaType) VALUES (%(idTag)s, %(idShow)s, 2);",
-                            {"idTag": i, "idShow": idShow},
-                        )
-                        commit = True
+                if tags is None or tvsPeople is None:
+                    break
 
-                # people part
-                tvsPeople = s.getPeople(scraperID)
-                tvsPeopleIDs = []
-                for p in tvsPeople:
-                    cursor.execute(
-                        "SELECT idPers FROM people WHERE name = %(name)s;",
-                        {"name": p[0]},
-                    )
-                    idPers = cursor.fetchone()
-                    if idPers == None:
-                        # create person if new
-                        cursor.execute(
-                            "INSERT INTO people (name) VALUES (%(name)s);",
-                            {"name": p[0]},
-                        )
-                        # get person id
-                        cursor.execute(
-                            "SELECT idPers FROM people WHERE name = %(name)s;",
-                            {"name": p[0]},
-                        )
-                        idPers = cursor.fetchone()
-                        commit = True
-                    tvsPeopleIDs.append(idPers["idPers"])
-
-                # get existing people for this tvs
-                cursor.execute(
-                    "SELECT idPers FROM people_link WHERE mediaType = 2 AND idMedia = %(idShow)s;",
-                    {"idShow": idShow},
-                )
-                existingPers = []
-                for i in cursor.fetchall():
-                    existingPers.append(i["idPers"])
-                # link new tags to this tv_show
-                for i in range(len(tvsPeopleIDs)):
-                    if tvsPeopleIDs[i] not in existingPers:
-                        cursor.execute(
-                            "INSERT INTO people_link (idPers, idMedia, mediaType, role) VALUES (%(idPers)s, %(idShow)s, 2, %(role)s);",
-                            {
-                                "idPers": tvsPeopleIDs[i],
-                                "idShow": idShow,
-                                "role": tvsPeople[i][1],
-                            },
-                        )
+                # tags and people are written in the transaction of the show
+                if linkTags(cursor, 2, idShow, tags):
+                    commit = True
+                if linkPeople(cursor, 2, idShow, tvsPeople):
+                    commit = True
+                break
 
         return commit
 
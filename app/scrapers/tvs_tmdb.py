@@ -1,9 +1,10 @@
 # coding: utf-8
-import requests
 import json
 import urllib.parse
 from datetime import datetime
 
+from app.httpClient import apiGet
+
 
 class tmdb:
     def __init__(self, apikey):
@@ -20,7 +21,8 @@ class tmdb:
 
     def getTVS(self, idTvs):
         resp = json.loads(
-            requests.get(
+            apiGet(
+                "tmdb",
                 self._endpoint + "tv/" + str(idTvs) + "?api_key=" + self._apikey
             ).text
         )
@@ -37,7 +39,8 @@ class tmdb:
 
     def getTVSSeason(self, idTvs, season):
         resp = json.loads(
-            requests.get(
+            apiGet(
+                "tmdb",
                 self._endpoint
                 + "tv/"
                 + str(idTvs)
@@ -62,7 +65,8 @@ class tmdb:
 
     def getPeople(self, idTvs):
         resp = json.loads(
-            requests.get(
+            apiGet(
+                "tmdb",
                 self._endpoint + "tv/" + str(idTvs) + "/credits?api_key=" + self._apikey
             ).text
         )
@@ -75,8 +79,10 @@ class tmdb:
 
     def getUpcomingEpisode(self, idTvs):
         d = json.loads(
-            requests.get(
-                self._endpoint + "tv/" + str(idTvs) + "?api_key=" + self._apikey
+            apiGet(
+                "tmdb",
+                self._endpoint + "tv/" + str(idTvs) + "?api_key=" + self._apikey,
+                3600,
             ).text
         )
         if (
@@ -99,7 +105,8 @@ class tmdb:
 
     def getTags(self, idTvs):
         d = json.loads(
-            requests.get(
+            apiGet(
+                "tmdb",
                 self._endpoint + "tv/" + str(idTvs) + "?api_key=" + self._apikey
             ).text
         )
@@ -126,7 +133,8 @@ class tmdb:
     def getTVSEp(self, id, season, episode, scraperData=None):
         if scraperData == None:
             resp = json.loads(
-                requests.get(
+                apiGet(
+                    "tmdb",
                     self._endpoint
                     + "tv/"
                     + str(id)
@@ -156,7 +164,8 @@ class tmdb:
                     id,
                     scraperData,
                     json.loads(
-                        requests.get(
+                        apiGet(
+                            "tmdb",
                             self._endpoint
                             + "tv/episode_group/"
                             + str(scraperData)
@@ -204,7 +213,8 @@ class tmdb:
         results = []
         while next:
             response = json.loads(
-                requests.get(
+                apiGet(
+                    "tmdb",
                     self._endpoint
                     + "search/tv?query="
                     + urllib.parse.quote(name)
@@ -225,7 +235,8 @@ class tmdb:
         while i < d:
             res = data[i]
             epGroup = json.loads(
-                requests.get(
+                apiGet(
+                    "tmdb",
                     self._endpoint
                     + "tv/"
                     + str(res["id"])
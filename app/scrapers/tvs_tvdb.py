@@ -1,15 +1,35 @@
-import requests
 import json
 import urllib.parse
 from datetime import datetime
 
+from app.httpClient import apiGet, apiPost
+from app.dbHelper import r_cache
+
 class tvdb:
 
     def __init__(self, apiKey):
         self._endpoint = "https://api.thetvdb.com"
-        token = json.loads(requests.post(self._endpoint+"/login",data=json.dumps({"apikey":apiKey}), headers={"Content-type":"application/json", "Accept": "application/json"}).text)["token"]
+        self._apiKey = apiKey
+        self._login()
+
+    def _login(self, refresh=False):
+        # the token is valid for 24h and shared between the scanners
+        token = r_cache.get("tvdb:token")
+        if token is None or refresh:
+            token = json.loads(apiPost("tvdb", self._endpoint+"/login",data=json.dumps({"apikey":self._apiKey}), headers={"Content-type":"application/json", "Accept": "application/json"}).text)["token"]
+            r_cache.set("tvdb:token", token, ex=23*3600)
+        elif isinstance(token, bytes):
+            token = token.decode("utf-8")
         self._headers = {"Accept":"application/json", "Content-type":"application/json", "Accept-Language":"en", "Authorization": "Bearer "+token}
 
+    def _get(self, url, **kwargs):
+        resp = apiGet("tvdb", url, headers=self._headers, **kwargs)
+        if resp.status_code == 401:
+            # the token expired
+            self._login(True)
+            resp = apiGet("tvdb", url, headers=self._headers, **kwargs)
+        return resp
+
     def getImg(self, img, isBanner):
         if img is None:
             return None
@@ -22,7 +42,7 @@ class tvdb:
         
     def searchTVS(self, name):
         results = []
-        resp = json.loads(requests.get(self._endpoint+"/search/series?name="+urllib.parse.quote(name), headers=self._headers).text)
+        resp = json.loads(self._get(self._endpoint+"/search/series?name="+urllib.parse.quote(name)).text)
         if "Error" not in resp and 'data' in resp:
             for item in resp['data']:
                 inProd = False
@@ -41,7 +61,7 @@ class tvdb:
         return results
 
     def getTVS(self, id):
-        resp = json.loads(requests.get(self._endpoint+"/series/"+str(id), headers=self._headers).text)
+        resp = json.loads(self._get(self._endpoint+"/series/"+str(id)).text)
         if 'data' in resp:
             resp = resp['data']
             return {
@@ -67,9 +87,9 @@ class tvdb:
             }
 
     def getTVSSeason(self, id, season):
-        d = json.loads(requests.get(self._endpoint+"/series/"+str(id)+"/images/query?keyType=season&subKey="+str(season), headers=self._headers).text)
+        d = json.loads(self._get(self._endpoint+"/series/"+str(id)+"/images/query?keyType=season&subKey="+str(season)).text)
         try:
-            date = json.loads(requests.get(self._endpoint+"/series/"+str(id)+"/episodes/query?airedSeason="+str(season)+"&airedEpisode=1", headers=self._headers).text)['data'][0]['firstAired']
+            date = json.loads(self._get(self._endpoint+"/series/"+str(id)+"/episodes/query?airedSeason="+str(season)+"&airedEpisode=1").text)['data'][0]['firstAired']
         except Exception:
             date = 'Unknown'
         try:
@@ -86,16 +106,16 @@ class tvdb:
                 }
 
     def getPeople(self, id):
-        d = json.loads(requests.get(self._endpoint+"/series/"+str(id)+"/actors", headers=self._headers).text)
+        d = json.loads(self._get(self._endpoint+"/series/"+str(id)+"/actors").text)
         people = []
         for p in d['data']:
             people.append([p.get('name'), p.get('role')])
         return people
         
     def getUpcomingEpisode(self, id):
-        d = json.loads(requests.get(self._endpoint+"/series/"+str(id)+"/episodes", headers=self._headers).text)
+        d = json.loads(self._get(self._endpoint+"/series/"+str(id)+"/episodes", ttl=3600).text)
         if d['links']['last'] != 1:
-            d = json.loads(requests.get(self._endpoint+"/series/"+str(id)+"/episodes?page="+str(d['links']['last']), headers=self._headers).text)
+            d = json.loads(self._get(self._endpoint+"/series/"+str(id)+"/episodes?page="+str(d['links']['last']), ttl=3600).text)
         for ep in d['data']:
             if ep.get('firstAired') is not None and ep.get('firstAired') != '' and datetime.strptime(ep.get('firstAired'), '%Y-%m-%d') > datetime.now():
                 return {
@@ -111,7 +131,7 @@ class tvdb:
         return None
 
     def getTags(self, idTvs):
-        d = json.loads(requests.get(self._endpoint+"/series/"+str(idTvs), headers=self._headers).text)['data']
+        d = json.loads(self._get(self._endpoint+"/series/"+str(idTvs)).text)['data']
         tags = []
         if 'network' in d:
             tags.append(['network', d['network'], None])
@@ -123,7 +143,7 @@ class tvdb:
         return tags
 
     def getTVSEp(self, id, season, episode=None, scraperData=None):
-        resp = json.loads(requests.get(self._endpoint+"/series/"+str(id)+"/episodes/query?airedSeason="+str(season)+"&airedEpisode="+str(episode), headers=self._headers).text)
+        resp = json.loads(self._get(self._endpoint+"/series/"+str(id)+"/episodes/query?airedSeason="+str(season)+"&airedEpisode="+str(episode)).text)
         if 'data' in resp and len(resp['data']) > 0:
             resp = resp['data'][0]
             return {
@@ -0,0 +1,132 @@
+import re
+
+"""
+full-text search over the library, using the FULLTEXT indexes of migration 005
+    episodes, tv_shows, movies : (title, overview)
+    people : (name)
+the words shorter than the minimum indexed length (3 by default with InnoDB) are searched as title prefixes
+the queries are built without a database, so that tests/test_query_plans.py can explain them
+"""
+
+_minWordLength = 3
+# tables searched for each media type
+_mediaTables = {
+    1: ("episodes", "idEpisode"),
+    2: ("tv_shows", "idShow"),
+    3: ("movies", "idMovie"),
+}
+# a media found through one of its people ranks lower than a media found by its title or overview
+_peopleWeight = 0.5
+
+
+def _getWords(text: str) -> list:
+    # the operators of the boolean mode are removed from the user input
+    return [w for w in re.split(r"[\s+\-<>()~*\"@]+", str(text)) if w != ""]
+
+
+def _toBoolean(words: list) -> str:
+    # every word must match, the last one can be the beginning of a word
+    query = ["+" + w for w in words[:-1]] + ["+" + words[-1] + "*"]
+    return " ".join(query)
+
+
+def searchMediaQuery(text: str, mediaTypes: list, limit: int = None) -> tuple:
+    # returns the query of the medias matching the text and its parameters,
+    # None if there is nothing to search
+    words = _getWords(text)
+    if len(words) == 0 or len(mediaTypes) == 0:
+        return None
+    queries = []
+    data = {"limit": limit}
+    if len([w for w in words if len(w) >= _minWordLength]) > 0:
+        data["query"] = _toBoolean([w for w in words if len(w) >= _minWordLength])
+        for t in mediaTypes:
+            table, idField = _mediaTables[t]
+            queries.append(
+                "SELECT " + str(t) + " AS mediaType, " + idField + " AS idMedia, "
+                "MATCH (title, overview) AGAINST (%(query)s IN BOOLEAN MODE) AS score "
+                "FROM " + table + " WHERE MATCH (title, overview) AGAINST (%(query)s IN BOOLEAN MODE)"
+            )
+        queries.append(
+            "SELECT l.mediaType, l.idMedia, MATCH (p.name) AGAINST (%(query)s IN BOOLEAN MODE) * "
+            + str(_peopleWeight)
+            + " AS score FROM people p INNER JOIN people_link l ON (l.idPers = p.idPers) "
+            "WHERE MATCH (p.name) AGAINST (%(query)s IN BOOLEAN MODE) AND l.mediaType IN ("
+            + ", ".join(str(int(t)) for t in mediaTypes)
+            + ")"
+        )
+    else:
+        # too short to be indexed, search the beginning of the titles
+        data["prefix"] = " ".join(words) + "%"
+        for t in mediaTypes:
+            table, idField = _mediaTables[t]
+            queries.append(
+                "SELECT " + str(t) + " AS mediaType, " + idField + " AS idMedia, 1 AS score "
+                "FROM " + table + " WHERE title LIKE %(prefix)s"
+            )
+
+    query = (
+        "SELECT mediaType, idMedia, MAX(score) AS score FROM ("
+        + " UNION ALL ".join(queries)
+        + ") r GROUP BY mediaType, idMedia ORDER BY score DESC"
+    )
+    if limit is not None:
+        query += " LIMIT %(limit)s"
+    return query + ";", data
+
+
+def searchMedia(cursor, text: str, mediaTypes: list, limit: int = None) -> dict:
+    # returns the medias matching the text with their score {(mediaType, idMedia): score}
+    # only the limit best ones if a limit is given
+    query = searchMediaQuery(text, mediaTypes, limit)
+    if query is None:
+        return {}
+    cursor.execute(*query)
+    return {(r["mediaType"], r["idMedia"]): float(r["score"]) for r in cursor.fetchall()}
+
+
+def searchPeople(cursor, name: str, limit: int, offset: int = 0) -> list:
+    # returns the people matching the name, the best matches first
+    words = _getWords(name)
+    if len(words) == 0:
+        return []
+    fields = "idPers AS id, name, gender, birthdate, deathdate, description, known_for, CONCAT('/api/core/image/',icon) AS icon"
+    data = {"limit": limit, "offset": offset}
+    if len([w for w in words if len(w) >= _minWordLength]) > 0:
+        data["query"] = _toBoolean([w for w in words if len(w) >= _minWordLength])
+        cursor.execute(
+            "SELECT " + fields + " FROM people "
+            "WHERE MATCH (name) AGAINST (%(query)s IN BOOLEAN MODE) "
+            "ORDER BY MATCH (name) AGAINST (%(query)s IN BOOLEAN MODE) DESC, name "
+            "LIMIT %(limit)s OFFSET %(offset)s;",
+            data,
+        )
+    else:
+        data["prefix"] = " ".join(words) + "%"
+        cursor.execute(
+            "SELECT " + fields + " FROM people WHERE name LIKE %(prefix)s "
+            "ORDER BY name LIMIT %(limit)s OFFSET %(offset)s;",
+            data,
+        )
+    return cursor.fetchall()
+
+
+def linkedMediaQuery(table: str, field: str, ids: list, allIds: bool) -> tuple:
+    # returns the query of the medias linked to the tags or people and its parameters
+    query = (
+        "SELECT mediaType, idMedia FROM " + table + " WHERE " + field + " IN ("
+        + ", ".join(["%s"] * len(ids))
+        + ") GROUP BY mediaType, idMedia"
+    )
+    if allIds:
+        query += " HAVING COUNT(DISTINCT " + field + ") = " + str(len(set(ids)))
+    return query + ";", ids
+
+
+def getLinkedMedia(cursor, table: str, field: str, ids: list, allIds: bool) -> set:
+    # medias linked to the tags or people, to any of them or to all of them (allIds)
+    ids = [int(i) for i in ids]
+    if len(ids) == 0:
+        return set()
+    cursor.execute(*linkedMediaQuery(table, field, ids, allIds))
+    return set((r["mediaType"], r["idMedia"]) for r in cursor.fetchall())
@@ -23,9 +23,10 @@ from .core import core
 from .player import player
 from .device import device
 from .tracker import tracker
-from .dbHelper import r_runningThreads, r_userTokens, configData
-from .utils import getUID, checkUser
+from .dbHelper import r_runningThreads, r_userTokens, configData, closeSqlConnections
+from .utils import getUID, checkUser, bumpLibraryVersion
 from .watcher import startWatcher
+from .libraryWatcher import startLibraryWatcher
 from .socketio import sio
 
 """
@@ -39,6 +40,7 @@ DB:
 """
 
 startWatcher()
+startLibraryWatcher()
 
 r_runningThreads.set("tvs", 0)
 r_runningThreads.set("movies", 0)
@@ -81,6 +83,25 @@ def before_request():
         abort(403)
 
 
+@app.after_request
+def after_request(response):
+    # the write requests (status, scraper ids, deletions...) invalidate the etags of the listings
+    if (
+        request.method in ["POST", "PUT", "DELETE"]
+        and response.status_code < 400
+        and request.endpoint is not None
+        and request.endpoint.split(".")[0] in ["tvs", "movie", "core"]
+        and request.endpoint != "core.search_main"
+    ):
+        bumpLibraryVersion()
+    return response
+
+
+@app.teardown_request
+def teardown_request(exception):
+    closeSqlConnections()
+
+
 @app.route("/api/", methods=["GET"])
 def home():
     return "Zogwine API"
@@ -0,0 +1,159 @@
+import os
+import re
+import hashlib
+import secrets
+import subprocess
+from flask import abort
+
+from .log import logger
+from .dbHelper import configData
+
+"""
+text subtitles extracted to WebVTT, cached in <outDir>/subtitles/<key>.vtt
+the key is computed from the path, the stream index, the size and the mtime of the source,
+the time offset of startFrom is applied when the cached file is read
+the mtime of a cached file is its last use, the least recently used files are removed
+when the cache is larger than subtitleCacheSize (MB)
+"""
+
+_timing = re.compile(r"^((?:\d+:)?\d{2}:\d{2}\.\d{3}) --> ((?:\d+:)?\d{2}:\d{2}\.\d{3})(.*)$")
+
+
+def _getCacheDir() -> str:
+    path = os.path.join(configData["config"]["outDir"], "subtitles")
+    if not os.path.exists(path):
+        os.makedirs(path, exist_ok=True)
+    return path
+
+
+def getSubtitleKey(path: bytes, stream: str) -> str:
+    st = os.stat(path)
+    return hashlib.sha1(
+        path
+        + b"|"
+        + str(stream).encode("utf-8")
+        + b"|"
+        + str(st.st_size).encode("utf-8")
+        + b"|"
+        + str(st.st_mtime).encode("utf-8")
+    ).hexdigest()
+
+
+def _parseTime(t: str) -> float:
+    parts = t.split(":")
+    return sum(float(p) * 60 ** i for i, p in enumerate(reversed(parts)))
+
+
+def _formatTime(t: float) -> str:
+    ms = int(round(t * 1000))
+    return "%02d:%02d:%02d.%03d" % (
+        ms // 3600000,
+        ms // 60000 % 60,
+        ms // 1000 % 60,
+        ms % 1000,
+    )
+
+
+def _shiftCue(cue: list, offset: float) -> list:
+    # returns the cue lines with the timing moved by -offset, None if the cue ends before 0
+    for i, line in enumerate(cue):
+        m = _timing.match(line)
+        if m:
+            start = _parseTime(m.group(1)) - offset
+            end = _parseTime(m.group(2)) - offset
+            if end <= 0:
+                return None
+            cue = list(cue)
+            cue[i] = _formatTime(max(start, 0)) + " --> " + _formatTime(end) + m.group(3)
+            return cue
+    return cue
+
+
+def _shiftLines(lines, offset: float):
+    # yields the WebVTT lines, the cues being shifted by offset seconds
+    cue = []
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if line != "":
+            cue.append(line)
+            continue
+        if len(cue) > 0:
+            cue = _shiftCue(cue, offset) if offset > 0 else cue
+            if cue is not None:
+                yield "\n".join(cue) + "\n\n"
+        cue = []
+    if len(cue) > 0:
+        cue = _shiftCue(cue, offset) if offset > 0 else cue
+        if cue is not None:
+            yield "\n".join(cue) + "\n"
+
+
+def _extract(path: bytes, stream: str, cacheFile: str):
+    # run ffmpeg and yield its output while writing it to the cache
+    cmd = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-i", path]
+    if stream != "file":
+        cmd += ["-map", "0:s:" + str(stream)]
+    cmd += ["-f", "webvtt", "-"]
+    tmpFile = cacheFile + "." + secrets.token_hex(8) + ".tmp"
+    p = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+    complete = False
+    try:
+        with open(tmpFile, "w", encoding="utf-8") as f:
+            for line in p.stdout:
+                line = line.decode("utf-8", "replace")
+                f.write(line)
+                yield line
+        complete = p.wait() == 0
+    finally:
+        if p.poll() is None:
+            # the client went away, the partial output is not kept
+            p.kill()
+            p.wait()
+        if complete:
+            os.replace(tmpFile, cacheFile)
+            enforceSubtitleBudget()
+        else:
+            logger.warning("Subtitle extraction failed for " + str(path))
+            if os.path.exists(tmpFile):
+                os.remove(tmpFile)
+
+
+def _readFile(f):
+    with f:
+        for line in f:
+            yield line
+
+
+def enforceSubtitleBudget():
+    # remove the least recently used files until the cache fits in subtitleCacheSize (MB)
+    budget = configData["config"].get("subtitleCacheSize", 500) * 1024 ** 2
+    entries = []
+    total = 0
+    for entry in os.scandir(_getCacheDir()):
+        if entry.is_file(follow_symlinks=False) and entry.name.endswith(".vtt"):
+            st = entry.stat(follow_symlinks=False)
+            total += st.st_size
+            entries.append((st.st_mtime, entry.path, st.st_size))
+
+    for mtime, path, size in sorted(entries):
+        if total <= budget:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def streamSubtitles(path: bytes, stream: str, startFrom: float = 0):
+    # yields the WebVTT subtitles of a text stream ("file" for an external subtitle file)
+    if not os.path.isfile(path):
+        abort(404)
+    cacheFile = os.path.join(_getCacheDir(), getSubtitleKey(path, stream) + ".vtt")
+    try:
+        # last use of the file, for the eviction
+        os.utime(cacheFile)
+        lines = _readFile(open(cacheFile, "r", encoding="utf-8"))
+    except FileNotFoundError:
+        lines = _extract(path, stream, cacheFile)
+    return _shiftLines(lines, float(startFrom))
@@ -2,6 +2,8 @@ from abc import ABC, abstractmethod
 from app.dbHelper import getSqlConnection
 from fuzzywuzzy import fuzz, process
 from app.log import logger
+from app.watchStats import updateWatchStats
+from app.utils import bumpLibraryVersion
 
 
 class BaseTracker(ABC):
@@ -63,7 +65,10 @@ class BaseTracker(ABC):
                 "UPDATE status SET watchCount = %(count)s, watchTime = %(time)s, lastDate = %(date)s WHERE mediaType = %(mediaType)s AND idMedia = %(mediaData)s AND idUser = %(idUser)s",
                 data,
             )
+        if mediaType == 1:
+            updateWatchStats(cursor, self._idUser, mediaData)
         self._connection.commit()
+        bumpLibraryVersion()
 
     def _addTrackerEntry(
         self, mediaType: int, mediaData: str, trackerData: str, enabled: int = 1
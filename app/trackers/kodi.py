@@ -1,10 +1,10 @@
 from app.dbHelper import getSqlConnection
+from app.httpClient import getSession
 from app.log import logger
 from app.exceptions import InvalidArgument
 from app.trackers.TVSTracker import TVSTracker
 from app.trackers.MovieTracker import MovieTracker
 
-import requests
 import json
 
 
@@ -26,7 +26,8 @@ class kodi(TVSTracker, MovieTracker):
             self._auth = None
 
     def __apiCall(self, data):
-        return requests.post(
+        # the library requests can be long
+        return getSession("trackers", 120).post(
             "http://" + self._address + ":" + str(self._port) + "/jsonrpc",
             auth=self._auth,
             data=json.dumps(data),
@@ -0,0 +1,210 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+
+from .log import logger
+from .transcoder import transcoder
+from .dbHelper import r_cache, r_userFiles, configData
+
+"""
+r_cache: shared transcode cache, an encode is identified by a key computed from
+the transcoder settings, so users watching the same media with the same
+settings share the same ffmpeg process and output directory
+    transcode:<key> : transcoder data of the encode (same as r_userFiles "transcoder")
+    transcode:<key>:users : sorted set of the uids using this encode, scored by the last time
+        they requested it (a user that stops requesting it stops protecting it from eviction)
+    transcode:<key>:atime : last time this encode was used
+"""
+
+# transcoder fields that change the produced segments
+_keyFields = [
+    "_file",
+    "_audioStream",
+    "_subStream",
+    "_subFile",
+    "_resize",
+    "_remove3D",
+    "_encoder",
+    "_crf",
+    "_hlsTime",
+    "_abr",
+]
+
+
+def getCacheKey(tr: transcoder) -> str:
+    data = json.loads(tr.toJSON())
+    fields = _keyFields + ["onDemand"]
+    data["onDemand"] = tr.isOnDemand()
+    if not data["onDemand"]:
+        # a linear encode only contains what comes after startFrom
+        fields = fields + ["_startFrom"]
+    return hashlib.sha1(
+        json.dumps({k: data.get(k) for k in fields}, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+def getSharedOutputDir(key: str) -> str:
+    return os.path.join(configData["config"]["outDir"], "shared", key)
+
+
+def resolveTranscoder(data: dict) -> dict:
+    # returns the up to date transcoder data for a r_userFiles "transcoder" entry
+    if "cacheKey" not in data:
+        return data
+    d = r_cache.get("transcode:" + data["cacheKey"])
+    if d is None:
+        return data
+    d = json.loads(d)
+    d["cacheKey"] = data["cacheKey"]
+    return d
+
+
+def updateTranscoder(key: str, data: dict):
+    data["cacheKey"] = key
+    r_cache.set("transcode:" + key, json.dumps(data))
+
+
+def acquireTranscoder(uid: int, tr: transcoder) -> dict:
+    # use the encode matching the transcoder settings, and start it if needed
+    key = getCacheKey(tr)
+    tr._outDir = getSharedOutputDir(key)
+    tr._outFile = tr._outDir.encode("utf-8") + b"/stream"
+    tr.setSession(cacheKey=key)
+
+    with r_cache.lock("transcode:" + key + ":lock", timeout=60):
+        data = r_cache.get("transcode:" + key)
+        if data is not None:
+            data = json.loads(data)
+            if not _isUsable(data):
+                data = None
+            elif data.get("onDemand", False):
+                # make sure that the segment this user starts at will be encoded
+                cached = transcoder.fromJSON(data["classData"])
+                num = int(float(tr._startFrom) // float(tr._hlsTime))
+                if not os.path.exists(
+                    os.path.join(cached._outDir, cached.getSegmentName(num))
+                ) and not (transcoder.isRunning(data) and cached.isInWindow(num)):
+                    transcoder.stop(data, False)
+                    data = cached.startSegment(num)
+                    updateTranscoder(key, data)
+
+        if data is None:
+            enforceCacheBudget()
+            logger.info("Starting shared transcoder " + key)
+            data = tr.start()
+            updateTranscoder(key, data)
+
+        r_cache.zadd("transcode:" + key + ":users", {str(uid): time.time()})
+        r_cache.set("transcode:" + key + ":atime", time.time())
+
+    userData = {
+        "cacheKey": key,
+        "outDir": data["outDir"],
+        "startTime": data["startTime"],
+        "onDemand": data.get("onDemand", False),
+        "playlist": data.get("playlist", "stream.m3u8"),
+        "firstSegment": data.get("firstSegment", "stream001.ts"),
+        # the on-demand encodes are shared whatever the position of the user
+        "startFrom": float(tr._startFrom),
+    }
+    if userData["onDemand"]:
+        userData["firstSegment"] = tr.getSegmentName(
+            int(float(tr._startFrom) // float(tr._hlsTime))
+        )
+    return userData
+
+
+def releaseTranscoder(uid: int, data: dict):
+    # stop using an encode, ffmpeg is stopped when nobody uses it anymore but the
+    # output is kept on disk until the cache is full
+    key = data["cacheKey"]
+    with r_cache.lock("transcode:" + key + ":lock", timeout=60):
+        r_cache.zrem("transcode:" + key + ":users", str(uid))
+        r_cache.set("transcode:" + key + ":atime", time.time())
+        if _countUsers(key) == 0:
+            logger.info("Stopping unused shared transcoder " + key)
+            transcoder.stop(resolveTranscoder(data), False)
+    enforceCacheBudget()
+
+
+def touchTranscoder(uid: int, data: dict):
+    # the user is still using the encode
+    if "cacheKey" in data:
+        r_cache.zadd(
+            "transcode:" + data["cacheKey"] + ":users", {str(uid): time.time()}, xx=True
+        )
+        r_cache.set("transcode:" + data["cacheKey"] + ":atime", time.time())
+
+
+def _countUsers(key: str) -> int:
+    # remove the users that did not stop the encode but stopped using it
+    # (closed or crashed client), then count the remaining ones
+    users = "transcode:" + key + ":users"
+    r_cache.zremrangebyscore(
+        users, 0, time.time() - configData["config"].get("cacheUserTimeout", 14400)
+    )
+    for uid in r_cache.zrange(users, 0, -1):
+        data = r_userFiles.get(uid)
+        if data is None or json.loads(data)["transcoder"].get("cacheKey") != key:
+            r_cache.zrem(users, uid)
+    return r_cache.zcard(users)
+
+
+def _isUsable(data: dict) -> bool:
+    if not os.path.exists(data["outDir"]):
+        return False
+    if data.get("onDemand", False) or transcoder.isRunning(data):
+        return True
+    # a linear encode can only be reused if it reached the end of the file
+    playlist = os.path.join(data["outDir"], data.get("playlist", "stream.m3u8"))
+    if os.path.exists(playlist):
+        with open(playlist, "r") as f:
+            return "#EXT-X-ENDLIST" in f.read()
+    return False
+
+
+def _getDirSize(path: str) -> int:
+    size = 0
+    for entry in os.scandir(path):
+        if entry.is_file(follow_symlinks=False):
+            size += entry.stat(follow_symlinks=False).st_size
+    return size
+
+
+def enforceCacheBudget():
+    # remove the least recently used encodes until the cache fits in cacheSize (GB)
+    path = os.path.join(configData["config"]["outDir"], "shared")
+    if not os.path.exists(path):
+        return
+    budget = configData["config"].get("cacheSize", 20) * 1024 ** 3
+
+    entries = []
+    total = 0
+    for entry in os.scandir(path):
+        if not entry.is_dir(follow_symlinks=False):
+            continue
+        size = _getDirSize(entry.path)
+        total += size
+        atime = r_cache.get("transcode:" + entry.name + ":atime")
+        entries.append(
+            (float(atime) if atime is not None else entry.stat().st_mtime, entry, size)
+        )
+
+    for atime, entry, size in sorted(entries, key=lambda e: e[0]):
+        if total <= budget:
+            break
+        if _countUsers(entry.name) > 0:
+            continue
+        logger.info("Removing shared transcoder output " + entry.name)
+        data = r_cache.get("transcode:" + entry.name)
+        if data is not None:
+            transcoder.stop(json.loads(data), False)
+        shutil.rmtree(entry.path, ignore_errors=True)
+        r_cache.delete(
+            "transcode:" + entry.name,
+            "transcode:" + entry.name + ":users",
+            "transcode:" + entry.name + ":atime",
+        )
+        total -= size
@@ -0,0 +1,78 @@
+import time
+
+from .log import logger
+from .dbHelper import r_cache
+
+"""
+r_cache: progress of the running ffmpeg processes, read from their -progress output
+    progress:<key> : hash with the last values reported by ffmpeg
+        frame, fps, speed, out_time (seconds), bitrate (kbit/s), progress (continue or end), updated (timestamp)
+        exitCode : set when ffmpeg exits
+        stopped : set when ffmpeg was stopped on purpose (its exit code is not an error)
+"""
+
+_progressTTL = 86400
+# fields kept from the -progress output
+_fields = ["frame", "fps", "speed", "out_time_us", "bitrate", "progress"]
+
+
+def _parseBlock(block: dict) -> dict:
+    data = {}
+    for k in _fields:
+        v = block.get(k, "N/A")
+        if v == "N/A":
+            continue
+        if k == "out_time_us":
+            data["out_time"] = int(v) / 1000000
+        elif k == "speed":
+            data["speed"] = float(v.rstrip("x"))
+        elif k == "bitrate":
+            data["bitrate"] = float(v.replace("kbits/s", ""))
+        else:
+            data[k] = v
+    data["updated"] = time.time()
+    return data
+
+
+def readProgress(process, key: str):
+    # read the -progress output of ffmpeg until it exits, the pipe must always be drained
+    block = {}
+    for line in process.stdout:
+        line = line.decode("utf-8", "replace").strip()
+        if "=" not in line:
+            continue
+        k, v = line.split("=", 1)
+        block[k] = v
+        if k == "progress":
+            # last line of a report
+            try:
+                r_cache.hset("progress:" + key, mapping=_parseBlock(block))
+                r_cache.expire("progress:" + key, _progressTTL)
+            except Exception as e:
+                logger.debug("Unable to save ffmpeg progress: " + str(e))
+            block = {}
+
+
+def setExitCode(key: str, code: int):
+    r_cache.hset("progress:" + key, "exitCode", code)
+    r_cache.expire("progress:" + key, _progressTTL)
+
+
+def getProgress(key: str) -> dict:
+    data = r_cache.hgetall("progress:" + key)
+    ret = {}
+    for k, v in data.items():
+        k = k.decode("utf-8")
+        v = v.decode("utf-8")
+        if k in ["frame", "exitCode", "stopped"]:
+            ret[k] = int(v)
+        elif k in ["fps", "speed", "out_time", "bitrate", "updated"]:
+            ret[k] = float(v)
+        else:
+            ret[k] = v
+    return ret
+
+
+def markStopped(key: str):
+    r_cache.hset("progress:" + key, "stopped", 1)
+    r_cache.expire("progress:" + key, _progressTTL)
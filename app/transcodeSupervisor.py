@@ -0,0 +1,125 @@
+import os
+import json
+import time
+from uwsgidecorators import thread
+
+from .log import logger
+from .dbHelper import r_userFiles, r_cache
+from .transcodeProgress import readProgress, setExitCode, markStopped
+
+"""
+supervisor of the ffmpeg processes started by this worker
+    _sessions : progress key -> transcoder that started the process
+each process is waited by a thread (gevent child watcher, woken up by SIGCHLD),
+when ffmpeg exits with an error it is restarted with libx264 right away
+the session is found from the transcoder: _cacheKey for a shared encode, _uid otherwise
+"""
+
+_sessions = {}
+# maximum time to wait for the session of a failed encode to be written
+_sessionTimeout = 30
+
+
+def supervise(tr, process, key: str, logFile: str, startTime: float):
+    _sessions[key] = tr
+    _watch(process, key, logFile, startTime)
+
+
+def release(key: str):
+    # the process is stopped on purpose, its exit must not trigger a restart
+    _sessions.pop(key, None)
+    markStopped(key)
+
+
+@thread
+def _watch(process, key: str, logFile: str, startTime: float):
+    readProgress(process, key)
+    code = process.wait()
+    setExitCode(key, code)
+    tr = _sessions.pop(key, None)
+    if tr is not None and code != 0:
+        logger.error(
+            ("ffmpeg error, restarting ... [" + _readLogTail(logFile) + "]").encode(
+                "utf-8"
+            )
+        )
+        if os.path.exists(logFile):
+            os.remove(logFile)
+        try:
+            _restart(tr, key, startTime)
+        except Exception as e:
+            logger.error("Unable to restart the transcoder: " + str(e))
+
+
+def _readLogTail(logFile: str, size: int = 2048) -> str:
+    # only the end of the log is needed to know why ffmpeg exited
+    if not os.path.exists(logFile):
+        return ""
+    with open(logFile, "rb") as f:
+        f.seek(max(os.path.getsize(logFile) - size, 0))
+        return f.read().decode("utf-8", "replace")
+
+
+def _getSession(tr) -> dict:
+    # transcoder data of the session of the encode, None if there is no session
+    if tr._cacheKey is not None:
+        data = r_cache.get("transcode:" + tr._cacheKey)
+        return json.loads(data) if data is not None else None
+    data = r_userFiles.get(tr._uid)
+    return json.loads(data)["transcoder"] if data is not None else None
+
+
+def _isCurrent(tr, key: str, startTime: float) -> bool:
+    # the session is written after ffmpeg is started (after the device call for a device
+    # playback), wait for it unless it was replaced by a newer encode in the meantime
+    timeout = time.time() + _sessionTimeout
+    while time.time() <= timeout:
+        data = _getSession(tr)
+        if data is not None:
+            if data.get("progress") == key:
+                return True
+            if data.get("startTime", 0) >= startTime:
+                return False
+        time.sleep(0.5)
+    return False
+
+
+def _restart(tr, key: str, startTime: float):
+    from .transcodeCache import updateTranscoder
+
+    if tr._cacheKey is None and tr._uid is None:
+        # not started for a session
+        return
+    if not _isCurrent(tr, key, startTime):
+        return
+    if tr._startNum > 0:
+        # the fallback failed too
+        _dropSession(tr)
+        return
+    onDemand = tr.isOnDemand()
+    tr._startNum = 1
+    tr._encoder = "libx264"
+    tr._directStream = False
+    # the session keeps its playlist type
+    tr.enableOnDemand(onDemand)
+    if onDemand:
+        # the segments already encoded are kept
+        startData = tr.startSegment(tr._segmentStart)
+    else:
+        startData = tr.start()
+
+    if tr._cacheKey is not None:
+        # the output dir stays the same, so the encode keeps its key
+        updateTranscoder(tr._cacheKey, startData)
+    else:
+        data = json.loads(r_userFiles.get(tr._uid))
+        data["transcoder"] = startData
+        r_userFiles.set(tr._uid, json.dumps(data))
+
+
+def _dropSession(tr):
+    if tr._cacheKey is not None:
+        for uid in r_cache.zrange("transcode:" + tr._cacheKey + ":users", 0, -1):
+            r_userFiles.delete(uid)
+    else:
+        r_userFiles.delete(tr._uid)
@@ -2,6 +2,7 @@ import os
 import signal
 import json
 import re
+import math
 import subprocess
 import shutil
 import time
@@ -11,6 +12,8 @@ from uwsgidecorators import thread
 from .log import logger
 from .files import getFileInfos, getMediaPath, getSubPathFromName, getOutputDir
 from .utils import configData
+from .subtitleCache import streamSubtitles
+from .transcodeSupervisor import supervise, release
 
 
 class transcoder:
@@ -44,6 +47,12 @@ class transcoder:
         self._startNum = 0
         self._mediaType = mediaType
         self._mediaData = mediaData
+        self._onDemand = False
+        self._segmentStart = 0
+        self._directStream = configData["config"].get("directStream", True)
+        self._abr = False
+        self._uid = None
+        self._cacheKey = None
 
     def setAudioStream(self, audioStream: str):
         self._audioStream = str(audioStream)
@@ -59,10 +68,76 @@ class transcoder:
         if subFile != "":
             self._subFile = getSubPathFromName(self._file, subFile)
 
+    def setSession(self, uid: int = None, cacheKey: str = None):
+        # session restarted by the supervisor if ffmpeg fails
+        self._uid = uid
+        self._cacheKey = cacheKey
+
     def enableHLS(self, en, time=configData["config"]["hlsTime"]):
         self._enableHLS = en
         self._hlsTime = time
 
+    def enableOnDemand(self, en: bool):
+        # publish the whole VOD playlist and only encode the requested segments
+        self._onDemand = en
+
+    def enableABR(self, en: bool):
+        # encode several renditions in one ffmpeg, listed in a master playlist
+        self._abr = en
+
+    def isABR(self) -> bool:
+        # the on-demand mode restarts ffmpeg at any segment, it only produces one rendition
+        return self._abr and self._enableHLS and not self._onDemand
+
+    def getRenditions(self) -> list:
+        # [width, max bitrate (kb/s)] of each rendition, from the highest to the lowest,
+        # limited to the source and requested widths
+        ladder = sorted(
+            configData["config"].get(
+                "abrLadder", [[1920, 6000], [1280, 3000], [854, 1200]]
+            ),
+            reverse=True,
+        )
+        try:
+            maxWidth = int(self._fileInfos["dimension"].split("x")[0])
+        except (KeyError, ValueError, AttributeError):
+            maxWidth = ladder[0][0]
+        if int(self._resize) > 0:
+            maxWidth = min(maxWidth, int(self._resize))
+        renditions = [r for r in ladder if r[0] <= maxWidth][:4]
+        if len(renditions) == 0:
+            renditions = [[maxWidth, ladder[-1][1]]]
+        return renditions
+
+    def isOnDemand(self) -> bool:
+        # copied video can only be cut on the source keyframes, so segments
+        # would not match the VOD playlist: direct streams are always linear
+        return self._onDemand and self._enableHLS and not self.canCopyVideo()
+
+    def canCopyVideo(self) -> bool:
+        # the video stream can be sent as is if it is playable by the clients
+        # and no filter must be applied on it
+        return (
+            self._directStream
+            and self._fileInfos.get("video_codec") == "h264"
+            and self._fileInfos.get("pix_fmt") == "yuv420p"
+            and self._subStream == "-1"
+            and self._subFile == b""
+            and int(self._resize) <= 0
+            and not self._remove3D
+            and not self.isABR()
+        )
+
+    def canCopyAudio(self) -> bool:
+        audio = self._fileInfos.get("audio", [])
+        index = int(self._audioStream)
+        return (
+            self._directStream
+            and index < len(audio)
+            and audio[index]["codec"] == "aac"
+            and int(audio[index]["channels"]) <= 2
+        )
+
     def setStartTime(self, time):
         self._startFrom = time
 
@@ -86,8 +161,50 @@ class transcoder:
         # stereoType is 1 for SBS (side by side) or 2 for TAB (top and bottom)
         self._remove3D = stereoType
 
-    def getWatchedDuration(self, data):
-        return float(data) + float(self._startFrom)
+    def getSegmentCount(self) -> int:
+        return int(
+            math.ceil(float(self._fileInfos["duration"]) / float(self._hlsTime))
+        )
+
+    def getSegmentName(self, num: int) -> str:
+        return "stream" + ("%05d" % int(num)) + ".ts"
+
+    def getEncodedSegment(self) -> int:
+        # last segment completed by the running ffmpeg, read from its own playlist
+        last = self._segmentStart - 1
+        path = os.path.join(self._outDir, "stream_enc.m3u8")
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                for line in f:
+                    m = re.match(r"stream(\d+)\.ts", line.strip())
+                    if m:
+                        last = max(last, int(m.group(1)))
+        return last
+
+    def isInWindow(self, num: int) -> bool:
+        # True if the running ffmpeg will produce this segment soon enough
+        return (
+            self._segmentStart
+            <= num
+            <= self.getEncodedSegment() + configData["config"].get("hlsWindow", 5)
+        )
+
+    def _writeVODPlaylist(self):
+        duration = float(self._fileInfos["duration"])
+        hlsTime = float(self._hlsTime)
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:3",
+            "#EXT-X-TARGETDURATION:" + str(int(math.ceil(hlsTime))),
+            "#EXT-X-MEDIA-SEQUENCE:0",
+            "#EXT-X-PLAYLIST-TYPE:VOD",
+        ]
+        for i in range(self.getSegmentCount()):
+            lines.append("#EXTINF:%.6f," % min(hlsTime, duration - i * hlsTime))
+            lines.append(self.getSegmentName(i))
+        lines.append("#EXT-X-ENDLIST")
+        with open(os.path.join(self._outDir, "stream.m3u8"), "w") as f:
+            f.write("\n".join(lines) + "\n")
 
     def configure(self, args: dict):
         if args is not None:
@@ -101,14 +218,14 @@ class transcoder:
                 self.setStartTime(args.get("startFrom"))
             if "resize" in args:
                 self.resize(args.get("resize"))
+            if "abr" in args:
+                self.enableABR(bool(args.get("abr")))
             if "remove3D" in args:
                 r3 = args["remove3D"]
                 self.remove3D(int(r3))
 
-    def getSubtitles(self) -> bytes:
-        sf = b""
-        if int(self._startFrom) > 0:
-            sf = b" -ss " + str(self._startFrom).encode("utf-8")
+    def getSubtitles(self):
+        # returns a generator of the WebVTT lines, extracted once and cached on disk
         if self._subStream != "-1":
             if (
                 self._fileInfos["subtitles"][int(self._subStream)]["codec"]
@@ -117,29 +234,9 @@ class transcoder:
                 # we can't easily get text content for bitmap-type subtitles
                 return None
             else:
-                p = subprocess.Popen(
-                    b"ffmpeg -hide_banner -loglevel error"
-                    + sf
-                    + b' -i "'
-                    + self._file
-                    + b'" -map 0:s:'
-                    + self._subStream.encode("utf-8")
-                    + b" -f webvtt -",
-                    shell=True,
-                    stdout=subprocess.PIPE,
-                )
-                return p.stdout.read()
+                return streamSubtitles(self._file, self._subStream, self._startFrom)
         elif self._subFile != b"":
-            p = subprocess.Popen(
-                b"ffmpeg -hide_banner -loglevel error"
-                + sf
-                + b' -i "'
-                + self._subFile
-                + b'" -f webvtt -',
-                shell=True,
-                stdout=subprocess.PIPE,
-            )
-            return p.stdout.read()
+            return streamSubtitles(self._subFile, "file", self._startFrom)
         else:
             return None
 
@@ -154,32 +251,48 @@ class transcoder:
         except FileExistsError:
             pass
 
+        if self.isOnDemand():
+            self._writeVODPlaylist()
+            return self.startSegment(
+                int(float(self._startFrom) // float(self._hlsTime))
+            )
+        return self._run(self._buildCommand(self._startFrom))
+
+    def startSegment(self, num: int) -> dict:
+        # (re)start ffmpeg at segment num, segments before it are kept on disk
+        self._segmentStart = int(num)
+        encPlaylist = os.path.join(self._outDir, "stream_enc.m3u8")
+        if os.path.exists(encPlaylist):
+            os.remove(encPlaylist)
+        return self._run(self._buildCommand(self._segmentStart * self._hlsTime))
+
+    def _buildCommand(self, startFrom) -> bytes:
         filePath = self._file
         cut = b""
-        if int(self._startFrom) > 0:
-            if self._subStream != "-1" or self._subFile != b"":
-                filePath = filePath.decode("utf-8")
-                ext = filePath[filePath.rfind(".") + 1 :]
-                filePath = (
-                    self._outDir.encode("utf-8") + b"/temp." + ext.encode("utf-8")
-                )
-
-                cutCmd = (
-                    b"ffmpeg -y -hide_banner -loglevel error -ss "
-                    + str(self._startFrom).encode("utf-8")
-                    + b' -i "'
-                    + self._file
-                    + b'" -c copy -map 0 '
-                    + filePath
-                )
-                logger.info(b"Cutting file with ffmpeg:" + cutCmd)
-                os.system(cutCmd)
-            else:
-                cut = b"-ss " + str(self._startFrom).encode("utf-8")
+        subShift = b""
+        subUnshift = b""
+        if float(startFrom) > 0:
+            cut = b"-ss " + str(startFrom).encode("utf-8")
+            # the seeked input starts at 0, the frames are moved back to the time of the
+            # source while the text subtitles are rendered, then to 0 again
+            subShift = b"setpts=PTS+" + str(startFrom).encode("utf-8") + b"/TB,"
+            subUnshift = b",setpts=PTS-" + str(startFrom).encode("utf-8") + b"/TB"
 
         cmd = b"ffmpeg -hide_banner -loglevel error " + cut + b' -i "' + filePath + b'"'
-        cmd += b" -pix_fmt yuv420p -preset medium"
-        if self._audioStream != "0":
+        copyVideo = self.canCopyVideo()
+        copyAudio = self.canCopyAudio()
+        if copyVideo or copyAudio:
+            logger.info(
+                "Direct stream for video: "
+                + str(copyVideo)
+                + ", for audio: "
+                + str(copyAudio)
+            )
+
+        if not copyVideo:
+            cmd += b" -pix_fmt yuv420p -preset medium"
+        if (self._audioStream != "0" or copyAudio) and not self.isABR():
+            # the copied audio stream must be the one that was checked
             cmd += b" -map 0:v:0"
 
         rm3d = b""
@@ -192,7 +305,26 @@ class transcoder:
             rm3dMeta = b' -metadata:s:v:0 stereo_mode="mono"'
 
         resize = b""
-        if int(self._resize) > 0:
+        renditions = []
+        if self.isABR():
+            # decode and filter once, then scale the picture for each rendition
+            renditions = self.getRenditions()
+            resize = (
+                b"[v2];[v2]split="
+                + str(len(renditions)).encode("utf-8")
+                + b"".join(b"[s" + str(i).encode("utf-8") + b"]" for i in range(len(renditions)))
+            )
+            for i, r in enumerate(renditions):
+                resize += (
+                    b";[s"
+                    + str(i).encode("utf-8")
+                    + b"]scale="
+                    + str(r[0]).encode("utf-8")
+                    + b":-2[r"
+                    + str(i).encode("utf-8")
+                    + b"]"
+                )
+        elif int(self._resize) > 0:
             resize = b"[v2];[v2]scale=" + str(self._resize).encode("utf-8") + b":-1"
 
         if self._subStream != "-1":
@@ -213,10 +345,12 @@ class transcoder:
                 cmd += (
                     b' -filter_complex "[0:v:0]'
                     + rm3d
+                    + subShift
                     + b"subtitles='"
                     + filePath
                     + b"':si="
                     + self._subStream.encode("utf-8")
+                    + subUnshift
                     + resize
                     + b'"'
                 )
@@ -224,10 +358,12 @@ class transcoder:
             cmd += (
                 b' -filter_complex "[0:v:0]'
                 + rm3d
+                + subShift
                 + b"subtitles='"
                 + self._subFile
                 + b"':si="
                 + self._subStream.encode("utf-8")
+                + subUnshift
                 + resize
                 + b'"'
             )
@@ -238,7 +374,7 @@ class transcoder:
             elif self._remove3D == 2:
                 cmd += b' -filter_complex "[0:v:0]stereo3d=abl:ml' + resize + b'"'
 
-        elif self._resize and int(self._resize) > 0:
+        elif resize != b"":
             cmd += b' -filter_complex "' + resize[9:] + b'"'
 
         if self._remove3D and self._remove3D > 0:
@@ -247,14 +383,76 @@ class transcoder:
             else:
                 cmd += b" -aspect 16:9"
 
-        if self._audioStream != "0":
+        if self.isABR():
+            # each rendition has its video and a copy of the audio
+            for i in range(len(renditions)):
+                cmd += (
+                    b' -map "[r'
+                    + str(i).encode("utf-8")
+                    + b']" -map 0:a:'
+                    + self._audioStream.encode("utf-8")
+                )
+        elif self._audioStream != "0" or copyAudio:
             cmd += b" -map 0:a:" + self._audioStream.encode("utf-8")
-        cmd += b" -c:a aac -ar 48000 -b:a 128k -ac 2"
+        if copyAudio:
+            cmd += b" -c:a copy"
+        else:
+            cmd += b" -c:a aac -ar 48000 -b:a 128k -ac 2"
         cmd += rm3dMeta
-        cmd += b" -c:v " + self._encoder.encode("utf-8")
-        cmd += b" -crf " + str(self._crf).encode("utf-8")
+        if copyVideo:
+            cmd += b" -c:v copy"
+        else:
+            cmd += b" -c:v " + self._encoder.encode("utf-8")
+            cmd += b" -crf " + str(self._crf).encode("utf-8")
+            for i, r in enumerate(renditions):
+                # capped crf, the max bitrate is also the bandwidth of the master playlist
+                cmd += (
+                    b" -maxrate:v:"
+                    + str(i).encode("utf-8")
+                    + b" "
+                    + str(r[1]).encode("utf-8")
+                    + b"k -bufsize:v:"
+                    + str(i).encode("utf-8")
+                    + b" "
+                    + str(r[1] * 2).encode("utf-8")
+                    + b"k"
+                )
 
-        if self._enableHLS:
+        if self.isOnDemand():
+            # force a keyframe on every segment boundary so that a segment always
+            # starts at num * hlsTime, whatever the position ffmpeg was started at
+            hlsTime = str(self._hlsTime).encode("utf-8")
+            cmd += (
+                b' -force_key_frames "expr:gte(t,n_forced*'
+                + hlsTime
+                + b')" -output_ts_offset '
+                + str(startFrom).encode("utf-8")
+                + b" -hls_time "
+                + hlsTime
+                + b" -hls_list_size 0 -hls_flags temp_file -start_number "
+                + str(self._segmentStart).encode("utf-8")
+                + b" -hls_segment_filename "
+                + self._outFile
+                + b"%05d.ts "
+                + self._outFile
+                + b"_enc.m3u8"
+            )
+        elif self.isABR():
+            cmd += (
+                b" -hls_time "
+                + str(self._hlsTime).encode("utf-8")
+                + b' -hls_playlist_type event -var_stream_map "'
+                + b" ".join(
+                    ("v:" + str(i) + ",a:" + str(i)).encode("utf-8")
+                    for i in range(len(renditions))
+                )
+                + b'" -master_pl_name stream.m3u8 -hls_segment_filename '
+                + self._outFile
+                + b"_%v_%03d.ts "
+                + self._outFile
+                + b"_%v.m3u8"
+            )
+        elif self._enableHLS:
             cmd += (
                 b" -hls_time "
                 + str(self._hlsTime).encode("utf-8")
@@ -267,33 +465,70 @@ class transcoder:
         else:
             cmd += b" " + self._outFile + b"." + self._fileInfos["general"]["extension"]
 
+        return cmd
+
+    def _run(self, cmd: bytes) -> dict:
         logger.info(b"Starting ffmpeg with:" + cmd)
         logFile = (
             b"/tmp/zogwine/ffmpeg/" + secrets.token_hex(20).encode("utf-8") + b".log"
         )
-        a = b"exec " + cmd
-        self._process = subprocess.Popen(a, shell=True, stderr=open(logFile, "w"))
+        progressKey = secrets.token_hex(20)
+        startTime = time.time()
+        # the progress reports are written to stdout, the errors to the log file
+        a = b"exec " + cmd.replace(b"ffmpeg ", b"ffmpeg -progress pipe:1 -nostats ", 1)
+        self._process = subprocess.Popen(
+            a, shell=True, stdout=subprocess.PIPE, stderr=open(logFile, "w")
+        )
+        supervise(
+            self, self._process, progressKey, logFile.decode("utf-8"), startTime
+        )
 
         return {
             "pid": self._process.pid,
             "outDir": self._outDir,
-            "startTime": time.time(),
+            "startTime": startTime,
             "logFile": logFile.decode("utf-8"),
+            "progress": progressKey,
+            "onDemand": self.isOnDemand(),
+            "playlist": "stream.m3u8",
+            "firstSegment": (
+                self.getSegmentName(self._segmentStart)
+                if self.isOnDemand()
+                else ("stream_0_001.ts" if self.isABR() else "stream001.ts")
+            ),
+            "abr": self.isABR(),
+            "startFrom": float(self._startFrom),
             "classData": self.toJSON(),
         }
 
     @staticmethod
-    def stop(data: dict):
+    def stop(data: dict, clean: bool = True):
+        if "progress" in data:
+            release(data["progress"])
         if "pid" in data:
             try:
-                os.kill(data["pid"], signal.SIGTERM)
+                # when the output is kept, SIGKILL prevents ffmpeg from closing
+                # (and publishing) the segment it was writing
+                os.kill(data["pid"], signal.SIGTERM if clean else signal.SIGKILL)
             except ProcessLookupError:
                 pass
-        if "outDir" in data and os.path.exists(data["outDir"]):
+        if clean and "outDir" in data and os.path.exists(data["outDir"]):
             os.system('rm -rf "' + data["outDir"] + '"')
         if "logFile" in data and os.path.exists(data["logFile"]):
             os.remove(data["logFile"])
 
+    @staticmethod
+    def isRunning(data: dict) -> bool:
+        if "pid" not in data:
+            return False
+        try:
+            os.kill(data["pid"], 0)
+            with open("/proc/" + str(data["pid"]) + "/stat", "r") as f:
+                # ignore zombie processes
+                return f.read().split(")")[-1].split()[0] != "Z"
+        except (ProcessLookupError, FileNotFoundError):
+            return False
+
     @classmethod
     def fromJSON(transcoder, data):
         data = json.loads(data)
@@ -313,6 +548,6 @@ class transcoder:
         for i in data.keys():
             if type(data[i]) == bytes:
                 d[i] = "__b__" + data[i].decode("utf-8")
-            elif type(data[i]) in [int, float, str, dict, list]:
+            elif type(data[i]) in [bool, int, float, str, dict, list]:
                 d[i] = data[i]
         return json.dumps(d)
\ No newline at end of file
@@ -7,9 +7,20 @@ from datetime import datetime
 
 from .transcoder import transcoder
 from .log import logger
-from .utils import checkArgs, checkUser, addCache, getUID
+from .utils import (
+    checkArgs,
+    checkUser,
+    addCache,
+    getUID,
+    conditionalGet,
+    bumpLibraryVersion,
+    getListArgs,
+    getNextPage,
+)
+from .listing import listQuery
 
 from .dbHelper import getSqlConnection, r_runningThreads, configData
+from .watchStats import refreshShowStats, updateShowWatchStats, updateWatchStats
 from .indexer import scanner
 
 tvs = Blueprint("tvs", __name__)
@@ -31,6 +42,7 @@ def tvs_runUpcomingScan():
     r_runningThreads.set("upEpisodes", 1)
     sqlConnection = getSqlConnection(False)
     scanner(sqlConnection, "tvs", configData["api"]).getObject().scanUpcomingEpisodes()
+    bumpLibraryVersion()
     r_runningThreads.set("upEpisodes", 0)
     sqlConnection.close()
 
@@ -43,21 +55,49 @@ def tvs_getShowsMr():
 @tvs.route("scan", methods=["GET"])
 def tvs_runScanThreaded():
     checkUser("admin")
-    tvs_runScan()
+    tvs_runScan(request.args.get("full", "false") == "true")
     return jsonify({"status": "ok", "data": "ok"})
 
 
 @thread
-def tvs_runScan():
+def tvs_runScan(full: bool = False):
+    # one scan at a time, the flag is only cleared by the scan that set it
+    if r_runningThreads.getset("tvs", 1) == b"1":
+        logger.info("A tvs scan is already running, skipping the new one")
+        return
     sqlConnection = getSqlConnection(False)
-    r_runningThreads.set("tvs", 1)
-    scanner(sqlConnection, "tvs", configData["api"]).scanDir(
-        os.path.join(
-            configData["config"]["contentPath"], configData["config"]["tvsPath"]
+    try:
+        scanner(sqlConnection, "tvs", configData["api"]).scanDir(
+            os.path.join(
+                configData["config"]["contentPath"], configData["config"]["tvsPath"]
+            ),
+            full,
         )
+    finally:
+        bumpLibraryVersion()
+        r_runningThreads.set("tvs", 0)
+        sqlConnection.close()
+
+
+def tvs_scanShow(item: str):
+    # scan a single show directory (used by the library watcher)
+    path = os.path.join(
+        configData["config"]["contentPath"], configData["config"]["tvsPath"]
     )
-    r_runningThreads.set("tvs", 0)
-    sqlConnection.close()
+    if not os.path.isdir(os.path.join(path, item)):
+        return
+    sqlConnection = getSqlConnection(False)
+    # the flag is only cleared by the scan that set it (a full scan may be running)
+    owner = r_runningThreads.getset("tvs", 1) != b"1"
+    try:
+        scanner(sqlConnection, "tvs", configData["api"]).getObject().scanShow(
+            path, item
+        )
+    finally:
+        bumpLibraryVersion()
+        if owner:
+            r_runningThreads.set("tvs", 0)
+        sqlConnection.close()
 
 
 # endregion
@@ -66,6 +106,7 @@ def tvs_runScan():
 
 ################################# GET ####################################################
 @tvs.route("episode/upcoming", methods=["GET"])
+@conditionalGet
 def get_upcoming_episodes():
     sqlConnection, cursor = getSqlConnection()
     cursor.execute(
@@ -116,6 +157,8 @@ def delete_episode(idEpisode: int):
 
     sqlConnection, cursor = getSqlConnection()
     idEp = {"id": idEpisode}
+    cursor.execute("SELECT idShow FROM episodes WHERE idEpisode = %(id)s;", idEp)
+    show = cursor.fetchone()
     cursor.execute(
         "DELETE FROM status WHERE mediaType = 1 AND idMedia = (SELECT idEpisode FROM episodes WHERE idEpisode = %(id)s);",
         idEp,
@@ -125,6 +168,8 @@ def delete_episode(idEpisode: int):
         idEp,
     )
     cursor.execute("DELETE FROM episodes WHERE idEpisode = %(id)s;", idEp)
+    if show is not None:
+        refreshShowStats(cursor, show["idShow"])
     sqlConnection.commit()
     sqlConnection.close()
     return jsonify({"status": "ok", "data": "ok"})
@@ -137,6 +182,7 @@ def delete_episode(idEpisode: int):
 ################################# GET ####################################################
 @tvs.route("<int:idShow>/season/<int:season>/episode", methods=["GET"])
 @tvs.route("<int:idShow>/episode", methods=["GET"])
+@conditionalGet
 def get_show_episodes(idShow: int, season: int = None):
     return jsonify(
         {
@@ -150,12 +196,14 @@ def get_show_episodes(idShow: int, season: int = None):
 
 
 @tvs.route("<int:idShow>", methods=["GET"])
+@conditionalGet
 def get_show(idShow: int):
     return jsonify({"status": "ok", "data": tvs_getShows(False, int(idShow))})
 
 
 @tvs.route("<int:idShow>/season", methods=["GET"])
 @tvs.route("<int:idShow>/season/<int:season>", methods=["GET"])
+@conditionalGet
 def get_season(idShow: int, season: int = None):
     idUser = getUID()
     sqlConnection, cursor = getSqlConnection()
@@ -163,15 +211,16 @@ def get_season(idShow: int, season: int = None):
     dat = {"idUser": idUser, "idShow": idShow}
     if season is not None:
         dat["season"] = season
-        s = "AND season = %(season)s "
+        s = "AND s.season = %(season)s "
     cursor.execute(
         "SELECT title, overview, CONCAT('/api/core/image/',icon) AS icon,"
-        "season, premiered, "
-        "(SELECT COUNT(*) FROM episodes WHERE idShow = s.idShow AND season = s.season) AS episodes, "
-        "(SELECT COUNT(watchCount) FROM status WHERE idMedia IN (SELECT idEpisode FROM episodes WHERE idShow = s.idShow AND season = s.season) AND mediaType = 1  AND watchCount > 0 AND idUser = %(idUser)s) AS watchedEpisodes "
+        "s.season, premiered, "
+        "IFNULL(es.episodes, 0) AS episodes, IFNULL(ws.watchedEpisodes, 0) AS watchedEpisodes "
         "FROM seasons s "
-        "WHERE idShow = %(idShow)s " + s + ""
-        "ORDER BY season;",
+        "LEFT JOIN episode_stats es ON (es.idShow = s.idShow AND es.season = s.season) "
+        "LEFT JOIN watch_stats ws ON (ws.idShow = s.idShow AND ws.season = s.season AND ws.idUser = %(idUser)s) "
+        "WHERE s.idShow = %(idShow)s " + s + ""
+        "ORDER BY s.season;",
         dat,
     )
     res = cursor.fetchall()
@@ -180,8 +229,11 @@ def get_season(idShow: int, season: int = None):
 
 
 @tvs.route("", methods=["GET"])
+@conditionalGet
 def tvs_getShowsFlask():
-    return jsonify({"status": "ok", "data": tvs_getShows(False)})
+    fields, limit, after = getListArgs()
+    res = tvs_getShows(False, None, fields, limit, after)
+    return jsonify({"status": "ok", "data": res, "next": getNextPage(res, limit)})
 
 
 ################################# POST ####################################################
@@ -217,30 +269,39 @@ def tvs_setID(idShow: int, id: int):
 @tvs.route("<int:idShow>/status", methods=["PUT"])
 @tvs.route("<int:idShow>/season/<int:season>/status", methods=["PUT"])
 def tvs_toggleWatchedSeason(idShow: int, season: int = None):
-    uid = getUID()
     sqlConnection, cursor = getSqlConnection()
-    dat = {"idUser": getUID(), "idShow": idShow}
-    watched = True
-
+    dat = {
+        "idUser": getUID(),
+        "idShow": idShow,
+        "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    s = ""
     if season is not None:
         dat["season"] = season
-        s = "AND season = %(season)s"
+        s = " AND e.season = %(season)s"
     cursor.execute(
-        "SELECT SUM(watchCount) AS watched FROM status WHERE idUser = %(idUser)s AND mediaType = 1 "
-        "AND idMedia IN (SELECT idEpisode FROM episodes WHERE idShow = %(idShow)s "
-        + s
-        + ");",
+        "SELECT SUM(watchCount) AS watched FROM status st INNER JOIN episodes e ON (e.idEpisode = st.idMedia) "
+        "WHERE st.idUser = %(idUser)s AND st.mediaType = 1 AND e.idShow = %(idShow)s" + s + ";",
         dat,
     )
     isWatched = cursor.fetchone()["watched"]
-    if isWatched is not None and int(isWatched) > 0:
-        watched = False
-
-    ids = tvs_getEps(idShow, season)
-    for i in ids:
-        if season is None or int(season) == int(i["season"]):
-            tvs_toggleWatchedEpisode(uid, i["id"], watched)
 
+    if isWatched is not None and int(isWatched) > 0:
+        # some episodes are watched, mark them all as unwatched
+        cursor.execute(
+            "UPDATE status st INNER JOIN episodes e ON (e.idEpisode = st.idMedia) SET st.watchCount = 0, st.lastDate = %(date)s "
+            "WHERE st.idUser = %(idUser)s AND st.mediaType = 1 AND st.watchCount > 0 AND e.idShow = %(idShow)s" + s + ";",
+            dat,
+        )
+    else:
+        cursor.execute(
+            "INSERT INTO status (idUser, mediaType, idMedia, watchCount, watchTime, lastDate) "
+            "SELECT %(idUser)s, 1, idEpisode, 1, 0, %(date)s FROM episodes e WHERE e.idShow = %(idShow)s" + s + " "
+            "ON DUPLICATE KEY UPDATE watchCount = 1, lastDate = VALUES(lastDate);",
+            dat,
+        )
+    updateShowWatchStats(cursor, idShow, dat["idUser"])
+    sqlConnection.commit()
     sqlConnection.close()
     return jsonify({"status": "ok", "data": "ok"})
 
@@ -268,14 +329,16 @@ def delete_show(idShow: int):
     sqlConnection, cursor = getSqlConnection()
     idS = {"id": idShow}
     cursor.execute(
-        "DELETE FROM status WHERE mediaType = 1 AND idMedia IN (SELECT idEpisode FROM episodes WHERE idShow = %(id)s);",
+        "DELETE s FROM status s INNER JOIN episodes e ON (e.idEpisode = s.idMedia) WHERE s.mediaType = 1 AND e.idShow = %(id)s;",
         idS,
     )
     cursor.execute(
-        "DELETE FROM video_files WHERE idVid IN (SELECT idVid FROM episodes WHERE idShow = %(id)s);",
+        "DELETE v FROM video_files v INNER JOIN episodes e ON (e.idVid = v.idVid) WHERE e.idShow = %(id)s;",
         idS,
     )
     cursor.execute("DELETE FROM episodes WHERE idShow = %(id)s;", idS)
+    cursor.execute("DELETE FROM episode_stats WHERE idShow = %(id)s;", idS)
+    cursor.execute("DELETE FROM watch_stats WHERE idShow = %(id)s;", idS)
     cursor.execute("DELETE FROM seasons WHERE idShow = %(id)s;", idS)
     cursor.execute("DELETE FROM tv_shows WHERE idShow = %(id)s;", idS)
     sqlConnection.commit()
@@ -286,29 +349,47 @@ def delete_show(idShow: int):
 # endregion
 
 # region HELPERS
-def tvs_getShows(mr=False, idShow=None):
+_showColumns = {
+    "id": "t.idShow AS id",
+    "title": "title",
+    "overview": "overview",
+    "icon": "CONCAT('/api/core/image/',icon) AS icon",
+    "fanart": "CONCAT('/api/core/image/',fanart) AS fanart",
+    "rating": "rating",
+    "premiered": "premiered",
+    "scraperName": "scraperName",
+    "scraperID": "scraperID",
+    "multipleResults": "multipleResults",
+    "seasons": "(SELECT MAX(season) FROM episode_stats WHERE idShow = t.idShow) AS seasons",
+    "episodes": "(SELECT IFNULL(SUM(episodes), 0) FROM episode_stats WHERE idShow = t.idShow) AS episodes",
+    "watchedEpisodes": "(SELECT IFNULL(SUM(watchedEpisodes), 0) FROM watch_stats WHERE idUser = %(idUser)s AND idShow = t.idShow) AS watchedEpisodes",
+    "scraperLink": "CONCAT((SELECT scraperURL FROM scrapers WHERE scraperName = t.scraperName AND mediaType = 1),scraperID) AS scraperLink",
+}
+
+
+def tvs_getShows(mr=False, idShow=None, fields=None, limit=None, after=None):
     idUser = getUID()
     sqlConnection, cursor = getSqlConnection()
     mrDat = ""
-    show = ""
+    where = ""
     queryData = {"idUser": int(idUser)}
     if mr:
         mrDat = "NOT "
     if idShow is not None:
-        show = " AND idShow = %(idShow)s"
+        where = " AND t.idShow = %(idShow)s"
         queryData.update({"idShow": idShow})
-
-    query = (
-        "SELECT idShow AS id,"
-        "title, overview, CONCAT('/api/core/image/',icon) AS icon, CONCAT('/api/core/image/',fanart) AS fanart, "
-        "rating, premiered, scraperName, scraperID, multipleResults, "
-        "(SELECT MAX(season) FROM episodes WHERE idShow = t.idShow) AS seasons,"
-        "(SELECT COUNT(idEpisode) FROM episodes WHERE idShow = t.idShow) AS episodes,"
-        "(SELECT COUNT(*) FROM episodes e LEFT JOIN status s ON (s.idMedia = e.idEpisode)"
-        "WHERE e.idEpisode = s.idMedia AND s.mediaType = 1 AND watchCount > 0  AND idUser = %(idUser)s and idShow = t.idShow) AS watchedEpisodes,"
-        "CONCAT((SELECT scraperURL FROM scrapers WHERE scraperName = t.scraperName AND mediaType = 1),scraperID) AS scraperLink "
-        "FROM tv_shows t "
-        "WHERE multipleResults IS " + mrDat + "NULL" + show + " ORDER BY title;"
+    if after is not None:
+        # keyset pagination on (title, id), NULL titles first
+        queryData.update({"afterTitle": after[0], "afterId": after[1]})
+
+    query = listQuery(
+        _showColumns,
+        "tv_shows t",
+        "t.idShow",
+        "multipleResults IS " + mrDat + "NULL" + where,
+        fields,
+        limit,
+        after,
     )
 
     cursor.execute(query, queryData)
@@ -374,6 +455,7 @@ def tvs_toggleWatchedEpisode(uid, idEpisode, watched=None):
                 "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
             },
         )
+    updateWatchStats(cursor, uid, idEpisode)
     sqlConnection.commit()
     sqlConnection.close()
     return True
@@ -7,10 +7,18 @@ from urllib.parse import urlparse, parse_qs, unquote
 
 from .transcoder import transcoder
 from .log import logger, getLogs
-from .utils import checkArgs, getUID, generateToken, checkUser
+from .utils import (
+    checkArgs,
+    getUID,
+    generateToken,
+    checkUser,
+    getUserProps,
+    invalidateUser,
+)
 from .dbHelper import getSqlConnection, r_userFiles, r_userTokens, configData
 from .indexer import scanner
 from .files import getMediaFromUrl
+from .player import stopTranscoder
 
 user = Blueprint("user", __name__)
 allowedMethods = ["GET", "POST"]
@@ -36,6 +44,8 @@ def signin():
         sqlConnection.close()
         if dat != None and "idUser" in dat:
             logger.info("User: " + str(user) + " successfully authenticated")
+            # reload the permissions of the user on login
+            invalidateUser(dat["idUser"])
             return jsonify({"status": "ok", "data": generateToken(dat["idUser"])})
         else:
             logger.warning("Bad Authentication for user: " + str(user))
@@ -46,14 +56,12 @@ def signin():
 
 
 def getUserData(userID):
-    sqlConnection, cursor = getSqlConnection()
-    cursor.execute(
-        "SELECT name, admin, cast, receive, allowMovie, allowTvs FROM users WHERE idUser = %(idUser)s",
-        {"idUser": userID},
-    )
-    res = cursor.fetchone()
-    sqlConnection.close()
-    return res
+    res = getUserProps(userID)
+    if res is None:
+        return None
+    return {
+        k: res[k] for k in ["name", "admin", "cast", "receive", "allowMovie", "allowTvs"]
+    }
 
 
 @user.route("data", methods=["GET"])
@@ -76,7 +84,7 @@ def signout(token=None):
 
     if s == 0:
         if r_userFiles.exists(uid):
-            transcoder.stop(r_userFiles.get(uid))
+            stopTranscoder(uid, json.loads(r_userFiles.get(uid))["transcoder"])
             r_userFiles.delete(uid)
     return jsonify({"status": "ok", "data": "ok"})
 
@@ -119,6 +127,12 @@ def nginx():
                     return "ok"
     elif service == "out":
         aPath = "out/" + str(uid) + "/"
+        userData = r_userFiles.get(uid)
+        if userData is not None:
+            userData = json.loads(userData)
+            if "cacheKey" in userData["transcoder"]:
+                # the user is watching a shared encode
+                aPath = "out/shared/" + userData["transcoder"]["cacheKey"] + "/"
         if (
             path[0 : len(aPath)] == aPath
             and "/" not in path[len(aPath) :]
@@ -1,17 +1,27 @@
-from flask import request, abort, Response
+from flask import request, abort, Response, g, has_request_context, make_response
 import os
+import time
+import gzip
+import functools
+import threading
 import mimetypes
 import re
 import requests
-from base64 import b64decode, b64encode
+import json
+from base64 import b64decode, b64encode, urlsafe_b64decode, urlsafe_b64encode
 from urllib.parse import urlparse, parse_qs, unquote
 import secrets
 import hashlib
 from decimal import Decimal
 
-from .dbHelper import getSqlConnection, configData, r_userTokens
+from .dbHelper import getSqlConnection, configData, r_userTokens, r_cache
 from .log import logger
 
+"""
+r_cache: version of the library, changed by the scans and the status updates
+    library:version : counter used in the etags of the listings
+"""
+
 
 def checkArgs(args, data=None):
     for a in args:
@@ -26,15 +36,51 @@ def checkArgs(args, data=None):
     return True
 
 
+_userCache = {}
+_userCacheLock = threading.Lock()
+
+
+def getUserProps(uid: int) -> dict:
+    # user data and permissions, cached for the request and for userCacheTTL seconds
+    if has_request_context():
+        if "userProps" not in g:
+            g.userProps = {}
+        if uid in g.userProps:
+            return g.userProps[uid]
+
+    with _userCacheLock:
+        entry = _userCache.get(uid)
+    if entry is None or entry[0] + configData["config"].get(
+        "userCacheTTL", 30
+    ) <= time.time():
+        sqlConnection, cursor = getSqlConnection()
+        cursor.execute(
+            "SELECT name, admin, cast, receive, indexof, allowMovie, allowTvs FROM users WHERE idUser = %(idUser)s",
+            {"idUser": uid},
+        )
+        entry = (time.time(), cursor.fetchone())
+        sqlConnection.close()
+        with _userCacheLock:
+            _userCache[uid] = entry
+
+    if has_request_context():
+        g.userProps[uid] = entry[1]
+    return entry[1]
+
+
+def invalidateUser(uid: int = None):
+    # must be called when a user is modified (all users if uid is None)
+    with _userCacheLock:
+        if uid is None:
+            _userCache.clear()
+        else:
+            _userCache.pop(uid, None)
+    if has_request_context() and "userProps" in g:
+        g.userProps = {}
+
+
 def checkUser(prop, abrt=True, uid=None):
-    sqlConnection, cursor = getSqlConnection()
-    cursor = sqlConnection.cursor(dictionary=True)
-    cursor.execute(
-        "SELECT name, admin, cast, receive, indexof, allowMovie, allowTvs FROM users WHERE idUser = %(idUser)s",
-        {"idUser": uid or getUID()},
-    )
-    d = cursor.fetchone()
-    sqlConnection.close()
+    d = getUserProps(uid or getUID()) or {}
 
     props = ["admin", "indexof", "cast", "receive", "allowMovie", "allowTvs"]
 
@@ -66,6 +112,16 @@ def getUID(token=None) -> int:
         if d is not None:
             return int(d.decode("utf-8"))
 
+    # the uid of a request is only looked up once
+    if has_request_context() and "uid" in g:
+        return g.uid
+    uid = _getRequestUID()
+    if has_request_context():
+        g.uid = uid
+    return uid
+
+
+def _getRequestUID() -> int:
     if "token" in request.args:
         d = r_userTokens.get(request.args["token"])
         if d is not None:
@@ -144,4 +200,126 @@ def __convertTypes(data):
             data[k] = fixTypes(data[k])
     #        elif type(data[k]) not in [str, int, float]:
     #            print(type(data))
-    return data
\ No newline at end of file
+    return data
+
+
+def getLibraryVersion() -> int:
+    version = r_cache.get("library:version")
+    if version is None:
+        return 0
+    return int(version)
+
+
+def bumpLibraryVersion():
+    # must be called when the library or a status changes, the clients will then reload the listings
+    r_cache.incr("library:version")
+
+
+def _getEncoding() -> str:
+    if not configData["config"].get("compressResponses", True):
+        return None
+    if "br" in request.accept_encodings:
+        try:
+            import brotli
+
+            return "br"
+        except ImportError:
+            pass
+    if "gzip" in request.accept_encodings:
+        return "gzip"
+    return None
+
+
+def conditionalGet(func):
+    # answer 304 if the library didn't change since the client got the response,
+    # and compress the large responses
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        encoding = _getEncoding()
+        etag = hashlib.sha1(
+            (
+                str(getLibraryVersion())
+                + "|"
+                + str(getUID())
+                + "|"
+                + request.full_path
+                + "|"
+                + str(encoding)
+            ).encode("utf-8")
+        ).hexdigest()
+        if request.if_none_match.contains(etag):
+            resp = Response(status=304)
+            resp.set_etag(etag)
+            return resp
+
+        resp = make_response(func(*args, **kwargs))
+        if resp.status_code != 200:
+            return resp
+        resp.set_etag(etag)
+        resp.headers["Cache-Control"] = "private, no-cache"
+        resp.vary.add("Accept-Encoding")
+        data = resp.get_data()
+        if encoding is not None and len(data) >= configData["config"].get(
+            "compressMinSize", 1024
+        ):
+            if encoding == "br":
+                import brotli
+
+                resp.set_data(brotli.compress(data))
+            else:
+                resp.set_data(gzip.compress(data, 6))
+            resp.headers["Content-Encoding"] = encoding
+        return resp
+
+    return wrapper
+
+
+def getListArgs() -> tuple:
+    # returns the requested fields, the page size and the position (title, id) of a listing request
+    # ?fields=id,title,icon&limit=50&after=<next of the previous page>
+    fields = None
+    if request.args.get("fields"):
+        fields = request.args["fields"].split(",")
+    limit = request.args.get("limit")
+    if limit is not None:
+        limit = _parseLimit(limit)
+    after = request.args.get("after")
+    if after is not None:
+        try:
+            after = json.loads(urlsafe_b64decode(after.encode("utf-8")))
+        except ValueError:
+            abort(400)
+        if (
+            not isinstance(after, list)
+            or len(after) != 2
+            or not isinstance(after[0], (str, type(None)))
+            or not isinstance(after[1], int)
+        ):
+            abort(400)
+    return fields, limit, after
+
+
+def getPageArgs(args: dict = None) -> tuple:
+    # returns the page size (default and max: maxPageSize) and the offset of a paginated request
+    if args is None:
+        args = request.args
+    limit = _parseLimit(args.get("limit", configData["config"].get("maxPageSize", 500)))
+    offset = args.get("offset", 0)
+    if not str(offset).isdigit():
+        abort(400)
+    return limit, int(offset)
+
+
+def _parseLimit(limit) -> int:
+    if not str(limit).isdigit() or int(limit) == 0:
+        abort(400)
+    return min(int(limit), configData["config"].get("maxPageSize", 500))
+
+
+def getNextPage(res: list, limit: int) -> str:
+    # position of the last row of a full page, to be given as "after" for the next one
+    if limit is None or len(res) < limit:
+        return None
+    return urlsafe_b64encode(
+        json.dumps([res[-1]["title"], res[-1]["id"]]).encode("utf-8")
+    ).decode("utf-8")
@@ -0,0 +1,52 @@
+"""
+aggregates of the tv shows, used to list the shows and seasons without counting the episodes and status
+    episode_stats : (idShow, season) -> number of episodes
+    watch_stats : (idUser, idShow, season) -> number of watched episodes
+    (the episodes without season are counted in the season 0)
+the functions take the cursor of the caller, which commits
+"""
+
+
+def refreshShowStats(cursor, idShow: int):
+    # recount the episodes of a show and the watched episodes of all its users
+    # (after a scan or when episodes are deleted)
+    cursor.execute(
+        "DELETE FROM episode_stats WHERE idShow = %(idShow)s;", {"idShow": idShow}
+    )
+    cursor.execute(
+        "INSERT INTO episode_stats (idShow, season, episodes) "
+        "SELECT idShow, IFNULL(season, 0), COUNT(*) FROM episodes WHERE idShow = %(idShow)s GROUP BY IFNULL(season, 0);",
+        {"idShow": idShow},
+    )
+    updateShowWatchStats(cursor, idShow)
+
+
+def updateShowWatchStats(cursor, idShow: int, idUser: int = None):
+    # recount the watched episodes of a show for a user (default: all the users)
+    dat = {"idShow": idShow, "idUser": idUser}
+    u = ""
+    if idUser is not None:
+        u = " AND idUser = %(idUser)s"
+    cursor.execute("DELETE FROM watch_stats WHERE idShow = %(idShow)s" + u + ";", dat)
+    if idUser is not None:
+        u = " AND s.idUser = %(idUser)s"
+    cursor.execute(
+        "INSERT INTO watch_stats (idUser, idShow, season, watchedEpisodes) "
+        "SELECT s.idUser, e.idShow, IFNULL(e.season, 0), COUNT(*) FROM status s INNER JOIN episodes e ON (e.idEpisode = s.idMedia) "
+        "WHERE s.mediaType = 1 AND s.watchCount > 0 AND e.idShow = %(idShow)s" + u + " "
+        "GROUP BY s.idUser, IFNULL(e.season, 0);",
+        dat,
+    )
+
+
+def updateWatchStats(cursor, idUser: int, idEpisode: int):
+    # recount the watched episodes of the season of an episode for a user, after a status change
+    cursor.execute(
+        "INSERT INTO watch_stats (idUser, idShow, season, watchedEpisodes) "
+        "SELECT %(idUser)s, e.idShow, IFNULL(e.season, 0), "
+        "(SELECT COUNT(*) FROM status s INNER JOIN episodes se ON (se.idEpisode = s.idMedia) "
+        "WHERE s.idUser = %(idUser)s AND s.mediaType = 1 AND s.watchCount > 0 AND se.idShow = e.idShow AND IFNULL(se.season, 0) = IFNULL(e.season, 0)) "
+        "FROM episodes e WHERE e.idEpisode = %(idEpisode)s "
+        "ON DUPLICATE KEY UPDATE watchedEpisodes = VALUES(watchedEpisodes);",
+        {"idUser": idUser, "idEpisode": idEpisode},
+    )
@@ -1,14 +1,11 @@
 from uwsgidecorators import thread
 import time
 import os
-import json
-import signal
 import croniter
 import datetime
 
-from .dbHelper import r_userFiles, configData
+from .dbHelper import configData
 from .log import logger
-from .transcoder import transcoder
 
 from .movie import mov_runScan
 from .tvs import tvs_runScan, tvs_runUpcomingScan
@@ -26,7 +23,6 @@ def startWatcher():
     lastCheck = 0
 
     while True:
-        checkTranscodingErrors()
         if lastCheck + 60 <= time.time():
             # check only once per minute
             lastCheck = time.time()
@@ -34,56 +30,6 @@ def startWatcher():
         time.sleep(sleepTime)
 
 
-def checkTranscodingErrors():
-    # search for errors after transcoder start, and try to fall back to libx264
-    for u in r_userFiles.scan_iter():
-        data = r_userFiles.get(u)
-        if data is not None:
-            data = json.loads(data)
-            if "logFile" in data["transcoder"] and os.path.exists(
-                data["transcoder"]["logFile"]
-            ):
-                with open(data["transcoder"]["logFile"], "r") as f:
-                    d = ("".join(f.readlines())).lower()
-                    if "error" in d or "failed" in d:
-                        logger.error(
-                            ("ffmpeg error, restarting ... [" + d + "]").encode("utf-8")
-                        )
-                        killAndRestart(
-                            data,
-                            transcoder.fromJSON(data["transcoder"]["classData"]),
-                            u,
-                        )
-                    elif (
-                        "startTime" in data
-                        and data["startTime"] + configData["hlsKill"] <= time.time()
-                    ):
-                        tr = transcoder.fromJSON(data["transcoder"]["classData"])
-                        if tr._enableHLS:
-                            killAndRestart(data, tr, u)
-
-
-def killAndRestart(data, tr, uid):
-    transcoder.stop(data["transcoder"])
-    if tr._startNum <= 0:
-        tr._startNum = 1
-        tr._encoder = "libx264"
-        startData = tr.start()
-        r_userFiles.set(
-            uid,
-            json.dumps(
-                {
-                    "mediaType": data["mediaType"],
-                    "mediaData": data["mediaData"],
-                    "transcoder": startData,
-                    "device": data["device"] or {},
-                }
-            ),
-        )
-    else:
-        r_userFiles.delete(uid)
-
-
 def setupCron(cron):
     cronData = []
     now = datetime.datetime.now()
@@ -44,10 +44,21 @@ CREATE TABLE `episodes` (
   PRIMARY KEY (`idEpisode`),
   KEY `idShow` (`idShow`),
   KEY `idVid` (`idVid`),
+  KEY `title` (`title`),
+  FULLTEXT KEY `search` (`title`,`overview`),
   CONSTRAINT `episodes_ibfk_1` FOREIGN KEY (`idShow`) REFERENCES `tv_shows` (`idShow`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8;
 
 
+DROP TABLE IF EXISTS `episode_stats`;
+CREATE TABLE `episode_stats` (
+  `idShow` int(11) NOT NULL,
+  `season` int(11) NOT NULL,
+  `episodes` int(11) NOT NULL DEFAULT 0,
+  PRIMARY KEY (`idShow`,`season`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+
+
 DROP TABLE IF EXISTS `movies`;
 CREATE TABLE `movies` (
   `idMovie` int(11) NOT NULL AUTO_INCREMENT,
@@ -67,7 +78,9 @@ CREATE TABLE `movies` (
   `forceUpdate` tinyint(1) NOT NULL DEFAULT 0,
   PRIMARY KEY (`idMovie`),
   KEY `idCollection` (`idCollection`),
+  KEY `title` (`title`),
   KEY `idVid` (`idVid`),
+  FULLTEXT KEY `search` (`title`,`overview`),
   CONSTRAINT `movies_ibfk_1` FOREIGN KEY (`idCollection`) REFERENCES `movie_collections` (`idCollection`),
   CONSTRAINT `movies_ibfk_2` FOREIGN KEY (`idVid`) REFERENCES `video_files` (`idVid`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8;
@@ -100,7 +113,9 @@ CREATE TABLE `people` (
   `icon` text DEFAULT NULL,
   `known_for` varchar(255) DEFAULT NULL,
   `forceUpdate` tinyint(4) NOT NULL DEFAULT 0,
-  PRIMARY KEY (`idPers`)
+  PRIMARY KEY (`idPers`),
+  KEY `name` (`name`),
+  FULLTEXT KEY `search` (`name`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8;
 
 
@@ -111,10 +126,23 @@ CREATE TABLE `people_link` (
   `mediaType` int(11) NOT NULL,
   `role` varchar(255) NOT NULL,
   KEY `idPers` (`idPers`),
+  KEY `media` (`mediaType`,`idMedia`),
   CONSTRAINT `people_link_ibfk_1` FOREIGN KEY (`idPers`) REFERENCES `people` (`idPers`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8;
 
 
+DROP TABLE IF EXISTS `probe_cache`;
+CREATE TABLE `probe_cache` (
+  `dev` bigint(20) unsigned NOT NULL,
+  `inode` bigint(20) unsigned NOT NULL,
+  `size` bigint(20) NOT NULL,
+  `mtime` double NOT NULL,
+  `path` text NOT NULL,
+  `data` longtext NOT NULL,
+  PRIMARY KEY (`dev`,`inode`,`size`,`mtime`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+
+
 DROP TABLE IF EXISTS `scrapers`;
 CREATE TABLE `scrapers` (
   `id` int(11) NOT NULL AUTO_INCREMENT,
@@ -155,7 +183,8 @@ CREATE TABLE `status` (
   `watchTime` int(11) NOT NULL DEFAULT 0,
   `lastDate` varchar(255) DEFAULT NULL,
   PRIMARY KEY (`idStatus`),
-  KEY `idUser` (`idUser`),
+  UNIQUE KEY `userMedia` (`idUser`,`mediaType`,`idMedia`),
+  KEY `media` (`mediaType`,`idMedia`),
   CONSTRAINT `status_ibfk_1` FOREIGN KEY (`idUser`) REFERENCES `users` (`idUser`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8;
 
@@ -176,6 +205,7 @@ CREATE TABLE `tags_link` (
   `idMedia` int(11) NOT NULL,
   `mediaType` int(11) NOT NULL,
   KEY `idTag` (`idTag`),
+  KEY `media` (`mediaType`,`idMedia`),
   CONSTRAINT `tags_link_ibfk_1` FOREIGN KEY (`idTag`) REFERENCES `tags` (`idTag`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8;
 
@@ -226,7 +256,9 @@ CREATE TABLE `tv_shows` (
   `path` varchar(255) DEFAULT NULL,
   `multipleResults` longtext DEFAULT NULL,
   `forceUpdate` tinyint(4) NOT NULL DEFAULT 0,
-  PRIMARY KEY (`idShow`)
+  PRIMARY KEY (`idShow`),
+  KEY `title` (`title`),
+  FULLTEXT KEY `search` (`title`,`overview`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8;
 
 
@@ -276,7 +308,19 @@ CREATE TABLE `video_files` (
   `pix_fmt` varchar(50) DEFAULT NULL,
   `video_codec` varchar(50) DEFAULT NULL,
   `size` bigint(20) NOT NULL,
-  PRIMARY KEY (`idVid`)
+  PRIMARY KEY (`idVid`),
+  KEY `path` (`path`(255))
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+
+
+DROP TABLE IF EXISTS `watch_stats`;
+CREATE TABLE `watch_stats` (
+  `idUser` int(11) NOT NULL,
+  `idShow` int(11) NOT NULL,
+  `season` int(11) NOT NULL,
+  `watchedEpisodes` int(11) NOT NULL DEFAULT 0,
+  PRIMARY KEY (`idUser`,`idShow`,`season`),
+  KEY `idShow` (`idShow`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8;
 
 
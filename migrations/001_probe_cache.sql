@@ -0,0 +1,10 @@
+-- cache of the ffprobe results, a file is identified by its device, inode, size and mtime
+CREATE TABLE IF NOT EXISTS `probe_cache` (
+  `dev` bigint(20) unsigned NOT NULL,
+  `inode` bigint(20) unsigned NOT NULL,
+  `size` bigint(20) NOT NULL,
+  `mtime` double NOT NULL,
+  `path` text NOT NULL,
+  `data` longtext NOT NULL,
+  PRIMARY KEY (`dev`,`inode`,`size`,`mtime`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
@@ -0,0 +1,26 @@
+-- per show/season episode counts and per user watched counts, maintained by app/watchStats.py
+CREATE TABLE IF NOT EXISTS `episode_stats` (
+  `idShow` int(11) NOT NULL,
+  `season` int(11) NOT NULL,
+  `episodes` int(11) NOT NULL DEFAULT 0,
+  PRIMARY KEY (`idShow`,`season`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+
+CREATE TABLE IF NOT EXISTS `watch_stats` (
+  `idUser` int(11) NOT NULL,
+  `idShow` int(11) NOT NULL,
+  `season` int(11) NOT NULL,
+  `watchedEpisodes` int(11) NOT NULL DEFAULT 0,
+  PRIMARY KEY (`idUser`,`idShow`,`season`),
+  KEY `idShow` (`idShow`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+
+-- fill the aggregates from the existing library
+DELETE FROM `episode_stats`;
+INSERT INTO `episode_stats` (idShow, season, episodes)
+SELECT idShow, IFNULL(season, 0), COUNT(*) FROM episodes WHERE idShow IS NOT NULL GROUP BY idShow, IFNULL(season, 0);
+
+DELETE FROM `watch_stats`;
+INSERT INTO `watch_stats` (idUser, idShow, season, watchedEpisodes)
+SELECT s.idUser, e.idShow, IFNULL(e.season, 0), COUNT(*) FROM status s INNER JOIN episodes e ON (e.idEpisode = s.idMedia)
+WHERE s.mediaType = 1 AND s.watchCount > 0 AND e.idShow IS NOT NULL GROUP BY s.idUser, e.idShow, IFNULL(e.season, 0);
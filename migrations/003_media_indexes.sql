@@ -0,0 +1,19 @@
+-- indexes for the lookups of a media (status, tags, people) and of a file by its path
+
+-- a user has only one status for a media, keep the last one
+DELETE s1 FROM `status` s1 INNER JOIN `status` s2
+ON (s1.idUser = s2.idUser AND s1.mediaType = s2.mediaType AND s1.idMedia = s2.idMedia AND s1.idStatus < s2.idStatus);
+
+ALTER TABLE `status` ADD UNIQUE KEY `userMedia` (`idUser`,`mediaType`,`idMedia`), ADD KEY `media` (`mediaType`,`idMedia`);
+-- covered by userMedia
+ALTER TABLE `status` DROP KEY `idUser`;
+
+ALTER TABLE `tags_link` ADD KEY `media` (`mediaType`,`idMedia`);
+ALTER TABLE `people_link` ADD KEY `media` (`mediaType`,`idMedia`);
+ALTER TABLE `video_files` ADD KEY `path` (`path`(255));
+
+-- the duplicates were counted in the watched episodes
+DELETE FROM `watch_stats`;
+INSERT INTO `watch_stats` (idUser, idShow, season, watchedEpisodes)
+SELECT s.idUser, e.idShow, IFNULL(e.season, 0), COUNT(*) FROM status s INNER JOIN episodes e ON (e.idEpisode = s.idMedia)
+WHERE s.mediaType = 1 AND s.watchCount > 0 AND e.idShow IS NOT NULL GROUP BY s.idUser, e.idShow, IFNULL(e.season, 0);
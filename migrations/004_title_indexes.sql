@@ -0,0 +1,3 @@
+-- the listings are sorted and paginated on (title, id)
+ALTER TABLE `movies` ADD KEY `title` (`title`);
+ALTER TABLE `tv_shows` ADD KEY `title` (`title`);
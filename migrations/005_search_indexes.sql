@@ -0,0 +1,6 @@
+-- full-text indexes used by app/search.py
+-- the short words are searched as title prefixes (tv_shows and movies have a title key since 004)
+ALTER TABLE `episodes` ADD KEY `title` (`title`), ADD FULLTEXT KEY `search` (`title`,`overview`);
+ALTER TABLE `tv_shows` ADD FULLTEXT KEY `search` (`title`,`overview`);
+ALTER TABLE `movies` ADD FULLTEXT KEY `search` (`title`,`overview`);
+ALTER TABLE `people` ADD KEY `name` (`name`), ADD FULLTEXT KEY `search` (`name`);
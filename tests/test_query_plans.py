@@ -0,0 +1,286 @@
+"""
+run EXPLAIN on the queries of the api against a seeded database, and fail on full table scans
+the tests are skipped if TEST_DB_HOST is not set, the database TEST_DB_NAME (default: zogwine_test) is recreated
+    TEST_DB_HOST=localhost TEST_DB_USER=root TEST_DB_PASSWORD=pass python -m pytest tests
+"""
+import os
+import re
+import ast
+import sys
+import random
+import pytest
+
+mysql = pytest.importorskip("mysql.connector")
+
+_root = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, _root)
+
+from app.listing import listQuery
+from app.search import searchMediaQuery, linkedMediaQuery
+
+_modules = [
+    "app/tvs.py",
+    "app/movie.py",
+    "app/core.py",
+    "app/player.py",
+    "app/watchStats.py",
+    "app/search.py",
+]
+_dbName = os.environ.get("TEST_DB_NAME", "zogwine_test")
+
+# a table scan estimated to read this many rows fails the test
+_maxScanRows = 1000
+# queries that read whole tables on purpose (listings, cache refresh, statistics, search by date)
+_fullScans = [
+    "SELECT icon",
+    "SELECT COUNT(DISTINCT idShow) AS tvsCount",
+    "SELECT COUNT(*) AS movCount FROM movies;",
+    "SELECT DISTINCT name FROM tags",
+    "FROM movie_collections t ORDER BY title;",
+    "FROM movies t WHERE multipleResults IS NULL ORDER BY title, idMovie;",
+    "WHERE premiered",
+]
+# listings of the api: module, columns, table, id field
+_listings = [
+    ("app/tvs.py", "_showColumns", "tv_shows t", "t.idShow"),
+    ("app/movie.py", "_movieColumns", "movies t", "idMovie"),
+]
+
+
+class _queryVisitor(ast.NodeVisitor):
+    # collect the sql strings given to cursor.execute, with the default value of the variables used to build them
+    def __init__(self):
+        self.queries = []
+        self._vars = [{}]
+        # module level dicts of columns, given to selectFields
+        self._columns = {}
+
+    def visit_FunctionDef(self, node):
+        self._vars.append({})
+        self.generic_visit(node)
+        self._vars.pop()
+
+    def visit_Assign(self, node):
+        if len(self._vars) == 1 and isinstance(node.value, ast.Dict):
+            columns = {
+                self._eval(k): self._eval(v)
+                for k, v in zip(node.value.keys, node.value.values)
+            }
+            if all(k is not None and v is not None for k, v in columns.items()):
+                for t in node.targets:
+                    if isinstance(t, ast.Name):
+                        self._columns[t.id] = columns
+        for t in node.targets:
+            # the first value of a variable is the default fragment of the query
+            if isinstance(t, ast.Name) and t.id not in self._vars[-1]:
+                self._vars[-1][t.id] = self._eval(node.value)
+        self.generic_visit(node)
+
+    def visit_Call(self, node):
+        if (
+            isinstance(node.func, ast.Attribute)
+            and node.func.attr == "execute"
+            and len(node.args) > 0
+        ):
+            self.queries.append((node.lineno, self._eval(node.args[0])))
+        self.generic_visit(node)
+
+    def _eval(self, node):
+        # returns None if the value is not known statically
+        if isinstance(node, ast.Constant) and isinstance(node.value, str):
+            return node.value
+        if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Add):
+            left = self._eval(node.left)
+            right = self._eval(node.right)
+            if left is None or right is None:
+                return None
+            return left + right
+        if isinstance(node, ast.Name):
+            return self._vars[-1].get(node.id)
+        if isinstance(node, ast.Call) and getattr(node.func, "id", None) == "str":
+            return "1"
+        if (
+            isinstance(node, ast.Call)
+            and getattr(node.func, "id", None) == "selectFields"
+            and getattr(node.args[0], "id", None) in self._columns
+        ):
+            # all the fields are selected by default
+            return ", ".join(self._columns[node.args[0].id].values())
+        return None
+
+
+def _visit(module: str) -> _queryVisitor:
+    with open(os.path.join(_root, module)) as f:
+        visitor = _queryVisitor()
+        visitor.visit(ast.parse(f.read()))
+    return visitor
+
+
+def _getBuiltQueries() -> list:
+    # queries built at runtime, with the builders used by the api
+    queries = []
+    for module, columns, table, idField in _listings:
+        columns = _visit(module)._columns[columns]
+        for name, limit, after in [
+            ("", None, None),
+            (":page", 50, None),
+            (":after", 50, ["title", 1]),
+            (":afterNull", 50, [None, 1]),
+        ]:
+            sql = listQuery(
+                columns, table, idField, "multipleResults IS NULL", None, limit, after
+            )
+            queries.append((module + ":listQuery" + name, sql))
+    # full-text words and short words searched as prefixes, with and without the cap
+    for name, text in [("searchMediaQuery", "title"), ("searchMediaQuery:prefix", "t")]:
+        for limit in [1000, None]:
+            sql = searchMediaQuery(text, [1, 2, 3], limit)[0]
+            queries.append((name + (":capped" if limit else ""), sql))
+    for table, field in [("tags_link", "idTag"), ("people_link", "idPers")]:
+        for allIds in [True, False]:
+            sql = linkedMediaQuery(table, field, [1, 2], allIds)[0]
+            queries.append(("linkedMediaQuery:" + table + (":all" if allIds else ""), sql))
+    return queries
+
+
+def _getQueries():
+    queries = []
+    for module in _modules:
+        for line, sql in _visit(module).queries:
+            queries.append(pytest.param(sql, id=module + ":" + str(line)))
+    for name, sql in _getBuiltQueries():
+        queries.append(pytest.param(sql, id=name))
+    return queries
+
+
+def _seed(cursor):
+    random.seed(0)
+    users = 10
+    shows = 200
+    movies = 2000
+    cursor.executemany(
+        "INSERT INTO users (idUser, name, user, password) VALUES (%s, %s, %s, '');",
+        [(i, "user" + str(i), "user" + str(i)) for i in range(1, users + 1)],
+    )
+    cursor.executemany(
+        "INSERT INTO tv_shows (idShow, title, path, forceUpdate, premiered) VALUES (%s, %s, %s, 0, %s);",
+        [(i, "show" + str(i), "show" + str(i), str(1980 + i % 40) + "-01-01") for i in range(1, shows + 1)],
+    )
+    cursor.executemany(
+        "INSERT INTO seasons (idShow, season, title, forceUpdate) VALUES (%s, %s, %s, 0);",
+        [(i, s, "season" + str(s)) for i in range(1, shows + 1) for s in range(1, 6)],
+    )
+    cursor.executemany(
+        "INSERT INTO movie_collections (idCollection, title, scraperName, scraperID, forceUpdate) VALUES (%s, %s, 'tmdb', %s, 0);",
+        [(i, "collection" + str(i), i) for i in range(1, 101)],
+    )
+
+    videos = []
+    episodes = []
+    for i in range(1, shows + 1):
+        for s in range(1, 6):
+            for e in range(1, 11):
+                idEpisode = len(episodes) + 1
+                episodes.append((idEpisode, "episode" + str(idEpisode), s, e, i, idEpisode))
+                videos.append((idEpisode, 1, "show" + str(i) + "/S" + str(s) + "/E" + str(e) + ".mkv"))
+    for i in range(1, movies + 1):
+        videos.append((len(videos) + 1, 3, "movie" + str(i) + ".mkv"))
+    cursor.executemany(
+        "INSERT INTO video_files (idVid, mediaType, path, duration, extension, audio, size) VALUES (%s, %s, %s, 1000, 'mkv', '[]', 1000);",
+        videos,
+    )
+    cursor.executemany(
+        "INSERT INTO episodes (idEpisode, title, season, episode, idShow, idVid, forceUpdate) VALUES (%s, %s, %s, %s, %s, %s, 0);",
+        episodes,
+    )
+    cursor.executemany(
+        "INSERT INTO movies (idMovie, title, idCollection, idVid, premiered, forceUpdate) VALUES (%s, %s, %s, %s, %s, 0);",
+        [
+            (i, "movie" + str(i), i % 100 + 1, len(episodes) + i, str(1980 + i % 40) + "-01-01")
+            for i in range(1, movies + 1)
+        ],
+    )
+
+    status = []
+    for u in range(1, users + 1):
+        for e in random.sample(range(1, len(episodes) + 1), 2500):
+            status.append((u, 1, e, 1))
+        for m in random.sample(range(1, movies + 1), 500):
+            status.append((u, 3, m, 1))
+    cursor.executemany(
+        "INSERT INTO status (idUser, mediaType, idMedia, watchCount, watchTime) VALUES (%s, %s, %s, %s, 0);",
+        status,
+    )
+
+    cursor.executemany(
+        "INSERT INTO tags (idTag, name, value) VALUES (%s, 'genre', %s);",
+        [(i, "genre" + str(i)) for i in range(1, 501)],
+    )
+    cursor.executemany(
+        "INSERT INTO people (idPers, name, forceUpdate) VALUES (%s, %s, 0);",
+        [(i, "person" + str(i)) for i in range(1, 5001)],
+    )
+    for count, insert in [
+        (500, "INSERT INTO tags_link (idTag, idMedia, mediaType) VALUES (%s, %s, %s);"),
+        (5000, "INSERT INTO people_link (idPers, idMedia, mediaType, role) VALUES (%s, %s, %s, 'actor');"),
+    ]:
+        links = []
+        for mediaType, medias in [(1, len(episodes)), (2, shows), (3, movies)]:
+            for m in range(1, medias + 1):
+                links.append((random.randint(1, count), m, mediaType))
+        cursor.executemany(insert, links)
+
+    with open(os.path.join(_root, "migrations/002_watch_stats.sql")) as f:
+        for statement in _splitSql(f.read()):
+            if not statement.startswith("CREATE"):
+                cursor.execute(statement)
+
+
+def _splitSql(sql: str) -> list:
+    lines = [l for l in sql.split("\n") if not l.startswith("--")]
+    return [s.strip() for s in "\n".join(lines).split(";\n") if s.strip() != ""]
+
+
+@pytest.fixture(scope="module")
+def cursor():
+    if "TEST_DB_HOST" not in os.environ:
+        pytest.skip("TEST_DB_HOST is not set")
+    connection = mysql.connector.connect(
+        host=os.environ["TEST_DB_HOST"],
+        port=int(os.environ.get("TEST_DB_PORT", 3306)),
+        user=os.environ.get("TEST_DB_USER", "root"),
+        password=os.environ.get("TEST_DB_PASSWORD", ""),
+    )
+    cursor = connection.cursor(dictionary=True, buffered=True)
+    with open(os.path.join(_root, "database.sql")) as f:
+        schema = f.read().replace("`zogwine`", "`" + _dbName + "`")
+    for statement in _splitSql(schema):
+        cursor.execute(statement)
+    _seed(cursor)
+    connection.commit()
+    cursor.execute("SHOW TABLES;")
+    for t in cursor.fetchall():
+        cursor.execute("ANALYZE TABLE `" + list(t.values())[0] + "`;")
+        cursor.fetchall()
+
+    yield cursor
+
+    cursor.execute("DROP DATABASE `" + _dbName + "`;")
+    connection.close()
+
+
+@pytest.mark.parametrize("sql", _getQueries())
+def test_query_plan(cursor, sql):
+    if sql is None:
+        pytest.skip("query built at runtime")
+    if not re.match(r"\s*(SELECT|UPDATE|DELETE|INSERT INTO \S+ \([^)]*\) SELECT)", sql):
+        pytest.skip("nothing to explain")
+
+    # the parameters are strings, so that the indexes of the text columns can be used
+    explain = re.sub(r"(LIMIT|OFFSET) (%\(\w+\)s|%s)", r"\1 1", sql)
+    cursor.execute("EXPLAIN " + re.sub(r"%\(\w+\)s|%s", "'1'", explain))
+    for row in cursor.fetchall():
+        if row["type"] == "ALL" and int(row["rows"] or 0) >= _maxScanRows:
+            assert any(f in sql for f in _fullScans), (
+                "full scan of " + str(row["table"]) + " (" + str(row["rows"]) + " rows)"
+            )